@@ -1,13 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, stream_with_context
 from functools import wraps
+import logging
 import os
 import random
 import string
 import json
-from datetime import datetime, timedelta
+import base64
+import uuid
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from werkzeug.middleware.proxy_fix import ProxyFix
+from markupsafe import escape
+from chat_feed import ConversationFeed
+from events import HeldRequests, create_broker, event_stream
+from supabase import Client
+from passwords import HashingBusy, hash_password, needs_rehash, start_pool, verify_password
+from progress_buffer import ProgressViewBuffer
+from log_config import configure_logging, log_payload
+from instrumentation import QueryInstrumentation, instrument_client, query_observers
+from metrics import Metrics
+from notifications import Notifications
+from unread_counts import UnreadCountCache
+from profiling import RequestProfiler
+from offline_backend import OfflineClient
+from sql_backend import HybridClient, PostgresReadBackend
+from rate_limit import RateLimiter, Rule, create_buckets
+from ttl_store import create_store
+from users_sync import UsersSync, user_row
+from supabase_clients import ClientPool, create_http_client, create_service_client, create_supabase_client
 # from realtime import AuthorizationError, NotConnectedError # This import seems incorrect based on the error
 
 def format_datetime(value, format='%b %d, %Y %I:%M %p'):
@@ -140,28 +160,42 @@ def parse_quiz_questions(quiz_text):
 
 
 def get_unread_notifications_count(user_id, user_role):
-    """Calculate the number of unread notifications for a user"""
-    try:
-        # This would typically query a notifications table in a real app
-        # For now, return a sample count based on user role
-        if user_role == 'student':
-            return 3  # Sample unread count for students
-        elif user_role == 'teacher':
-            return 5  # Sample unread count for teachers
-        else:  # admin
-            return 2  # Sample unread count for admins
-    except Exception as e:
-        print(f"Error calculating unread notifications: {str(e)}")
-        return 0
+    """Unread notifications for a user, cached for UNREAD_COUNT_TTL seconds"""
+    return notification_unread_counts.get(user_id)
+
+
+def get_unread_messages_count(user_id):
+    """Unread chat messages across a user's conversations, cached like the notification count"""
+    return chat_unread_counts.get(user_id)
+
+
+def load_unread_messages_count(user_id):
+    result = supabase.table('conversation_participants').select('unread_count').eq('user_id', user_id).execute()
+    return sum(row['unread_count'] or 0 for row in result.data or [])
 
 
 # Load environment variables
 load_dotenv()
 
+# Password hashing runs in worker processes; fork them before any background thread starts
+start_pool()
+
+# Leveled logging through a background writer thread (LOG_LEVEL / LOG_LEVELS / LOG_FORMAT)
+configure_logging()
+logger = logging.getLogger('app')
+# Development OTP delivery; set LOG_LEVELS=app.otp=WARNING once real email is wired up
+otp_logger = logging.getLogger('app.otp')
+
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', os.urandom(24).hex())
 
+# Behind nginx (or a load balancer) every request comes from the proxy's address; trust that many
+# hops of X-Forwarded-For/-Proto/-Host so request.remote_addr is the client's, e.g. for the per-IP rate limit
+trusted_proxies = int(os.getenv('TRUSTED_PROXIES', '0'))
+if trusted_proxies > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies, x_proto=trusted_proxies, x_host=trusted_proxies)
+
 # Register the custom filters
 app.jinja_env.filters['youtube_id'] = youtube_id_filter
 app.jinja_env.filters['parse_quiz_questions'] = parse_quiz_questions
@@ -172,23 +206,177 @@ app.jinja_env.filters['datetimeformat'] = format_datetime  # Add datetimeformat
 
 @app.context_processor
 def inject_unread_count():
-    """Inject unread notifications count into all templates"""
+    """Inject unread notification and chat message counts into all templates"""
     if 'user_id' in session and 'role' in session:
         user_id = session.get('user_id')
         user_role = session.get('role')
-        unread_count = get_unread_notifications_count(user_id, user_role)
-        return {'unread_count': unread_count}
-    return {'unread_count': 0}
+        return {'unread_count': get_unread_notifications_count(user_id, user_role),
+                'chat_unread_count': get_unread_messages_count(user_id)}
+    return {'unread_count': 0, 'chat_unread_count': 0}
 
 # Initialize Supabase client
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_KEY')
-supabase: Client = create_client(supabase_url, supabase_key)
+data_backend = os.getenv('DATA_BACKEND', 'supabase')
+
+if data_backend == 'offline':
+    # Local SQLite stand-in built from the schema files, for load tests and profiling
+    # without a Supabase project; privileged writes use the same client
+    supabase = OfflineClient(os.getenv('OFFLINE_DATABASE', ':memory:'))
+    service_clients = ClientPool(lambda: supabase, size=int(os.getenv('SUPABASE_SERVICE_POOL_SIZE', '4')))
+else:
+    # One keep-alive connection pool shared by every Supabase client in this worker
+    # (limits, HTTP/2 and timeouts come from the SUPABASE_POOL_*/SUPABASE_*TIMEOUT settings)
+    supabase_http = create_http_client()
+    supabase: Client = create_supabase_client(supabase_url, supabase_key, http_client=supabase_http)
+
+    # With DATA_BACKEND=postgres, plain reads on the hottest tables skip PostgREST and
+    # go straight to Postgres through a connection pool; everything else is unchanged
+    if data_backend == 'postgres':
+        supabase = HybridClient(
+            supabase,
+            PostgresReadBackend(os.getenv('DATABASE_URL'), maxconn=int(os.getenv('DATABASE_POOL_SIZE', '10'))),
+            tables=os.getenv('DATABASE_READ_TABLES', 'enrollments,tasks,progress').split(',')
+        )
+
+    # Pool of service-role clients for privileged writes, so nothing has to toggle RLS
+    supabase_service_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+    if not supabase_service_key:
+        logger.warning("SUPABASE_SERVICE_ROLE_KEY is not set, privileged writes will use SUPABASE_KEY")
+    service_clients = ClientPool(lambda: instrument_client(create_service_client(supabase_url,
+                                                                                 supabase_service_key or supabase_key,
+                                                                                 http_client=supabase_http)),
+                                 size=int(os.getenv('SUPABASE_SERVICE_POOL_SIZE', '4')))
+
+# Time every backend query: Server-Timing header, optional debug panel and per-route query budgets
+supabase = instrument_client(supabase)
+query_instrumentation = QueryInstrumentation(app)
+
+# Buffer first-view progress rows and write them in the background
+progress_view_buffer = ProgressViewBuffer(service_clients, flush_interval=float(os.getenv('PROGRESS_FLUSH_INTERVAL', '5')))
+progress_view_buffer.start()
+
+# Make sure every profile has a users row, in the background instead of on every login
+users_sync = UsersSync(service_clients, interval=float(os.getenv('USERS_SYNC_INTERVAL', '3600')))
+users_sync.start()
+
+# Notifications are written per recipient when something happens; unread counts are kept by a trigger
+notifier = Notifications(service_clients)
+NOTIFICATIONS_PAGE_SIZE = 20
+# Chat history is shown this many messages at a time, older pages load on scroll
+MESSAGES_PAGE_SIZE = 50
+
+# Unread badges are rendered on every page; keep each user's counts in memory for a short while
+# and drop them whenever something changes them
+unread_count_ttl = float(os.getenv('UNREAD_COUNT_TTL', '30'))
+notification_unread_counts = UnreadCountCache('notification_unread', notifier.unread_count, ttl=unread_count_ttl)
+chat_unread_counts = UnreadCountCache('chat_unread', load_unread_messages_count, ttl=unread_count_ttl)
+
+# Live updates for open pages over /events; use a redis:// broker when running several workers
+event_broker = create_broker(os.getenv('EVENTS_BROKER_URL', 'memory://'))
+EVENTS_HEARTBEAT = float(os.getenv('EVENTS_HEARTBEAT', '15'))
+EVENTS_MAX_DURATION = float(os.getenv('EVENTS_MAX_DURATION', '300'))
+# /events streams and waiting chat polls each hold a worker thread; past this many per worker they are
+# turned away and told to come back after HELD_REQUESTS_RETRY_AFTER seconds, leaving threads for pages
+held_requests = HeldRequests(int(os.getenv('HELD_REQUESTS_PER_WORKER', '8')))
+HELD_REQUESTS_RETRY_AFTER = 30
+
+# Open conversations long-poll /api/chat/get_messages; a poll with nothing new waits on the broker
+# instead of querying the database
+conversation_feed = ConversationFeed(event_broker)
+CHAT_POLL_TIMEOUT = float(os.getenv('CHAT_POLL_TIMEOUT', '25'))
+CHAT_POLL_BATCH = 200
+# Base URL of the optional WebSocket gateway (python chat_gateway.py), e.g. ws://localhost:8765
+CHAT_GATEWAY_URL = os.getenv('CHAT_GATEWAY_URL', '')
+# Sending a message echoes the sender's name and notifies the other participants; both change rarely,
+# so keep them in memory instead of looking them up on every send
+chat_lookup_ttl = float(os.getenv('CHAT_LOOKUP_TTL', '300'))
+profile_summaries = create_store('memory://', 'profile_summary', default_ttl=chat_lookup_ttl)
+conversation_members = create_store('memory://', 'conversation_members', default_ttl=chat_lookup_ttl)
+CHAT_SEARCH_PAGE_SIZE = 20
+
+
+def publish_to_users(user_ids, event, data):
+    """Push an event to the users' open /events streams"""
+    try:
+        event_broker.publish_many([f'user:{user_id}' for user_id in user_ids], event, data)
+    except Exception as e:
+        logger.error("Error publishing %s event: %s", event, e)
+
+
+def notify_users(user_ids, **notification):
+    """Send a notification without failing the request that triggered it"""
+    try:
+        user_ids = [user_id for user_id in user_ids if user_id]
+        notifier.notify(user_ids, **notification)
+        notification_unread_counts.invalidate_many(user_ids)
+        publish_to_users(user_ids, 'notification', notification)
+    except Exception as e:
+        logger.error("Error sending %s notification: %s", notification.get('type'), e)
 
-# Store OTPs in memory (in production, use Redis or database)
-otp_storage = {}
+
+def notify_new_module(course, module_title):
+    """Tell every student actively enrolled in the course about a new module"""
+    try:
+        student_ids = notifier.course_student_ids(course['id'])
+    except Exception as e:
+        logger.error("Error loading students to notify about a new module: %s", e)
+        return
+    notify_users(student_ids, type='module', title='New Module Available',
+                 message=f'A new module "{module_title}" has been added to "{course["title"]}".',
+                 course_id=course['id'], course_name=course['title'],
+                 link=url_for('course_modules', course_id=course['id']))
+
+# Pending signup OTPs and password reset codes expire after OTP_TTL seconds. The default
+# memory:// store is per process; use sqlite:/// or redis:// with more than one worker
+token_store_url = os.getenv('TOKEN_STORE_URL', 'memory://')
+token_store_options = {
+    'default_ttl': int(os.getenv('OTP_TTL', '600')),
+    'max_entries': int(os.getenv('TOKEN_STORE_MAX_ENTRIES', '10000')),
+    'sweep_interval': float(os.getenv('TOKEN_STORE_SWEEP_INTERVAL', '60')),
+}
+otp_storage = create_store(token_store_url, 'otp', **token_store_options)
 # Store password reset tokens separately
-password_reset_storage = {}
+password_reset_storage = create_store(token_store_url, 'password_reset', **token_store_options)
+
+# Token buckets per client IP and per email on the login, signup, OTP and reset routes;
+# shared between workers through the same kind of store as the OTPs
+rate_limiter = RateLimiter(
+    create_buckets(os.getenv('RATE_LIMIT_STORE_URL', token_store_url)),
+    ip_rule=Rule.parse('ip', os.getenv('RATE_LIMIT_PER_IP', '30/300')),
+    email_rule=Rule.parse('email', os.getenv('RATE_LIMIT_PER_EMAIL', '10/300')),
+    enabled=os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+)
+
+# Prometheus metrics at /metrics: request latency per endpoint, backend queries per table,
+# in-flight requests and the size of the OTP stores
+metrics = Metrics(app)
+query_observers.append(metrics.observe_query)
+metrics.callback_gauge('lms_token_store_entries', 'Entries held in the OTP and password reset stores',
+                       lambda: {('otp_storage',): len(otp_storage),
+                                ('password_reset_storage',): len(password_reset_storage)}, ('store',))
+rate_limited_requests = metrics.counter('lms_rate_limited_total', 'Requests rejected by the rate limiter',
+                                        ('endpoint', 'scope'))
+rate_limiter.observers.append(rate_limited_requests.inc)
+metrics.callback_gauge('lms_progress_views_pending', 'Progress views waiting to be flushed',
+                       progress_view_buffer.pending)
+for unread_counts in (notification_unread_counts, chat_unread_counts):
+    metrics.register_cache(unread_counts.name, unread_counts.stats)
+metrics.callback_gauge('lms_event_streams_open', 'Open /events streams in this worker',
+                       event_broker.subscriber_count)
+metrics.callback_gauge('lms_held_requests', 'Event streams and chat polls holding a thread in this worker',
+                       held_requests.held)
+
+# Opt-in cProfile sampling of requests; slow ones are listed at /admin/profiles
+request_profiler = RequestProfiler(app)
+
+def upsert_user_row(profile):
+    """Create the users row for a new profile; users_sync retries it if this fails"""
+    try:
+        supabase.table('users').upsert(user_row(profile), on_conflict='id', ignore_duplicates=True).execute()
+    except Exception as e:
+        logger.error("Error adding user to users table: %s", e)
+
 
 def generate_otp(length=6):
     """Generate a random numeric OTP of given length"""
@@ -270,8 +458,7 @@ def index():
                                  recent_activity=recent_activity)
 
         except Exception as e:
-            import traceback
-            print(f"Error loading dashboard: {str(e)}\n{traceback.format_exc()}")
+            logger.exception("Error loading dashboard: %s", e)
             flash('Could not load dashboard data. Please try again later.', 'error')
             # Render a fallback dashboard with minimal data
             return render_template('dashboard.html', username=username, courses=[], enrolled_courses=0, completed_courses=0, total_hours=0, enrolled_course_details=[], average_score=0, completion_rate=0, leaderboard_rank='N/A', upcoming_tasks=[], recent_activity=[])
@@ -280,6 +467,7 @@ def index():
 
 
 @app.route('/signup', methods=['GET', 'POST'])
+@rate_limiter.limited
 def signup():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -303,8 +491,9 @@ def signup():
         
         # Check if this is OTP verification step
         if 'verifying_otp' in session and session['verifying_otp']:
-            stored_otp = otp_storage.get(email, {}).get('otp')
-            expiry_time = otp_storage.get(email, {}).get('expiry')
+            pending = otp_storage.get(email, {})
+            stored_otp = pending.get('otp')
+            expiry_time = pending.get('expiry')
             
             if not stored_otp or datetime.now() > datetime.fromisoformat(expiry_time):
                 flash('OTP has expired. Please try again.', 'error')
@@ -321,7 +510,7 @@ def signup():
             
             # OTP verified, proceed with user creation
             try:
-                password_hash = generate_password_hash(password)
+                password_hash = hash_password(password)
                 # Insert into profiles table
                 profile_data = {
                     'name': username,
@@ -332,22 +521,8 @@ def signup():
                 result = supabase.table('profiles').insert(profile_data).execute()
                 
                 if result.data and len(result.data) > 0:
-                    # Get the new user's ID
-                    user_id = result.data[0]['id']
-                    
                     # Also add to users table
-                    try:
-                        user_data = {
-                            'id': user_id,
-                            'email': email,
-                            'full_name': username,
-                            'created_at': datetime.utcnow().isoformat(),
-                            'updated_at': datetime.utcnow().isoformat()
-                        }
-                        supabase.table('users').insert(user_data).execute()
-                    except Exception as e:
-                        print(f"Error adding user to users table: {str(e)}")
-                        # Continue with signup even if users table update fails
+                    upsert_user_row(result.data[0])
                 
                 # Clean up
                 session.pop('verifying_otp', None)
@@ -370,19 +545,17 @@ def signup():
             
             # Generate and store OTP
             otp = generate_otp()
-            expiry = (datetime.now() + timedelta(minutes=10)).isoformat()  # OTP valid for 10 minutes
+            expiry = (datetime.now() + timedelta(seconds=otp_storage.default_ttl)).isoformat()
+            # Only the hash is kept until the account is created
             otp_storage[email] = {
                 'otp': otp,
                 'expiry': expiry,
                 'username': username,
-                'password': password
+                'password_hash': hash_password(password)
             }
             
             # In production, you would send the OTP via email/SMS here
-            print(f"\n{'='*50}")
-            print(f"OTP for {email}: {otp}")
-            print(f"Expires at: {expiry}")
-            print("="*50 + "\n")
+            otp_logger.info("OTP for %s: %s (expires %s)", email, otp, expiry)
             
             # Set session to indicate we're verifying OTP
             session['verifying_otp'] = True
@@ -398,6 +571,7 @@ def signup():
     return render_template('signup.html')
 
 @app.route('/resend-otp', methods=['POST'])
+@rate_limiter.limited
 def resend_otp():
     email = request.form.get('email')
     if not email:
@@ -406,25 +580,18 @@ def resend_otp():
     
     # Generate new OTP
     otp = generate_otp()
-    print(otp)
-    expiry = (datetime.now() + timedelta(minutes=10)).isoformat()
+    expiry = (datetime.now() + timedelta(seconds=otp_storage.default_ttl)).isoformat()
     
-    if email in otp_storage:
-        otp_storage[email].update({
-            'otp': otp,
-            'expiry': expiry
-        })
-    else:
-        otp_storage[email] = {
-            'otp': otp,
-            'expiry': expiry
-        }
+    # Keep the pending signup details and restart the expiry
+    pending = otp_storage.get(email, {})
+    pending.update({
+        'otp': otp,
+        'expiry': expiry
+    })
+    otp_storage[email] = pending
     
     # In production, send the OTP via email/SMS
-    print(f"\n{'='*50}")
-    print(f"NEW OTP for {email}: {otp}")
-    print(f"Expires at: {expiry}")
-    print("="*50 + "\n")
+    otp_logger.info("New OTP for %s: %s (expires %s)", email, otp, expiry)
     
     session['verifying_otp'] = True
     flash('New verification code sent!', 'info')
@@ -432,6 +599,7 @@ def resend_otp():
 
 
 @app.route('/verify-otp/<email>', methods=['GET', 'POST'])
+@rate_limiter.limited
 def verify_otp(email):
     if request.method == 'POST':
         otp = request.form.get('otp')
@@ -441,8 +609,9 @@ def verify_otp(email):
             return redirect(url_for('verify_otp', email=email))
         
         # Verify OTP
-        stored_otp = otp_storage.get(email, {}).get('otp')
-        expiry_time = otp_storage.get(email, {}).get('expiry')
+        pending = otp_storage.get(email, {})
+        stored_otp = pending.get('otp')
+        expiry_time = pending.get('expiry')
         
         if not stored_otp or datetime.now() > datetime.fromisoformat(expiry_time):
             flash('OTP has expired. Please request a new one.', 'error')
@@ -455,21 +624,21 @@ def verify_otp(email):
         
         # OTP verified, get user data and create account
         try:
-            user_data = otp_storage.get(email, {})
-            username = user_data.get('username')
-            password = user_data.get('password')
+            username = pending.get('username')
+            password_hash = pending.get('password_hash')
             
-            if not username or not password:
+            if not username or not password_hash:
                 flash('Session expired. Please try signing up again.', 'error')
                 return redirect(url_for('signup'))
             
-            password_hash = generate_password_hash(password)
             result = supabase.table('profiles').insert({
                 'name': username,
                 'email': email,
                 'password_hash': password_hash,
                 'role': 'student'
             }).execute()
+            if result.data:
+                upsert_user_row(result.data[0])
             
             # Clean up
             otp_storage.pop(email, None)
@@ -491,6 +660,7 @@ def verify_otp(email):
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limited
 def login():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -508,27 +678,19 @@ def login():
                 user = result.data[0]
                 
                 # Verify password
-                if check_password_hash(user['password_hash'], password):
+                if verify_password(user['password_hash'], password):
                     user_id = str(user['id'])
-                    
-                    # Check if user exists in users table, if not create
-                    try:
-                        user_check = supabase.table('users').select('id').eq('id', user_id).execute()
-                        if not user_check.data:
-                            # Create user in users table
-                            user_data = {
-                                'id': user_id,
-                                'email': user['email'],
-                                'full_name': user.get('name', ''),
-                                'created_at': datetime.utcnow().isoformat(),
-                                'updated_at': datetime.utcnow().isoformat()
-                            }
-                            supabase.table('users').insert(user_data).execute()
-                    except Exception as e:
-                        print(f"Error syncing user to users table: {str(e)}")
-                        import traceback
-                        print(traceback.format_exc())
-                    
+
+                    # Upgrade hashes made with older parameters while the password is at hand
+                    if needs_rehash(user['password_hash']):
+                        try:
+                            with service_clients.checkout() as admin_client:
+                                admin_client.table('profiles').update({
+                                    'password_hash': hash_password(password)
+                                }).eq('id', user_id).execute()
+                        except Exception as e:
+                            logger.error("Error rehashing password for user %s: %s", user_id, e)
+
                     # Set session variables
                     session['user_id'] = user_id
                     session['username'] = user['name']
@@ -544,7 +706,10 @@ def login():
             else:
                 flash('Invalid email or password.', 'error')
                 return redirect(url_for('login'))
-                
+
+        except HashingBusy as e:
+            flash(str(e), 'error')
+            return redirect(url_for('login'))
         except Exception as e:
             flash(f'An error occurred: {str(e)}', 'error')
             return redirect(url_for('login'))
@@ -823,7 +988,7 @@ def course_detail(course_id):
                     'last_activity': 'Recently' if last_activity else 'No activity yet'
                 }
         except Exception as e:
-            print(f"Error calculating progress: {str(e)}")
+            logger.error("Error calculating progress: %s", e)
             progress = {
                 'completed_lessons': 0,
                 'total_lessons': 0,
@@ -1046,8 +1211,9 @@ def course_task(course_id, module_id, task_id):
 
         task = task_result.data[0]
 
-        # Debug: Print task data to see what's available
-        print(f"Task data: {task}")
+        # Quiz tasks carry their answer key, so only the identifying fields are ever dumped
+        log_payload(logger, "Task loaded", task_id=task.get('id'), task_type=task.get('type'),
+                    module_id=task.get('module_id'))
 
         # Ensure task has all required fields
         if not hasattr(task, 'get') or 'type' not in task:
@@ -1080,45 +1246,19 @@ def course_task(course_id, module_id, task_id):
         if task.get('type') == 'quiz':
             # Check both 'quiz_data' and 'quiz_content' fields, with fallback to description
             quiz_content = task.get('quiz_data') or task.get('quiz_content') or task.get('description', '')
-            
-            # Debug output
-            print(f"Quiz content from DB: {quiz_content}")
-            
+
             # If we have quiz content, try to parse it to ensure it's valid
             if quiz_content:
                 try:
                     questions = parse_quiz_questions(quiz_content)
-                    print(f"Successfully parsed {len(questions)} questions from quiz data")
+                    logger.debug("Parsed %d questions for quiz task %s", len(questions), task_id)
                 except Exception as e:
-                    print(f"Error parsing quiz data: {str(e)}")
+                    logger.error("Error parsing quiz data for task %s: %s", task_id, e)
                     quiz_content = None
 
-        # Initialize or update task progress when starting
+        # Record the first view; the row is written later by the view buffer
         if not task_progress:
-            # Create initial progress record
-            try:
-                supabase.table('progress').insert({
-                    'student_id': user_id,
-                    'course_id': course_id,
-                    'module_id': module_id,
-                    'task_id': task_id,
-                    'status': 'in_progress'
-                }).execute()
-            except Exception as e:
-                # If RLS policy fails, try with admin bypass
-                try:
-                    supabase.rpc('disable_rls_for_admin', params={}).execute()
-                    supabase.table('progress').insert({
-                        'student_id': user_id,
-                        'course_id': course_id,
-                        'module_id': module_id,
-                        'task_id': task_id,
-                        'status': 'in_progress'
-                    }).execute()
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                    raise e
+            progress_view_buffer.record_view(user_id, course_id, module_id, task_id)
             task_progress = {'status': 'in_progress', 'completion_percentage': 0}
 
         return render_template('course_task.html',
@@ -1148,13 +1288,19 @@ def complete_task(course_id, module_id, task_id):
             flash('You must be enrolled in this course.', 'error')
             return redirect(url_for('course_task', course_id=course_id, module_id=module_id, task_id=task_id))
 
-        # Update task progress to completed
+        # Upsert rather than update: the first view may still be buffered here or in another worker,
+        # and its insert does nothing once this row exists
         from datetime import datetime
-        supabase.table('progress').update({
+        supabase.table('progress').upsert({
+            'student_id': user_id,
+            'course_id': course_id,
+            'module_id': module_id,
+            'task_id': task_id,
             'status': 'completed',
             'completion_percentage': 100,
             'completed_at': datetime.utcnow().isoformat(),  # type: ignore
-        }).filter('student_id', 'eq', user_id).filter('task_id', 'eq', task_id).execute()
+        }, on_conflict='student_id,task_id').execute()
+        progress_view_buffer.discard(user_id, task_id)
 
         flash('Task completed successfully!', 'success')
         return redirect(url_for('course_task', course_id=course_id, module_id=module_id, task_id=task_id))
@@ -1176,35 +1322,32 @@ def enroll_course(course_id):
             flash('You are already enrolled in this course.', 'info')
             return redirect(url_for('course_detail', course_id=course_id))
 
-        # Find course title by ID
+        # Find course title and teacher by ID
         course_title = "Course"
+        teacher_id = None
         try:
-            result = supabase.table('courses').select('title').filter('id', 'eq', course_id).execute()
+            result = supabase.table('courses').select('title, teacher_uuid').filter('id', 'eq', course_id).execute()
             if result.data and len(result.data) > 0:
                 course_title = result.data[0]['title']
+                teacher_id = result.data[0].get('teacher_uuid')
         except:
             course_title = "Course"
 
         # Insert enrollment record
-        try:
-            supabase.table('enrollments').insert({
+        with service_clients.checkout() as admin_client:
+            admin_client.table('enrollments').insert({
                 'student_id': user_id,
                 'course_id': course_id,
                 'status': 'active'
             }).execute()
-        except Exception as e:
-            # If RLS policy fails, try with admin bypass
-            try:
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-                supabase.table('enrollments').insert({
-                    'student_id': user_id,
-                    'course_id': course_id,
-                    'status': 'active'
-                }).execute()
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
-            except:
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
-                raise e
+
+        course_link = url_for('course_detail', course_id=course_id)
+        notify_users([user_id], type='enrollment', title='Course Enrollment Confirmed',
+                     message=f'You have successfully enrolled in "{course_title}".', priority='low',
+                     course_id=course_id, course_name=course_title, link=course_link)
+        notify_users([teacher_id], type='enrollment', title='New Student Enrollment',
+                     message=f'{session.get("username") or "A student"} has enrolled in your course "{course_title}".',
+                     course_id=course_id, course_name=course_title, link=course_link)
 
         flash(f'Successfully enrolled in {course_title}!', 'success')
         return redirect(url_for('course_detail', course_id=course_id))
@@ -1229,17 +1372,8 @@ def unenroll_course(course_id):
             course_title = "Course"
 
         # Remove enrollment record
-        try:
-            supabase.table('enrollments').delete().filter('student_id', 'eq', user_id).filter('course_id', 'eq', course_id).execute()
-        except Exception as e:
-            # If RLS policy fails, try with admin bypass
-            try:
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-                supabase.table('enrollments').delete().filter('student_id', 'eq', user_id).filter('course_id', 'eq', course_id).execute()
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
-            except:
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
-                raise e
+        with service_clients.checkout() as admin_client:
+            admin_client.table('enrollments').delete().filter('student_id', 'eq', user_id).filter('course_id', 'eq', course_id).execute()
 
         flash(f'Successfully unenrolled from {course_title}.', 'success')
         return redirect(url_for('course_detail', course_id=course_id))
@@ -1266,8 +1400,7 @@ def profile():
             return redirect(url_for('dashboard'))
     except Exception as e:
         flash(f'Error fetching profile: {str(e)}', 'error')
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Error fetching profile: %s", e)
         return redirect(url_for('dashboard'))
 
 
@@ -1296,12 +1429,12 @@ def edit_profile():
                     flash('New passwords do not match.', 'error')
                     return redirect(url_for('edit_profile'))
                 
-                if not check_password_hash(result.data[0]['password_hash'], current_password):
+                if not verify_password(result.data[0]['password_hash'], current_password):
                     flash('Current password is incorrect.', 'error')
                     return redirect(url_for('edit_profile'))
                 
                 # Update password
-                password_hash = generate_password_hash(new_password)
+                password_hash = hash_password(new_password)
                 supabase.table('profiles').update({'password_hash': password_hash}).eq('id', user_id).execute()
                 flash('Password updated successfully!', 'success')
 
@@ -1310,6 +1443,7 @@ def edit_profile():
                 'name': name,
                 'email': email
             }).eq('id', user_id).execute()
+            profile_summaries.pop(str(user_id))
 
             # Update session
             session['username'] = name
@@ -1330,8 +1464,7 @@ def edit_profile():
 
     except Exception as e:
         flash(f'Error updating profile: {str(e)}', 'error')
-        import traceback
-        print(traceback.format_exc())
+        logger.exception("Error updating profile: %s", e)
         return redirect(url_for('profile'))
 
 
@@ -1343,6 +1476,7 @@ def logout():
 
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
+@rate_limiter.limited
 def forgot_password():
     if request.method == 'POST':
         email = request.form.get('email')
@@ -1360,17 +1494,14 @@ def forgot_password():
 
             # Generate and store password reset OTP
             reset_otp = generate_otp()
-            expiry = (datetime.now() + timedelta(minutes=10)).isoformat()
+            expiry = (datetime.now() + timedelta(seconds=password_reset_storage.default_ttl)).isoformat()
             password_reset_storage[email] = {
                 'otp': reset_otp,
                 'expiry': expiry
             }
 
             # In production, you would send the OTP via email/SMS here
-            print(f"\n{'='*50}")
-            print(f"PASSWORD RESET OTP for {email}: {reset_otp}")
-            print(f"Expires at: {expiry}")
-            print("="*50 + "\n")
+            otp_logger.info("Password reset OTP for %s: %s (expires %s)", email, reset_otp, expiry)
 
             flash('Password reset code sent to your email!', 'info')
             return redirect(url_for('verify_reset_otp', email=email))
@@ -1383,6 +1514,7 @@ def forgot_password():
 
 
 @app.route('/verify-reset-otp/<email>', methods=['GET', 'POST'])
+@rate_limiter.limited
 def verify_reset_otp(email):
     if request.method == 'POST':
         otp = request.form.get('otp')
@@ -1392,8 +1524,9 @@ def verify_reset_otp(email):
             return redirect(url_for('verify_reset_otp', email=email))
 
         # Verify password reset OTP
-        stored_otp = password_reset_storage.get(email, {}).get('otp')
-        expiry_time = password_reset_storage.get(email, {}).get('expiry')
+        pending = password_reset_storage.get(email, {})
+        stored_otp = pending.get('otp')
+        expiry_time = pending.get('expiry')
 
         if not stored_otp or datetime.now() > datetime.fromisoformat(expiry_time):
             flash('Reset code has expired. Please request a new one.', 'error')
@@ -1417,6 +1550,7 @@ def verify_reset_otp(email):
 
 
 @app.route('/resend-reset-otp', methods=['POST'])
+@rate_limiter.limited
 def resend_reset_otp():
     email = request.form.get('email')
     if not email:
@@ -1425,30 +1559,22 @@ def resend_reset_otp():
 
     # Generate new password reset OTP
     reset_otp = generate_otp()
-    expiry = (datetime.now() + timedelta(minutes=10)).isoformat()
+    expiry = (datetime.now() + timedelta(seconds=password_reset_storage.default_ttl)).isoformat()
 
-    if email in password_reset_storage:
-        password_reset_storage[email].update({
-            'otp': reset_otp,
-            'expiry': expiry
-        })
-    else:
-        password_reset_storage[email] = {
-            'otp': reset_otp,
-            'expiry': expiry
-        }
+    password_reset_storage[email] = {
+        'otp': reset_otp,
+        'expiry': expiry
+    }
 
     # In production, send the OTP via email/SMS
-    print(f"\n{'='*50}")
-    print(f"NEW PASSWORD RESET OTP for {email}: {reset_otp}")
-    print(f"Expires at: {expiry}")
-    print("="*50 + "\n")
+    otp_logger.info("New password reset OTP for %s: %s (expires %s)", email, reset_otp, expiry)
 
     flash('New reset code sent!', 'info')
     return redirect(url_for('verify_reset_otp', email=email))
 
 
 @app.route('/set-new-password/<email>', methods=['GET', 'POST'])
+@rate_limiter.limited
 def set_new_password(email):
     if request.method == 'POST':
         new_password = request.form.get('new_password')
@@ -1475,7 +1601,7 @@ def set_new_password(email):
                 return redirect(url_for('forgot_password'))
 
             # Hash new password and update
-            new_password_hash = generate_password_hash(new_password)
+            new_password_hash = hash_password(new_password)
             supabase.table('profiles').update({
                 'password_hash': new_password_hash
             }).filter('email', 'eq', email).execute()
@@ -2219,8 +2345,7 @@ def teachers_progress():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('teachers_dashboard'))
 
 
@@ -2304,8 +2429,7 @@ def teachers_grading():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('teachers_dashboard'))
 
 
@@ -2384,6 +2508,11 @@ def teachers_grade_submission(submission_id):
 
             supabase.table('submissions').update(update_data).eq('id', submission_id).execute()
 
+            notify_users([submission['student_id']], type='grade', title='Assignment Graded',
+                         message=f'Your assignment "{task.get("title")}" has been graded. You scored {grade_float:g}/100.',
+                         priority='high', course_id=course.get('id'), course_name=course.get('title'),
+                         link=url_for('student_grades'))
+
             flash(f'Assignment graded successfully! Grade: {grade_float}%', 'success')
             return redirect(url_for('teacher_grading'))
 
@@ -2397,8 +2526,7 @@ def teachers_grade_submission(submission_id):
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('teachers_dashboard'))
 
 
@@ -2445,6 +2573,8 @@ def teachers_add_module(course_id):
                     'estimated_time': estimated_time
                 }).execute()
 
+                notify_new_module(course, title)
+
                 flash(f'Module "{title}" added successfully!', 'success')
                 return redirect(url_for('teachers_course_modules', course_id=course_id))
 
@@ -2878,6 +3008,31 @@ def admin_users():
         return redirect(url_for('admin_dashboard'))
 
 
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    profiles = request_profiler.list_profiles()
+    return render_template('admin_profiles.html',
+                         profiles=profiles,
+                         profiler=request_profiler,
+                         username=session.get('username'))
+
+
+@app.route('/admin/profiles/<profile_id>')
+@admin_required
+def admin_profile_detail(profile_id):
+    report = request_profiler.profile_report(profile_id, sort=request.args.get('sort', 'cumulative'))
+    if report is None:
+        flash('Profile not found.', 'error')
+        return redirect(url_for('admin_profiles'))
+    return render_template('admin_profiles.html',
+                         profiles=request_profiler.list_profiles(),
+                         profiler=request_profiler,
+                         profile_id=profile_id,
+                         report=report,
+                         username=session.get('username'))
+
+
 @app.route('/admin/users/edit/<user_id>', methods=['GET', 'POST'])
 @admin_required
 def admin_edit_user(user_id):
@@ -2916,6 +3071,7 @@ def admin_edit_user(user_id):
                 'email': email,
                 'role': role
             }).filter('id', user_id).execute()
+            profile_summaries.pop(str(user_id))
 
             flash('User updated successfully!', 'success')
             return redirect(url_for('admin_users'))
@@ -3284,30 +3440,22 @@ def admin_add_module(course_id):
                                      username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Insert new module
-                result = supabase.table('modules').insert({
-                    'course_id': course_id,
-                    'title': title,
-                    'description': description,
-                    'order_index': int(order_index),
-                    'estimated_time': estimated_time
-                }).execute()
+                with service_clients.checkout() as admin_client:
+                    result = admin_client.table('modules').insert({
+                        'course_id': course_id,
+                        'title': title,
+                        'description': description,
+                        'order_index': int(order_index),
+                        'estimated_time': estimated_time
+                    }).execute()
 
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                notify_new_module(course, title)
 
                 flash(f'Module "{title}" added successfully!', 'success')
                 return redirect(url_for('admin_course_modules', course_id=course_id))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error creating module: {str(e)}', 'error')
                 return render_template('admin_add_module.html',
                                      course=course,
@@ -3583,7 +3731,8 @@ def admin_edit_task(task_id):
             else:
                 resource_link = current_resource_link
 
-            print(f"DEBUG: Edit task - form_resource_link='{form_resource_link}', current_resource_link='{current_resource_link}', final_resource_link='{resource_link}'")
+            logger.debug("Edit task %s resource link: form=%r current=%r final=%r", task_id,
+                         form_resource_link, current_resource_link, resource_link)
             is_mandatory = request.form.get('is_mandatory') == 'on'
 
             # Handle quiz-specific settings
@@ -3618,9 +3767,6 @@ def admin_edit_task(task_id):
                                      username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Prepare task data
                 update_data = {
                     'title': title,
@@ -3667,22 +3813,15 @@ def admin_edit_task(task_id):
                         'require_replies': require_replies
                     })
 
-                print(f"DEBUG: Updating task with data: {update_data}")
-                result = supabase.table('tasks').update(update_data).eq('id', task_id).execute()
-                print(f"DEBUG: Update result: {result}")
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                log_payload(logger, "Updating task", task_id=task_id, update_data=update_data)
+                with service_clients.checkout() as admin_client:
+                    result = admin_client.table('tasks').update(update_data).eq('id', task_id).execute()
+                logger.debug("Updated task %s (%d rows)", task_id, len(result.data or []))
 
                 flash(f'Task "{title}" updated successfully!', 'success')
                 return redirect(url_for('admin_module_tasks', module_id=module['id']))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error updating task: {str(e)}', 'error')
                 return render_template('admin_edit_task.html',
                                      task=task,
@@ -3774,9 +3913,6 @@ def admin_add_task(module_id):
                                      username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Prepare task data
                 task_data = {
                     'module_id': module_id,
@@ -3817,20 +3953,13 @@ def admin_add_task(module_id):
                     })
 
                 # Insert new test
-                supabase.table('tests').insert(test_data).execute()
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                with service_clients.checkout() as admin_client:
+                    admin_client.table('tests').insert(test_data).execute()
 
                 flash(f'Test "{title}" added successfully!', 'success')
                 return redirect(url_for('teachers_module_tasks', module_id=module_id))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error creating task: {str(e)}', 'error')
                 return render_template('admin_add_task.html',
                                      module=module,
@@ -3870,7 +3999,7 @@ def admin_add_user():
                                  username=session.get('username'))
 
         # Hash password and create user
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password(password)
 
         try:
             # Insert new user
@@ -3993,6 +4122,16 @@ def submit_assignment(task_id):
                         supabase.table('submissions').insert(submission_data).execute()
                         flash('Assignment submitted successfully!', 'success')
 
+                    if course_id:
+                        course_result = supabase.table('courses').select('title, teacher_uuid').filter('id', 'eq', course_id).execute()
+                        if course_result.data:
+                            course_info = course_result.data[0]
+                            notify_users([course_info.get('teacher_uuid')], type='submission',
+                                         title='Assignment Resubmitted' if submission else 'New Assignment Submission',
+                                         message=f'{session.get("username") or "A student"} has submitted "{task["title"]}".',
+                                         priority='high', course_id=course_id, course_name=course_info['title'],
+                                         link=url_for('teachers_grading'))
+
                     return redirect(url_for('my_submissions'))
 
                 else:
@@ -4146,8 +4285,7 @@ def admin_grading():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('teacher_dashboard' if user_role == 'teacher' else 'admin_dashboard'))
 
 
@@ -4301,8 +4439,7 @@ def admin_progress():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/course/<course_id>/analytics')
@@ -4509,8 +4646,7 @@ def course_analytics(course_id):
     
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('admin_progress'))
         return redirect(url_for('admin_dashboard'))
 
@@ -4587,6 +4723,11 @@ def admin_grade_submission(submission_id):
 
             supabase.table('submissions').update(update_data).eq('id', submission_id).execute()
 
+            notify_users([submission['student_id']], type='grade', title='Assignment Graded',
+                         message=f'Your assignment "{task.get("title")}" has been graded. You scored {grade_float:g}/100.',
+                         priority='high', course_id=course.get('id'), course_name=course.get('title'),
+                         link=url_for('student_grades'))
+
             flash(f'Assignment graded successfully! Grade: {grade_float}%', 'success')
             return redirect(url_for('course_analytics', course_id=course.get('id', '')))
 
@@ -4600,8 +4741,7 @@ def admin_grade_submission(submission_id):
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('admin_dashboard'))
 
 
@@ -4667,8 +4807,7 @@ def student_grades():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('dashboard'))
 
 
@@ -4707,9 +4846,6 @@ def admin_add_test(module_id):
                                     username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Prepare test data
                 test_data = {
                     'module_id': module_id,
@@ -4728,20 +4864,13 @@ def admin_add_test(module_id):
                 }
 
                 # Insert new test
-                supabase.table('tests').insert(test_data).execute()
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                with service_clients.checkout() as admin_client:
+                    admin_client.table('tests').insert(test_data).execute()
 
                 flash(f'Test "{title}" added successfully!', 'success')
                 return redirect(url_for('teachers_module_tasks', module_id=module_id))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error creating test: {str(e)}', 'error')
                 return render_template('admin_add_test.html',
                                     module=module,
@@ -4834,9 +4963,6 @@ def admin_edit_test(test_id):
                                     username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Prepare test data
                 update_data = {
                     'title': title,
@@ -4852,20 +4978,13 @@ def admin_edit_test(test_id):
                 }
 
                 # Update the test
-                supabase.table('tests').update(update_data).eq('id', test_id).execute()
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                with service_clients.checkout() as admin_client:
+                    admin_client.table('tests').update(update_data).eq('id', test_id).execute()
 
                 flash(f'Test "{title}" updated successfully!', 'success')
                 return redirect(url_for('teachers_module_tasks', module_id=module['id']))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except Exception as e:
-                    pass
                 flash(f'Error updating test: {str(e)}', 'error')
                 return render_template('admin_edit_test.html',
                                     test=test,
@@ -4952,27 +5071,17 @@ def admin_delete_test(test_id):
 
         test = test_result.data[0]
         
-        # Temporarily disable RLS for admin operations
-        supabase.rpc('disable_rls_for_admin', params={}).execute()
-        
-        # Delete test questions first (if they exist)
-        supabase.table('questions').delete().eq('test_id', test_id).execute()
-        
-        # Delete the test
-        supabase.table('tests').delete().eq('id', test_id).execute()
-        
-        # Re-enable RLS
-        supabase.rpc('enable_rls_for_admin', params={}).execute()
+        with service_clients.checkout() as admin_client:
+            # Delete test questions first (if they exist)
+            admin_client.table('questions').delete().eq('test_id', test_id).execute()
+
+            # Delete the test
+            admin_client.table('tests').delete().eq('id', test_id).execute()
         
         flash(f'Test "{test["title"]}" deleted successfully!', 'success')
         return redirect(url_for('admin_module_tests', module_id=test['module_id']))
 
     except Exception as e:
-        # Make sure to re-enable RLS if there's an error
-        try:
-            supabase.rpc('enable_rls_for_admin', params={}).execute()
-        except Exception as e:
-            print(f"Error re-enabling RLS: {str(e)}")
         flash(f'Error deleting test: {str(e)}', 'error')
         return redirect(url_for('admin_courses'))
 
@@ -5032,9 +5141,6 @@ def admin_add_question(test_id):
                                     username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Get next order index
                 questions_result = supabase.table('questions').select('order_index').eq('test_id', test_id).order('order_index', desc=True).execute()
                 next_order = (questions_result.data[0]['order_index'] + 1) if questions_result.data else 1
@@ -5051,20 +5157,13 @@ def admin_add_question(test_id):
                 }
 
                 # Insert new question
-                supabase.table('questions').insert(question_data).execute()
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                with service_clients.checkout() as admin_client:
+                    admin_client.table('questions').insert(question_data).execute()
 
                 flash(f'Question added successfully!', 'success')
                 return redirect(url_for('admin_manage_test', test_id=test_id))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error creating question: {str(e)}', 'error')
                 return render_template('admin_add_question.html',
                                     test=test,
@@ -5141,9 +5240,6 @@ def admin_edit_question(question_id):
                                     username=session.get('username'))
 
             try:
-                # Temporarily disable RLS for admin operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Prepare question data
                 update_data = {
                     'question_text': question_text,
@@ -5154,20 +5250,13 @@ def admin_edit_question(question_id):
                 }
 
                 # Update the question
-                supabase.table('questions').update(update_data).eq('id', question_id).execute()
-
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
+                with service_clients.checkout() as admin_client:
+                    admin_client.table('questions').update(update_data).eq('id', question_id).execute()
 
                 flash(f'Question updated successfully!', 'success')
                 return redirect(url_for('admin_manage_test', test_id=test['id']))
 
             except Exception as e:
-                # Make sure to re-enable RLS if there's an error
-                try:
-                    supabase.rpc('enable_rls_for_admin', params={}).execute()
-                except:
-                    pass
                 flash(f'Error updating question: {str(e)}', 'error')
                 return render_template('admin_edit_question.html',
                                     question=question,
@@ -5200,24 +5289,14 @@ def admin_delete_question(question_id):
         question = question_result.data[0]
         test_id = question['test_id']
         
-        # Temporarily disable RLS for admin operations
-        supabase.rpc('disable_rls_for_admin', params={}).execute()
-        
         # Delete the question
-        supabase.table('questions').delete().eq('id', question_id).execute()
-        
-        # Re-enable RLS
-        supabase.rpc('enable_rls_for_admin', params={}).execute()
+        with service_clients.checkout() as admin_client:
+            admin_client.table('questions').delete().eq('id', question_id).execute()
         
         flash(f'Question deleted successfully!', 'success')
         return redirect(url_for('admin_manage_test', test_id=test_id))
 
     except Exception as e:
-        # Make sure to re-enable RLS if there's an error
-        try:
-            supabase.rpc('enable_rls_for_admin', params={}).execute()
-        except Exception as e:
-            pass
         flash(f'Error deleting question: {str(e)}', 'error')
         return redirect(url_for('admin_courses'))
 
@@ -5299,9 +5378,6 @@ def course_test(course_id, module_id, test_id):
         # If no in-progress attempt, create one
         if not in_progress_attempt:
             try:
-                # Temporarily disable RLS for test operations
-                supabase.rpc('disable_rls_for_admin', params={}).execute()
-
                 # Create new attempt with required fields from schema
                 attempt_data = {
                     'student_id': user_id,
@@ -5317,13 +5393,11 @@ def course_test(course_id, module_id, test_id):
                     'updated_at': datetime.now().isoformat()
                 }
 
-                attempt_result = supabase.table('quiz_attempts').insert(attempt_data).execute()
+                with service_clients.checkout() as admin_client:
+                    attempt_result = admin_client.table('quiz_attempts').insert(attempt_data).execute()
                 if attempt_result.data:
                     in_progress_attempt = attempt_result.data[0]
 
-                # Re-enable RLS
-                supabase.rpc('enable_rls_for_admin', params={}).execute()
-
             except Exception as e:
                 flash(f'Error starting test: {str(e)}', 'error')
                 return redirect(url_for('course_modules', course_id=course_id))
@@ -5366,7 +5440,6 @@ def submit_quiz_attempt(course_id, module_id, test_id):
         return response
 
     try:
-        print(f"Starting quiz submission for test {test_id} by user {session.get('user_id')}")
         user_id = session.get('user_id')
         
         # Get JSON data with error handling
@@ -5377,10 +5450,7 @@ def submit_quiz_attempt(course_id, module_id, test_id):
         if not data:
             return jsonify({'success': False, 'message': 'No data received'}), 400
             
-        print(f"Received data: {data}")
-        
         # Find the quiz task for this module
-        print(f"Looking for quiz task for module {module_id}")
         task_result = supabase.table('tasks') \
             .select('id') \
             .eq('module_id', module_id) \
@@ -5388,14 +5458,12 @@ def submit_quiz_attempt(course_id, module_id, test_id):
             .execute()
             
         if not task_result.data:
-            print(f"No quiz task found for module {module_id}")
+            logger.warning("Quiz submission for module %s without a quiz task", module_id)
             return jsonify({'success': False, 'message': 'No quiz task found for this module'}), 404
             
         task_id = task_result.data[0]['id']
-        print(f"Found quiz task ID: {task_id}")
-        
+
         # Get the latest attempt for this user and task
-        print(f"Looking for active quiz attempt for user {user_id} and task {task_id}")
         attempt_result = supabase.table('quiz_attempts') \
             .select('*') \
             .eq('student_id', user_id) \
@@ -5405,11 +5473,10 @@ def submit_quiz_attempt(course_id, module_id, test_id):
             .execute()
             
         if not attempt_result.data:
-            print("No active quiz attempt found")
+            logger.info("No active quiz attempt for user %s and task %s", user_id, task_id)
             return jsonify({'success': False, 'message': 'No active quiz attempt found'}), 400
             
         attempt = attempt_result.data[0]
-        print(f"Found attempt: {attempt['id']}")
         
         # Update the attempt with the submitted answers
         update_data = {
@@ -5420,7 +5487,6 @@ def submit_quiz_attempt(course_id, module_id, test_id):
         
         # Calculate score if all answers are submitted
         if 'answers' in data:
-            print("Calculating score...")
             # Get the correct answers
             questions_result = supabase.table('questions') \
                 .select('id, correct_answer') \
@@ -5428,16 +5494,14 @@ def submit_quiz_attempt(course_id, module_id, test_id):
                 .execute()
                 
             if not questions_result.data:
-                print("No questions found for this test")
+                logger.warning("Quiz submission for test %s without questions", test_id)
                 return jsonify({'success': False, 'message': 'No questions found for this test'}), 400
                 
             correct_answers = {str(q['id']): q['correct_answer'] for q in questions_result.data}
-            print(f"Correct answers: {correct_answers}")
             
             # Calculate score
             correct_count = 0
             user_answers = data['answers']
-            print(f"User answers: {user_answers}")
             
             for q_id, answer in user_answers.items():
                 if q_id in correct_answers and answer == correct_answers[q_id]:
@@ -5453,10 +5517,15 @@ def submit_quiz_attempt(course_id, module_id, test_id):
                 'passed': score >= 70  # Assuming 70% is passing
             })
             
-            print(f"Score calculated: {score}% ({correct_count}/{total_questions} correct)")
+            logger.info("Quiz attempt scored", extra={'attempt_id': attempt['id'], 'test_id': test_id,
+                                                      'score': score, 'correct': correct_count,
+                                                      'total': total_questions})
         
         # Mark the quiz task as completed in progress table
         try:
+            # The row is written below, so a buffered first view is no longer needed
+            progress_view_buffer.discard(user_id, task_id)
+
             # Check if progress record exists for this user and task
             progress_result = supabase.table('progress') \
                 .select('*') \
@@ -5487,7 +5556,7 @@ def submit_quiz_attempt(course_id, module_id, test_id):
                 }).execute()
 
         except Exception as progress_error:
-            print(f"Warning: Could not update progress table: {str(progress_error)}")
+            logger.warning("Could not update progress table: %s", progress_error)
             # Don't fail the submission if progress update fails
         
         response = jsonify({
@@ -5504,14 +5573,11 @@ def submit_quiz_attempt(course_id, module_id, test_id):
         return response
         
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"Error in submit_quiz_attempt: {str(e)}\n{error_trace}")
+        logger.exception("Error in submit_quiz_attempt: %s", e)
         response = jsonify({
             'success': False, 
             'message': 'An error occurred while processing your submission',
-            'error': str(e),
-            'trace': error_trace
+            'error': str(e)
         })
         response.headers.add('Access-Control-Allow-Origin', request.headers.get('Origin', '*'))
         response.headers.add('Access-Control-Allow-Credentials', 'true')
@@ -5525,140 +5591,23 @@ def submit_quiz_attempt(course_id, module_id, test_id):
 def notifications():
     try:
         user_id = session.get('user_id')
-        user_role = session.get('role')
 
-        # Sample notifications data - in a real app, this would come from a notifications table
-        notifications_list = []
-
-        if user_role == 'student':
-            # Student notifications
-            notifications_list = [
-                {
-                    'id': 1,
-                    'type': 'grade',
-                    'title': 'Assignment Graded',
-                    'message': 'Your assignment "Final Project" has been graded. You scored 85/100.',
-                    'course_name': 'Computer Science Basics',
-                    'timestamp': '2024-01-15T10:30:00Z',
-                    'read': False,
-                    'priority': 'high',
-                    'icon': 'fa-graduation-cap'
-                },
-                {
-                    'id': 2,
-                    'type': 'deadline',
-                    'title': 'Upcoming Deadline',
-                    'message': 'Assignment "Machine Learning Project" is due in 2 days.',
-                    'course_name': 'Data Science Fundamentals',
-                    'timestamp': '2024-01-14T14:20:00Z',
-                    'read': False,
-                    'priority': 'medium',
-                    'icon': 'fa-clock'
-                },
-                {
-                    'id': 3,
-                    'type': 'enrollment',
-                    'title': 'Course Enrollment Confirmed',
-                    'message': 'You have successfully enrolled in "Advanced Python Programming".',
-                    'course_name': 'Advanced Python Programming',
-                    'timestamp': '2024-01-13T09:15:00Z',
-                    'read': True,
-                    'priority': 'low',
-                    'icon': 'fa-check-circle'
-                },
-                {
-                    'id': 4,
-                    'type': 'quiz',
-                    'title': 'Quiz Completed',
-                    'message': 'You have completed the quiz "Python Basics Quiz 3" with a score of 92%.',
-                    'course_name': 'Python Programming',
-                    'timestamp': '2024-01-12T16:45:00Z',
-                    'read': True,
-                    'priority': 'low',
-                    'icon': 'fa-clipboard-check'
-                },
-                {
-                    'id': 5,
-                    'type': 'announcement',
-                    'title': 'New Module Available',
-                    'message': 'A new module "Web Development with Flask" has been added to your course.',
-                    'course_name': 'Full Stack Development',
-                    'timestamp': '2024-01-11T11:00:00Z',
-                    'read': False,
-                    'priority': 'medium',
-                    'icon': 'fa-bullhorn'
-                }
-            ]
-        elif user_role == 'teacher':
-            # Teacher notifications
-            notifications_list = [
-                {
-                    'id': 1,
-                    'type': 'submission',
-                    'title': 'New Assignment Submission',
-                    'message': 'Student John Doe has submitted "Final Project" assignment.',
-                    'course_name': 'Computer Science Basics',
-                    'student_name': 'John Doe',
-                    'timestamp': '2024-01-15T11:30:00Z',
-                    'read': False,
-                    'priority': 'high',
-                    'icon': 'fa-file-upload'
-                },
-                {
-                    'id': 2,
-                    'type': 'enrollment',
-                    'title': 'New Student Enrollment',
-                    'message': '3 new students have enrolled in your course "Data Science Fundamentals".',
-                    'course_name': 'Data Science Fundamentals',
-                    'timestamp': '2024-01-14T15:20:00Z',
-                    'read': False,
-                    'priority': 'medium',
-                    'icon': 'fa-user-plus'
-                },
-                {
-                    'id': 3,
-                    'type': 'review',
-                    'title': 'Pending Reviews',
-                    'message': 'You have 5 assignments waiting for grading in "Machine Learning".',
-                    'course_name': 'Machine Learning',
-                    'timestamp': '2024-01-13T10:15:00Z',
-                    'read': True,
-                    'priority': 'high',
-                    'icon': 'fa-clipboard-list'
-                }
-            ]
-        else:  # admin
-            # Admin notifications
-            notifications_list = [
-                {
-                    'id': 1,
-                    'type': 'system',
-                    'title': 'System Maintenance',
-                    'message': 'Scheduled maintenance will occur tonight from 2:00 AM to 4:00 AM EST.',
-                    'timestamp': '2024-01-15T08:00:00Z',
-                    'read': False,
-                    'priority': 'high',
-                    'icon': 'fa-cog'
-                },
-                {
-                    'id': 2,
-                    'type': 'user',
-                    'title': 'New User Registration',
-                    'message': 'New instructor "Dr. Smith" has registered and is pending approval.',
-                    'timestamp': '2024-01-14T13:30:00Z',
-                    'read': False,
-                    'priority': 'medium',
-                    'icon': 'fa-user-check'
-                }
-            ]
+        # Newest first; ?before=<cursor of the last item> loads the next page
+        try:
+            notifications_list, next_cursor = notifier.list(user_id, limit=NOTIFICATIONS_PAGE_SIZE,
+                                                            before=request.args.get('before'))
+        except ValueError:
+            flash('That page of notifications could not be found', 'error')
+            return redirect(url_for('notifications'))
 
         # Calculate notification statistics
         total_notifications = len(notifications_list)
-        unread_count = len([n for n in notifications_list if not n['read']])
+        unread_count = notifier.unread_count(user_id)
         high_priority_count = len([n for n in notifications_list if n['priority'] == 'high'])
 
         return render_template('notifications.html',
                              notifications=notifications_list,
+                             next_cursor=next_cursor,
                              total_notifications=total_notifications,
                              unread_count=unread_count,
                              high_priority_count=high_priority_count,
@@ -5666,18 +5615,40 @@ def notifications():
 
     except Exception as e:
         flash(f'An error occurred: {str(e)}', 'error')
+        logger.exception("Error in %s: %s", request.endpoint, e)
         return redirect(url_for('dashboard'))
 
 
-@app.route('/notifications/<int:notification_id>/read', methods=['POST'])
+@app.route('/events')
+@login_required
+def events():
+    """Server-Sent Events stream of the user's new notifications and chat messages"""
+    if not held_requests.acquire():
+        # EventSource gives up on a 503; live_events.js reconnects after Retry-After
+        return Response(status=503, headers={'Retry-After': str(HELD_REQUESTS_RETRY_AFTER)})
+    try:
+        subscription = event_broker.subscribe(f"user:{session.get('user_id')}")
+        stream = event_stream(subscription, heartbeat=EVENTS_HEARTBEAT, max_duration=EVENTS_MAX_DURATION)
+        response = Response(stream_with_context(stream), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    except Exception:
+        held_requests.release()
+        raise
+    # Released when the server closes the response, whether or not the stream was ever read
+    response.call_on_close(held_requests.release)
+    return response
+
+
+@app.route('/notifications/<notification_id>/read', methods=['POST'])
 @login_required
 def mark_notification_read(notification_id):
     """Mark a specific notification as read"""
     try:
-        # In a real app, this would update the database
-        # For now, we'll just return success
+        if notifier.mark_read(session.get('user_id'), notification_id):
+            notification_unread_counts.invalidate(session.get('user_id'))
         return jsonify({'success': True, 'message': 'Notification marked as read'})
     except Exception as e:
+        logger.error("Error marking notification as read: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -5686,10 +5657,11 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read"""
     try:
-        # In a real app, this would update the database
-        # For now, we'll just return success
+        notifier.mark_all_read(session.get('user_id'))
+        notification_unread_counts.invalidate(session.get('user_id'))
         return jsonify({'success': True, 'message': 'All notifications marked as read'})
     except Exception as e:
+        logger.error("Error marking all notifications as read: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 @app.route('/landing')
 def landing():
@@ -5754,14 +5726,19 @@ def chat_conversation(conversation_id):
             flash('Conversation not found', 'error')
             return redirect(url_for('chat'))
 
-        messages = get_conversation_messages(conversation_id)
+        messages, older_cursor = get_conversation_messages(conversation_id)
+        newest_cursor = latest_message_cursor(messages)
+        conversation_feed.seen(conversation_id, newest_cursor)
 
-        # Mark messages as read
-        mark_messages_as_read(conversation_id, user_id)
+        # Mark the messages shown as read
+        mark_messages_as_read(conversation_id, user_id, newest_cursor)
 
         return render_template('chat_conversation.html',
                              conversation=conversation,
                              messages=messages,
+                             older_cursor=older_cursor,
+                             newest_cursor=newest_cursor,
+                             chat_gateway_url=CHAT_GATEWAY_URL,
                              current_user={'id': user_id, 'role': user_role, 'username': session.get('username')})
 
     except Exception as e:
@@ -5783,24 +5760,55 @@ def send_message():
 
         user_id = session.get('user_id')
 
-        # Save message to database (mock implementation)
-        message_id = save_message(conversation_id, user_id, message_content)
+        # The insert returns the stored message, so there is nothing to read back
+        message = save_message(conversation_id, user_id, message_content)
+        if message is None:
+            return jsonify({'success': False, 'message': 'Failed to send message'}), 500
 
-        # Get the message details for response
-        message = get_message(message_id)
+        return jsonify({'success': True, 'message': message})
 
-        return jsonify({
-            'success': True,
-            'message': {
-                'id': message['id'],
-                'content': message['content'],
-                'sender_id': message['sender_id'],
-                'timestamp': message['timestamp'].isoformat() if hasattr(message['timestamp'], 'isoformat') else str(message['timestamp']),
-                'sender_name': message['sender_name']
-            }
-        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/chat/conversations/<conversation_id>/messages')
+@login_required
+def conversation_history(conversation_id):
+    """Older messages of a conversation, a page at a time: ?before=<cursor>&limit=<n>"""
+    try:
+        user_id = session.get('user_id')
+        if not can_access_conversation(conversation_id, user_id):
+            return jsonify({'success': False, 'message': 'Access denied'}), 403
+
+        limit = max(1, min(request.args.get('limit', MESSAGES_PAGE_SIZE, type=int), 200))
+        try:
+            messages, older_cursor = get_conversation_messages(conversation_id, limit=limit,
+                                                               before=request.args.get('before'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+
+        return jsonify({'success': True, 'messages': messages, 'next_cursor': older_cursor})
+
+    except Exception as e:
+        logger.error("Error loading conversation history: %s", e)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/chat/search')
+@login_required
+def search_chat_messages():
+    """Full-text search over the messages of the user's conversations: ?q=<words>&page=<n>"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query or len(query) > 200:
+            return jsonify({'success': False, 'message': 'Enter up to 200 characters to search for'}), 400
+        page = max(1, request.args.get('page', 1, type=int))
+
+        results, has_more = search_messages(session.get('user_id'), query, page)
+        return jsonify({'success': True, 'results': results, 'page': page, 'has_more': has_more})
 
     except Exception as e:
+        logger.error("Error searching messages: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
@@ -5818,16 +5826,12 @@ def create_new_conversation():
 
         user_id = session.get('user_id')
 
-        # Create conversation
-        conversation_id = create_conversation(user_id, participant_ids)
+        # Create conversation, with the initial message if provided
+        conversation_id = create_conversation(user_id, participant_ids, initial_message=initial_message or None)
 
         if not conversation_id:
             return jsonify({'success': False, 'message': 'Failed to create conversation'}), 500
 
-        # Send initial message if provided
-        if initial_message:
-            save_message(conversation_id, user_id, initial_message)
-
         return jsonify({
             'success': True,
             'conversation_id': conversation_id,
@@ -5836,137 +5840,124 @@ def create_new_conversation():
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
-    """API endpoint for getting messages"""
+
+
+@app.route('/api/chat/get_messages/<conversation_id>')
+@login_required
+def get_new_messages(conversation_id):
+    """Chat feed: ?after=<cursor> returns the messages after the cursor, waiting up to ?wait=<seconds>
+    for one to arrive; without a cursor it returns the latest page"""
     try:
         user_id = session.get('user_id')
-
-        # Verify user has access to this conversation
-        if not can_access_conversation(conversation_id, user_id):
+        if not conversation_feed.can_access(conversation_id, user_id, can_access_conversation):
             return jsonify({'success': False, 'message': 'Access denied'}), 403
 
-        messages = get_conversation_messages(conversation_id)
+        after = request.args.get('after')
+        if after is None:
+            messages, older_cursor = get_conversation_messages(conversation_id)
+            cursor = latest_message_cursor(messages)
+            conversation_feed.seen(conversation_id, cursor)
+            return jsonify({'success': True, 'messages': messages, 'cursor': cursor, 'older_cursor': older_cursor})
 
-        return jsonify({
-            'success': True,
-            'messages': [
-                {
-                    'id': msg['id'],
-                    'content': msg['content'],
-                    'sender_id': msg['sender_id'],
-                    'timestamp': msg['timestamp'].isoformat() if hasattr(msg['timestamp'], 'isoformat') else str(msg['timestamp']),
-                    'sender_name': msg['sender_name'],
-                    'is_read': msg.get('is_read', False)
-                }
-                for msg in messages
-            ]
-        })
+        if after:
+            try:
+                decode_message_cursor(after)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 400
+
+        wait = max(0.0, min(request.args.get('wait', 0, type=float), CHAT_POLL_TIMEOUT))
+        if wait and not held_requests.acquire():
+            # No thread to spare for waiting: answer now and have the page poll again later
+            return jsonify({'success': True, 'messages': [], 'cursor': after, 'retry_after': HELD_REQUESTS_RETRY_AFTER})
+        try:
+            ready = conversation_feed.wait(conversation_id, after, wait)
+        finally:
+            if wait:
+                held_requests.release()
+        if not ready:
+            return jsonify({'success': True, 'messages': [], 'cursor': after})
+
+        messages = get_messages_after(conversation_id, after)
+        cursor = latest_message_cursor(messages) or after
+        conversation_feed.seen(conversation_id, cursor)
+        if any(message['sender_id'] != user_id for message in messages):
+            # The conversation is open, so what it shows has been read
+            mark_messages_as_read(conversation_id, user_id, cursor)
+        return jsonify({'success': True, 'messages': messages, 'cursor': cursor})
 
     except Exception as e:
+        logger.error("Error polling conversation messages: %s", e)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 # Helper functions for chat functionality (real database implementations)
+def get_inbox(user_id):
+    """The user's conversations with the other participant, last message preview and unread count, newest first"""
+    # One embedded select; the last message preview is kept on conversations by the messages trigger
+    result = supabase.table('conversation_participants').select('''
+        unread_count,
+        conversations!inner(
+            id,
+            created_at,
+            last_message_at,
+            last_message_preview,
+            last_message_sender_id,
+            conversation_participants(user_id, profiles!conversation_participants_user_id_fkey(id, name))
+        )
+    ''').eq('user_id', user_id).execute()
+
+    inbox = []
+    for item in result.data:
+        conv = item['conversations']
+        others = [participant['profiles'] for participant in conv['conversation_participants']
+                  if participant['user_id'] != user_id and participant.get('profiles')]
+        if not others:
+            continue
+        inbox.append({
+            'id': conv['id'],
+            'participant': others[0],
+            'last_message': conv['last_message_preview'] or 'No messages yet',
+            'last_message_sender_id': conv['last_message_sender_id'],
+            'last_message_time': conv['last_message_at'] or conv['created_at'],
+            'unread_count': item['unread_count'] or 0
+        })
+    inbox.sort(key=lambda conv: conv['last_message_time'] or '', reverse=True)
+    return inbox
+
+
 def get_student_conversations(student_id):
     """Get conversations for a student"""
     try:
-        # Get conversations where student is a participant
-        conversations_result = supabase.table('conversation_participants').select('''
-            conversation_id,
-            conversations!inner(*)
-        ''').eq('user_id', student_id).execute()
-
-        conversations = []
-        for item in conversations_result.data:
-            conv = item['conversations']
-
-            # Get the other participant (teacher) for this conversation
-            other_participant_result = supabase.table('conversation_participants').select('''
-                user_id,
-                profiles!conversation_participants_user_id_fkey(name)
-            ''').eq('conversation_id', conv['id']).neq('user_id', student_id).execute()
-
-            if other_participant_result.data:
-                participant = other_participant_result.data[0]['profiles']
-
-                # Get last message for this conversation
-                last_message_result = supabase.table('messages').select('''
-                    content,
-                    created_at,
-                    profiles!messages_sender_id_fkey(name)
-                ''').eq('conversation_id', conv['id']).order('created_at', desc=True).limit(1).execute()
-
-                last_message = last_message_result.data[0] if last_message_result.data else None
-
-                # Get unread count for this participant
-                unread_result = supabase.table('conversation_participants').select('unread_count').eq('conversation_id', conv['id']).eq('user_id', student_id).execute()
-                unread_count = unread_result.data[0]['unread_count'] if unread_result.data else 0
-
-                conversations.append({
-                    'id': conv['id'],
-                    'teacher_id': participant['id'],
-                    'teacher_name': participant['name'],
-                    'teacher_avatar': f"https://ui-avatars.com/api/?name={participant['name']}&background=667eea&color=fff&size=40",
-                    'last_message': last_message['content'] if last_message else 'No messages yet',
-                    'last_message_time': last_message['created_at'] if last_message else conv['created_at'],
-                    'unread_count': unread_count
-                })
-
-        return conversations
+        return [{
+            'id': conv['id'],
+            'teacher_id': conv['participant']['id'],
+            'teacher_name': conv['participant']['name'],
+            'teacher_avatar': f"https://ui-avatars.com/api/?name={conv['participant']['name']}&background=667eea&color=fff&size=40",
+            'last_message': conv['last_message'],
+            'last_message_time': conv['last_message_time'],
+            'unread_count': conv['unread_count']
+        } for conv in get_inbox(student_id)]
 
     except Exception as e:
-        print(f"Error getting student conversations: {str(e)}")
+        logger.error("Error getting student conversations: %s", e)
         return []
 
 
 def get_teacher_conversations(teacher_id):
     """Get conversations for a teacher"""
     try:
-        # Get conversations where teacher is a participant
-        conversations_result = supabase.table('conversation_participants').select('''
-            conversation_id,
-            conversations!inner(*)
-        ''').eq('user_id', teacher_id).execute()
-
-        conversations = []
-        for item in conversations_result.data:
-            conv = item['conversations']
-
-            # Get the other participant (student) for this conversation
-            other_participant_result = supabase.table('conversation_participants').select('''
-                user_id,
-                profiles!conversation_participants_user_id_fkey(name)
-            ''').eq('conversation_id', conv['id']).neq('user_id', teacher_id).execute()
-
-            if other_participant_result.data:
-                participant = other_participant_result.data[0]['profiles']
-
-                # Get last message for this conversation
-                last_message_result = supabase.table('messages').select('''
-                    content,
-                    created_at,
-                    profiles!messages_sender_id_fkey(name)
-                ''').eq('conversation_id', conv['id']).order('created_at', desc=True).limit(1).execute()
-
-                last_message = last_message_result.data[0] if last_message_result.data else None
-
-                # Get unread count for this participant
-                unread_result = supabase.table('conversation_participants').select('unread_count').eq('conversation_id', conv['id']).eq('user_id', teacher_id).execute()
-                unread_count = unread_result.data[0]['unread_count'] if unread_result.data else 0
-
-                conversations.append({
-                    'id': conv['id'],
-                    'student_id': participant['id'],
-                    'student_name': participant['name'],
-                    'student_avatar': f"https://ui-avatars.com/api/?name={participant['name']}&background=764ba2&color=fff&size=40",
-                    'last_message': last_message['content'] if last_message else 'No messages yet',
-                    'last_message_time': last_message['created_at'] if last_message else conv['created_at'],
-                    'unread_count': unread_count
-                })
-
-        return conversations
+        return [{
+            'id': conv['id'],
+            'student_id': conv['participant']['id'],
+            'student_name': conv['participant']['name'],
+            'student_avatar': f"https://ui-avatars.com/api/?name={conv['participant']['name']}&background=764ba2&color=fff&size=40",
+            'last_message': conv['last_message'],
+            'last_message_time': conv['last_message_time'],
+            'unread_count': conv['unread_count']
+        } for conv in get_inbox(teacher_id)]
 
     except Exception as e:
-        print(f"Error getting teacher conversations: {str(e)}")
+        logger.error("Error getting teacher conversations: %s", e)
         return []
 
 
@@ -5988,44 +5979,171 @@ def get_conversation(conversation_id, user_id):
         return conv_result.data[0]
 
     except Exception as e:
-        print(f"Error getting conversation: {str(e)}")
+        logger.error("Error getting conversation: %s", e)
         return None
 
 
-def get_conversation_messages(conversation_id):
-    """Get messages for a conversation"""
-    try:
-        # Get messages with sender information
-        messages_result = supabase.table('messages').select('''
-            id,
-            content,
-            sender_id,
-            created_at,
-            edited_at,
-            message_type,
-            profiles!messages_sender_id_fkey(name)
-        ''').eq('conversation_id', conversation_id).eq('is_deleted', False).order('created_at', asc=True).execute()
-
-        messages = []
-        for msg in messages_result.data:
-            messages.append({
-                'id': msg['id'],
-                'content': msg['content'],
-                'sender_id': msg['sender_id'],
-                'sender_name': msg['profiles']['name'],
-                'timestamp': msg['created_at'],
-                'is_read': True  # In real implementation, check read receipts
-            })
+def encode_message_cursor(message):
+    """Opaque cursor pointing just before a message"""
+    return base64.urlsafe_b64encode(f"{message['created_at']}|{message['id']}".encode()).decode()
 
-        return messages
 
-    except Exception as e:
-        print(f"Error getting conversation messages: {str(e)}")
+def decode_message_cursor(cursor):
+    """(created_at, id) from a cursor; ValueError if it was not made by encode_message_cursor"""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        # Both end up inside a PostgREST or=() filter, so only let well-formed values through
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(message_id))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def latest_message_cursor(messages):
+    """Cursor of the newest message in a list returned by get_conversation_messages, '' if empty"""
+    if not messages:
+        return ''
+    return encode_message_cursor({'created_at': messages[-1]['timestamp'], 'id': messages[-1]['id']})
+
+
+def select_messages(conversation_id):
+    return supabase.table('messages').select('''
+        id,
+        content,
+        sender_id,
+        created_at,
+        edited_at,
+        message_type,
+        profiles!messages_sender_id_fkey(name)
+    ''').eq('conversation_id', conversation_id).eq('is_deleted', False)
+
+
+def parse_timestamp(value):
+    """Timezone-aware datetime from a timestamptz string"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def get_read_watermarks(conversation_id):
+    """{user_id: last_read_at or None} for a conversation's participants.
+
+    A participant has read every message created at or before their last_read_at, so read receipts
+    cost one row per participant rather than one per message."""
+    rows = supabase.table('conversation_participants').select('user_id, last_read_at').eq('conversation_id', conversation_id).execute().data
+    return {row['user_id']: parse_timestamp(row['last_read_at']) if row['last_read_at'] else None for row in rows or []}
+
+
+def format_message(msg, watermarks=None):
+    """A message row for the client; read state is worked out from the participants' watermarks"""
+    created_at = parse_timestamp(msg['created_at'])
+    recipients = [read_at for user_id, read_at in (watermarks or {}).items() if user_id != msg['sender_id']]
+    read_count = sum(1 for read_at in recipients if read_at is not None and read_at >= created_at)
+    return {
+        'id': msg['id'],
+        'content': msg['content'],
+        'sender_id': msg['sender_id'],
+        'sender_name': msg['profiles']['name'],
+        'timestamp': msg['created_at'],
+        # Read by everyone else in the conversation
+        'is_read': bool(recipients) and read_count == len(recipients),
+        'read_count': read_count
+    }
+
+
+def get_conversation_messages(conversation_id, limit=MESSAGES_PAGE_SIZE, before=None):
+    """A page of messages, oldest first, ending just before the `before` cursor (the latest page without one).
+
+    Returns (messages, cursor for the page before this one or None)."""
+    query = select_messages(conversation_id)
+    if before:
+        created_at, message_id = decode_message_cursor(before)
+        query = query.or_(f'created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{message_id})')
+    rows = query.order('created_at', desc=True).order('id', desc=True).limit(limit + 1).execute().data
+
+    next_cursor = encode_message_cursor(rows[limit - 1]) if len(rows) > limit else None
+    watermarks = get_read_watermarks(conversation_id)
+    return [format_message(msg, watermarks) for msg in reversed(rows[:limit])], next_cursor
+
+
+def get_messages_after(conversation_id, after, limit=CHAT_POLL_BATCH):
+    """Up to `limit` messages after the `after` cursor (from the start if it is empty), oldest first"""
+    query = select_messages(conversation_id)
+    if after:
+        created_at, message_id = decode_message_cursor(after)
+        query = query.or_(f'created_at.gt.{created_at},and(created_at.eq.{created_at},id.gt.{message_id})')
+    rows = query.order('created_at').order('id').limit(limit).execute().data
+    if not rows:
         return []
+    watermarks = get_read_watermarks(conversation_id)
+    return [format_message(msg, watermarks) for msg in rows]
+
+
+def highlight_snippet(snippet):
+    """HTML for a search snippet: the content escaped, the matched words (between \x02 and \x03) in <mark>"""
+    return str(escape(snippet or '')).replace('\x02', '<mark>').replace('\x03', '</mark>')
+
+
+def search_messages(user_id, query, page=1, page_size=CHAT_SEARCH_PAGE_SIZE):
+    """A page of the user's messages matching query, best match first; returns (results, has_more)"""
+    rows = supabase.rpc('search_messages', {
+        'p_user_id': user_id,
+        'p_query': query,
+        'p_limit': page_size + 1,
+        'p_offset': (page - 1) * page_size
+    }).execute().data or []
+
+    results = [{
+        'id': row['id'],
+        'conversation_id': row['conversation_id'],
+        'sender_id': row['sender_id'],
+        'sender_name': row['sender_name'],
+        'timestamp': row['created_at'],
+        'rank': row['rank'],
+        'snippet_html': highlight_snippet(row['snippet'])
+    } for row in rows[:page_size]]
+    return results, len(rows) > page_size
+
+
+def get_profile_summary(user_id):
+    """id, name and role of a profile, from memory when recently looked up"""
+    summary = profile_summaries.get(str(user_id))
+    if summary is None:
+        rows = supabase.table('profiles').select('id, name, role').eq('id', user_id).execute().data
+        if not rows:
+            return {'id': user_id, 'name': 'Unknown', 'role': None}
+        summary = rows[0]
+        profile_summaries.set(str(user_id), summary)
+    return summary
+
+
+def get_conversation_member_ids(conversation_id):
+    """User ids of a conversation's participants, from memory when recently looked up"""
+    member_ids = conversation_members.get(str(conversation_id))
+    if member_ids is None:
+        rows = supabase.table('conversation_participants').select('user_id').eq('conversation_id', conversation_id).execute().data
+        member_ids = [row['user_id'] for row in rows or []]
+        conversation_members.set(str(conversation_id), member_ids)
+    return member_ids
+
+
+def message_sent(row):
+    """Tell the other participants about a message row just inserted; returns it formatted like format_message()"""
+    conversation_id = row['conversation_id']
+    # The insert trigger bumped the other participants' unread counts
+    recipient_ids = [user_id for user_id in get_conversation_member_ids(conversation_id) if user_id != row['sender_id']]
+    chat_unread_counts.invalidate_many(recipient_ids)
+    conversation_feed.published(conversation_id, encode_message_cursor(row))
+    publish_to_users(recipient_ids, 'message', {
+        'id': row['id'],
+        'conversation_id': conversation_id,
+        'sender_id': row['sender_id'],
+        'content': row['content'],
+        'timestamp': row['created_at']
+    })
+    return format_message({**row, 'profiles': {'name': get_profile_summary(row['sender_id'])['name']}})
 
 
 def save_message(conversation_id, sender_id, content, message_type='text'):
-    """Save a message to database"""
+    """Save a message to database; returns the stored message (see format_message) or None"""
     try:
         message_data = {
             'conversation_id': conversation_id,
@@ -6037,41 +6155,12 @@ def save_message(conversation_id, sender_id, content, message_type='text'):
         result = supabase.table('messages').insert(message_data).execute()
 
         if result.data and len(result.data) > 0:
-            return result.data[0]['id']
-
-        return None
-
-    except Exception as e:
-        print(f"Error saving message: {str(e)}")
-        return None
-
-
-def get_message(message_id):
-    """Get message details"""
-    try:
-        result = supabase.table('messages').select('''
-            id,
-            content,
-            sender_id,
-            created_at,
-            message_type,
-            profiles!messages_sender_id_fkey(name)
-        ''').eq('id', message_id).execute()
-
-        if result.data and len(result.data) > 0:
-            msg = result.data[0]
-            return {
-                'id': msg['id'],
-                'content': msg['content'],
-                'sender_id': msg['sender_id'],
-                'timestamp': msg['created_at'],
-                'sender_name': msg['profiles']['name']
-            }
+            return message_sent(result.data[0])
 
         return None
 
     except Exception as e:
-        print(f"Error getting message: {str(e)}")
+        logger.error("Error saving message: %s", e)
         return None
 
 
@@ -6082,56 +6171,85 @@ def can_access_conversation(conversation_id, user_id):
         return len(result.data) > 0
 
     except Exception as e:
-        print(f"Error checking conversation access: {str(e)}")
+        logger.error("Error checking conversation access: %s", e)
         return False
 
 
-def mark_messages_as_read(conversation_id, user_id):
-    """Mark messages as read for a user"""
+def mark_conversation_read(conversation_id, user_ids, read_through):
+    """Move the users' read watermarks forward to read_through and reset their unread counts.
+
+    read_through is the created_at of the newest message the users were shown, so that the watermark
+    is on the database's clock and messages inserted after that are not taken as read. A watermark
+    already at or past it is left alone.
+
+    The other participants are sent a 'read' event with the time up to which everyone else has read
+    their messages, for the read receipts on open pages."""
+    moved = supabase.table('conversation_participants').update({
+        'last_read_at': read_through,
+        'unread_count': 0
+    }).eq('conversation_id', conversation_id).in_('user_id', user_ids).or_(
+        f'last_read_at.is.null,last_read_at.lt.{read_through}').execute().data or []
+    if not moved:
+        return
+
+    # Messages that arrived after the ones shown are still unread
+    newer = supabase.table('messages').select('sender_id').eq('conversation_id', conversation_id).eq(
+        'is_deleted', False).gt('created_at', read_through).execute().data or []
+    user_ids = [row['user_id'] for row in moved]
+    for user_id in user_ids:
+        unread = sum(1 for row in newer if row['sender_id'] != user_id)
+        if unread:
+            supabase.table('conversation_participants').update({'unread_count': unread}).eq(
+                'conversation_id', conversation_id).eq('user_id', user_id).execute()
+    chat_unread_counts.invalidate_many(user_ids)
+
+    watermarks = get_read_watermarks(conversation_id)
+    for sender_id in watermarks:
+        if sender_id in user_ids:
+            continue
+        others = [read_at for user_id, read_at in watermarks.items() if user_id != sender_id]
+        if others and None not in others:
+            publish_to_users([sender_id], 'read', {'conversation_id': conversation_id, 'read_through': min(others).isoformat()})
+
+
+def mark_messages_as_read(conversation_id, user_id, cursor):
+    """Mark messages as read for a user, up to and including the message at cursor"""
+    if not cursor:
+        return True
     try:
-        # Update the participant's last_read_at and reset unread_count
-        supabase.table('conversation_participants').update({
-            'last_read_at': 'now()',
-            'unread_count': 0
-        }).eq('conversation_id', conversation_id).eq('user_id', user_id).execute()
+        read_through, _ = decode_message_cursor(cursor)
+        mark_conversation_read(conversation_id, [user_id], read_through)
 
         return True
 
     except Exception as e:
-        print(f"Error marking messages as read: {str(e)}")
+        logger.error("Error marking messages as read: %s", e)
         return False
 
 
-def create_conversation(creator_id, participant_ids, title=None):
+def create_conversation(creator_id, participant_ids, title=None, initial_message=None):
     """Create a new conversation"""
     try:
-        # Create conversation
-        conversation_data = {
-            'created_by': creator_id,
-            'title': title
-        }
-
-        conv_result = supabase.table('conversations').insert(conversation_data).execute()
+        # Conversation, participants (creator + others) and first message in one call
+        result = supabase.rpc('create_conversation_with_message', {
+            'p_creator_id': creator_id,
+            'p_participant_ids': participant_ids,
+            'p_title': title,
+            'p_content': initial_message
+        }).execute()
 
-        if not conv_result.data:
+        if not result.data:
             return None
 
-        conversation_id = conv_result.data[0]['id']
-
-        # Add participants (creator + others)
-        participants_data = []
-        for participant_id in [creator_id] + participant_ids:
-            participants_data.append({
-                'conversation_id': conversation_id,
-                'user_id': participant_id
-            })
-
-        supabase.table('conversation_participants').insert(participants_data).execute()
+        conversation_id = result.data['conversation_id']
+        conversation_members.set(str(conversation_id), list(dict.fromkeys([creator_id] + participant_ids)))
+        if result.data['message']:
+            message_sent(result.data['message'])
 
         return conversation_id
 
     except Exception as e:
-        print(f"Error creating conversation: {str(e)}")
+        logger.error("Error creating conversation: %s", e)
         return None
 
 
@@ -6160,7 +6278,7 @@ def get_available_teachers_for_student(student_id):
         return teachers
 
     except Exception as e:
-        print(f"Error getting available teachers: {str(e)}")
+        logger.error("Error getting available teachers: %s", e)
         return []
 
 
@@ -6187,7 +6305,7 @@ def get_available_students_for_teacher(teacher_id):
         return students
 
     except Exception as e:
-        print(f"Error getting available students: {str(e)}")
+        logger.error("Error getting available students: %s", e)
         return []
 
 
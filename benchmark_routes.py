@@ -0,0 +1,227 @@
+"""
+Route benchmark for the LMS.
+
+Loads a generated school (see generate_dataset.py) into the offline SQLite
+backend (DATA_BACKEND=offline), drives the main routes
+through Flask's test client and records latency percentiles and the number of
+backend queries each request makes. Results are written as JSON so runs can be
+compared, e.g. before and after fixing an N+1 query.
+
+Usage:
+    python benchmark_routes.py --preset small --requests 50 --output bench.json
+    python benchmark_routes.py --preset medium --database medium.db --baseline bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# The app picks its backend at import time
+os.environ['DATA_BACKEND'] = 'offline'
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+# Keep per-request log lines out of the report
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from generate_dataset import SchoolGenerator, add_scale_arguments, load_offline, scale_from_args
+
+ROUTES = [
+    'dashboard',
+    'courses',
+    'course_modules',
+    'course_module_tasks',
+    'course_task',
+    'submit_quiz_attempt',
+    'teachers_progress',
+    'teachers_grading',
+    'admin_progress',
+    'course_analytics',
+    'chat',
+    'my_submissions',
+]
+
+
+class QueryCounter:
+    """Count backend queries made by the benchmark thread (not the background flushers)"""
+
+    def __init__(self):
+        self.count = 0
+        self.thread_id = threading.get_ident()
+
+    def __call__(self, kind, name):
+        if threading.get_ident() == self.thread_id:
+            self.count += 1
+
+
+def prepare_dataset(client, generator, load=True):
+    """Load the generated school into the offline backend and return the sample ids"""
+    if load:
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_offline(generator, client)
+
+    ids = generator.sample()
+    # submit_quiz_attempt needs an open attempt to grade
+    attempt = (client.table('quiz_attempts').select('id')
+               .eq('student_id', ids['student_id']).eq('task_id', ids['task_id']).limit(1).execute())
+    if not attempt.data:
+        client.table('quiz_attempts').insert({
+            'student_id': ids['student_id'], 'course_id': ids['course_id'], 'module_id': ids['module_id'],
+            'task_id': ids['task_id'], 'score': 0, 'passed': False, 'answers': {},
+            'total_questions': generator.scale['questions_per_test'], 'correct_answers': 0
+        }).execute()
+    return ids
+
+
+def build_requests(ids):
+    """Method, user, path and JSON body for every benchmarked route"""
+    course, module = ids['course_id'], ids['module_id']
+    return {
+        'dashboard': ('GET', 'student', '/dashboard', None),
+        'courses': ('GET', 'student', '/courses', None),
+        'course_modules': ('GET', 'student', f'/course/{course}/modules', None),
+        'course_module_tasks': ('GET', 'student', f'/course/{course}/module/{module}', None),
+        'course_task': ('GET', 'student', f"/course/{course}/module/{module}/task/{ids['lesson_task_id']}", None),
+        'submit_quiz_attempt': ('POST', 'student', f"/course/{course}/module/{module}/test/{ids['test_id']}/submit",
+                                {'answers': {}}),
+        'teachers_progress': ('GET', 'teacher', '/teachers/progress', None),
+        'teachers_grading': ('GET', 'teacher', '/teachers/grading', None),
+        'admin_progress': ('GET', 'admin', '/admin/progress', None),
+        'course_analytics': ('GET', 'admin', f'/admin/course/{course}/analytics', None),
+        'chat': ('GET', 'student', '/chat', None),
+        'my_submissions': ('GET', 'student', '/my-submissions', None),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run(args):
+    # An existing --database file is reused; it must have been generated with the same preset and seed
+    load = True
+    if args.database:
+        load = not os.path.exists(args.database)
+        os.environ['OFFLINE_DATABASE'] = args.database
+    import app as lms
+
+    client = lms.supabase
+    generator = SchoolGenerator(scale_from_args(args), seed=args.seed)
+    ids = prepare_dataset(client, generator, load=load)
+    lms.progress_view_buffer.flush()
+
+    counter = QueryCounter()
+    client.listeners.append(counter)
+
+    users = {
+        'student': (ids['student_id'], 'student'),
+        'teacher': (ids['teacher_id'], 'teacher'),
+        'admin': (ids['admin_id'], 'admin'),
+    }
+    requests = build_requests(ids)
+    routes = [route for route in ROUTES if not args.routes or route in args.routes]
+    test_client = lms.app.test_client()
+    results = {}
+
+    for route in routes:
+        method, user, path, body = requests[route]
+        user_id, role = users[user]
+        with test_client.session_transaction() as sess:
+            sess.clear()
+            sess['user_id'] = user_id
+            sess['role'] = role
+            sess['username'] = f'bench-{role}'
+            sess['user_email'] = f'bench-{role}@example.com'
+
+        latencies, queries, statuses = [], [], {}
+        for iteration in range(args.warmup + args.requests):
+            counter.count = 0
+            started = time.perf_counter()
+            # The routes print a lot; keep that out of the timings and the report
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                response = test_client.open(path, method=method, json=body)
+            elapsed = (time.perf_counter() - started) * 1000
+            if iteration < args.warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(counter.count)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        results[route] = {
+            'method': method,
+            'path': path,
+            'user': user,
+            'status_codes': statuses,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p90': round(percentile(latencies, 90), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'max': round(max(latencies), 3),
+            },
+            'queries': {
+                'min': min(queries),
+                'mean': round(sum(queries) / len(queries), 2),
+                'max': max(queries),
+            },
+        }
+
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'backend': 'offline',
+        'requests_per_route': args.requests,
+        'dataset': {'preset': args.preset, 'seed': args.seed, 'scale': generator.scale,
+                    'rows': generator.counts},
+        'routes': results,
+    }
+
+
+def print_report(report, baseline=None):
+    baseline_routes = (baseline or {}).get('routes', {})
+    print(f"{'route':<22} {'status':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}")
+    for route, result in report['routes'].items():
+        statuses = ','.join(sorted(result['status_codes']))
+        line = (f"{route:<22} {statuses:<10} {result['latency_ms']['p50']:>9.2f} {result['latency_ms']['p95']:>9.2f} "
+                f"{result['latency_ms']['p99']:>9.2f} {result['queries']['mean']:>8.1f}")
+        previous = baseline_routes.get(route)
+        if previous:
+            line += (f"   (p95 {result['latency_ms']['p95'] - previous['latency_ms']['p95']:+.2f} ms, "
+                     f"queries {result['queries']['mean'] - previous['queries']['mean']:+.1f})")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the main LMS routes against the offline backend.')
+    add_scale_arguments(parser)
+    parser.add_argument('--database', help='SQLite file to generate the dataset into, or reuse if it exists')
+    parser.add_argument('--requests', type=int, default=30, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per route')
+    parser.add_argument('--routes', nargs='*', choices=ROUTES, help='only benchmark these routes')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--baseline', help='previous JSON report to compare against')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
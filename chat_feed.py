@@ -0,0 +1,82 @@
+"""
+Wakeups for the chat long-polling feed.
+
+A poll asks for the messages after a cursor. save_message() records each
+conversation's newest cursor here and publishes it on the event broker, so a
+poll whose cursor is already the newest one waits for that signal instead of
+querying the database, and an idle poll costs no queries at all. Newest
+cursors are only trusted for marker_ttl seconds; with several workers a
+message written on another worker therefore shows up within that bound (or
+immediately with a shared redis:// broker, which wakes the waiting polls).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationFeed:
+    """Newest-message markers and wakeups per conversation"""
+
+    def __init__(self, broker, marker_ttl=30.0, access_ttl=300.0, max_entries=10000):
+        self.broker = broker
+        self.marker_ttl = marker_ttl
+        self.access_ttl = access_ttl
+        self.max_entries = max_entries
+        self._markers = OrderedDict()
+        self._access = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def channel(conversation_id):
+        return f'conversation:{conversation_id}'
+
+    def _remember(self, entries, key, value, ttl):
+        with self._lock:
+            entries.pop(key, None)
+            entries[key] = (time.monotonic() + ttl, value)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def _recall(self, entries, key):
+        with self._lock:
+            entry = entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def seen(self, conversation_id, cursor):
+        """Record the newest cursor of a conversation, e.g. after reading it from the database"""
+        self._remember(self._markers, str(conversation_id), cursor, self.marker_ttl)
+
+    def published(self, conversation_id, cursor):
+        """A message was written: remember it and wake the conversation's waiting polls"""
+        self.seen(conversation_id, cursor)
+        self.broker.publish(self.channel(conversation_id), 'message', {'cursor': cursor})
+
+    def wait(self, conversation_id, after, timeout):
+        """Block until there may be messages after `after`; False if nothing arrived before timeout"""
+        subscription = self.broker.subscribe(self.channel(conversation_id))
+        try:
+            # Subscribed before checking, so a message written in between still wakes us
+            newest = self._recall(self._markers, str(conversation_id))
+            if newest != after:
+                # Newer (or unknown) messages: the caller has to read them
+                return True
+            item = subscription.get(timeout)
+            if item is None:
+                return False
+            self.seen(conversation_id, item[1]['cursor'])
+            return True
+        finally:
+            subscription.close()
+
+    def can_access(self, conversation_id, user_id, check):
+        """Cached check(conversation_id, user_id) so that every poll doesn't re-check membership"""
+        key = (str(conversation_id), str(user_id))
+        if self._recall(self._access, key):
+            return True
+        allowed = check(conversation_id, user_id)
+        if allowed:
+            self._remember(self._access, key, True, self.access_ttl)
+        return allowed
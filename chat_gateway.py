@@ -0,0 +1,237 @@
+"""
+WebSocket chat gateway.
+
+An optional asyncio process next to the Flask app for pages that keep a
+conversation open:
+
+    python chat_gateway.py
+
+Browsers connect to ws://<host>:<port>/conversations/<id>. The gateway reads the
+Flask session cookie with the same SECRET_KEY; cookies are not scoped by port, so
+the app's session reaches the gateway on the same host. Sent messages go through
+app.save_message(), which signals the conversation on the event broker. The
+gateway reads the new messages once per conversation and broadcasts them to
+every connection in memory. Recipients who have the conversation open get their
+unread_count reset in one update per conversation every flush interval, rather
+than once per message.
+
+Browsers attach that cookie to a WebSocket opened by any page, so handshakes are
+only accepted from the origins in CHAT_GATEWAY_ALLOWED_ORIGINS (the app's own).
+
+Each connection is a coroutine rather than a worker thread, so one process holds
+thousands of idle connections. Use a redis:// EVENTS_BROKER_URL so that messages
+sent through the Flask app reach the gateway too.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from functools import partial
+from http.cookies import SimpleCookie
+
+from events import Subscription
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 5000
+# Where the app itself is served when CHAT_GATEWAY_ALLOWED_ORIGINS is not set (python app.py)
+DEFAULT_ALLOWED_ORIGINS = 'http://localhost:5000,http://127.0.0.1:5000'
+
+
+def parse_origins(value):
+    """Comma-separated origins, e.g. "https://lms.example.com", as browsers send them in Origin"""
+    return [origin.strip().rstrip('/') for origin in value.split(',') if origin.strip()]
+
+
+class LoopSubscription(Subscription):
+    """Broker subscription that calls back on the gateway's event loop instead of queueing"""
+
+    def __init__(self, broker, channel, loop, callback):
+        super().__init__(broker, channel)
+        self.loop = loop
+        self.callback = callback
+
+    def put(self, event, data):
+        # Called from the thread that published (or from the redis listener)
+        self.loop.call_soon_threadsafe(self.callback, data)
+
+
+class Room:
+    """The gateway's connections to one conversation"""
+
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+        self.members = {}
+        self.cursor = None
+        self.ready = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.recent = deque(maxlen=200)
+        self.subscription = None
+
+
+class ChatGateway:
+    def __init__(self, lms, allowed_origins, flush_interval=1.0):
+        # lms is the app module: its session settings, save_message and message queries
+        self.lms = lms
+        self.allowed_origins = set(allowed_origins)
+        self.flush_interval = flush_interval
+        self.rooms = {}
+        self.pending_reads = {}
+        self.serializer = lms.app.session_interface.get_signing_serializer(lms.app)
+
+    def session_user(self, request):
+        """user_id from the request's Flask session cookie, or None"""
+        cookies = SimpleCookie(request.headers.get('Cookie', ''))
+        morsel = cookies.get(self.lms.app.config['SESSION_COOKIE_NAME'])
+        if morsel is None:
+            return None
+        try:
+            max_age = int(self.lms.app.permanent_session_lifetime.total_seconds())
+            return self.serializer.loads(morsel.value, max_age=max_age).get('user_id')
+        except Exception:
+            return None
+
+    async def handler(self, connection):
+        # Checked before the cookie is looked at: another site's page must not ride the user's session
+        if connection.request.headers.get('Origin') not in self.allowed_origins:
+            await connection.close(4403, 'Origin not allowed')
+            return
+        parts = connection.request.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'conversations':
+            await connection.close(4404, 'Not found')
+            return
+        conversation_id = parts[1]
+        user_id = self.session_user(connection.request)
+        if not user_id:
+            await connection.close(4401, 'Login required')
+            return
+        if not await asyncio.to_thread(self.lms.can_access_conversation, conversation_id, user_id):
+            await connection.close(4403, 'Access denied')
+            return
+
+        room = await self.join(conversation_id, connection, user_id)
+        try:
+            async for raw in connection:
+                await self.receive(room, connection, user_id, raw)
+        finally:
+            self.leave(room, connection)
+
+    async def join(self, conversation_id, connection, user_id):
+        room = self.rooms.get(conversation_id)
+        if room is None:
+            room = self.rooms[conversation_id] = Room(conversation_id)
+            loop = asyncio.get_running_loop()
+            room.subscription = self.lms.event_broker.subscribe(
+                self.lms.conversation_feed.channel(conversation_id),
+                partial(LoopSubscription, loop=loop, callback=lambda data: self.signal(room)))
+            try:
+                messages, _ = await asyncio.to_thread(self.lms.get_conversation_messages, conversation_id, 1)
+                room.cursor = self.lms.latest_message_cursor(messages)
+            except Exception as e:
+                logger.error("Error loading conversation %s for the gateway: %s", conversation_id, e)
+                room.cursor = ''
+            room.ready.set()
+        await room.ready.wait()
+        room.members[connection] = user_id
+        return room
+
+    def leave(self, room, connection):
+        room.members.pop(connection, None)
+        if not room.members and self.rooms.get(room.conversation_id) is room:
+            del self.rooms[room.conversation_id]
+            room.subscription.close()
+
+    async def receive(self, room, connection, user_id, raw):
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            await connection.send(json.dumps({'type': 'error', 'message': 'Invalid JSON'}))
+            return
+        if payload.get('type') != 'message':
+            return
+        content = str(payload.get('content') or '').strip()
+        if not content or len(content) > MAX_MESSAGE_LENGTH:
+            await connection.send(json.dumps({'type': 'error', 'message': 'Invalid message'}))
+            return
+        message = await asyncio.to_thread(self.lms.save_message, room.conversation_id, user_id, content)
+        if message is None:
+            await connection.send(json.dumps({'type': 'error', 'message': 'Failed to send message'}))
+            return
+        # The message itself reaches everyone, the sender included, through signal()
+        await connection.send(json.dumps({'type': 'sent', 'id': message['id']}))
+
+    def signal(self, room):
+        """The conversation has new messages somewhere after room.cursor"""
+        if self.rooms.get(room.conversation_id) is room:
+            asyncio.get_running_loop().create_task(self.catch_up(room))
+
+    async def catch_up(self, room):
+        async with room.lock:
+            try:
+                messages = await asyncio.to_thread(self.lms.get_messages_after, room.conversation_id, room.cursor)
+            except Exception as e:
+                logger.error("Error reading new messages for the gateway: %s", e)
+                return
+            for message in messages:
+                room.cursor = self.lms.latest_message_cursor([message])
+                if message['id'] not in room.recent:
+                    room.recent.append(message['id'])
+                    self.fan_out(room, message)
+
+    def fan_out(self, room, message):
+        from websockets.asyncio.server import broadcast
+
+        payload = json.dumps({'type': 'message', 'message': message, 'cursor': room.cursor}, default=str)
+        broadcast(list(room.members), payload)
+        readers = {user_id for user_id in room.members.values() if user_id != message['sender_id']}
+        if readers:
+            # Each reader has seen the conversation up to this message
+            self.pending_reads.setdefault(room.conversation_id, {}).update(dict.fromkeys(readers, room.cursor))
+
+    async def flush_reads(self):
+        """Reset unread counts of the recipients who saw their messages live, one update per conversation"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            pending, self.pending_reads = self.pending_reads, {}
+            for conversation_id, cursors in pending.items():
+                by_cursor = {}
+                for user_id, cursor in cursors.items():
+                    by_cursor.setdefault(cursor, []).append(user_id)
+                for cursor, user_ids in by_cursor.items():
+                    try:
+                        read_through, _ = self.lms.decode_message_cursor(cursor)
+                        await asyncio.to_thread(self.lms.mark_conversation_read, conversation_id, user_ids, read_through)
+                    except Exception as e:
+                        logger.error("Error flushing read state for conversation %s: %s", conversation_id, e)
+
+    def connection_count(self):
+        return sum(len(room.members) for room in self.rooms.values())
+
+
+async def serve(host, port, allowed_origins, flush_interval=1.0):
+    try:
+        from websockets.asyncio.server import serve as websocket_serve
+    except ImportError:
+        raise RuntimeError("The chat gateway needs the websockets package: pip install websockets")
+    import app as lms
+
+    if not allowed_origins:
+        raise RuntimeError("CHAT_GATEWAY_ALLOWED_ORIGINS must list the origins the app is served from")
+    gateway = ChatGateway(lms, allowed_origins, flush_interval=flush_interval)
+    flusher = asyncio.create_task(gateway.flush_reads())
+    # websockets answers 403 to handshakes from any other Origin
+    async with websocket_serve(gateway.handler, host, port, origins=list(allowed_origins), max_size=64 * 1024):
+        logger.info("Chat gateway listening on ws://%s:%s", host, port)
+        try:
+            await asyncio.Future()
+        finally:
+            flusher.cancel()
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(os.getenv('CHAT_GATEWAY_HOST', '0.0.0.0'),
+                      int(os.getenv('CHAT_GATEWAY_PORT', '8765')),
+                      parse_origins(os.getenv('CHAT_GATEWAY_ALLOWED_ORIGINS', DEFAULT_ALLOWED_ORIGINS)),
+                      flush_interval=float(os.getenv('CHAT_GATEWAY_FLUSH_INTERVAL', '1'))))
@@ -11,6 +11,8 @@ DROP TRIGGER IF EXISTS trigger_update_conversation_last_message ON messages;
 DROP TRIGGER IF EXISTS trigger_update_unread_counts ON messages;
 DROP FUNCTION IF EXISTS update_conversation_last_message();
 DROP FUNCTION IF EXISTS update_unread_counts();
+DROP FUNCTION IF EXISTS create_conversation_with_message(UUID, UUID[], TEXT, TEXT);
+DROP FUNCTION IF EXISTS search_messages(UUID, TEXT, INTEGER, INTEGER);
 
 -- Create conversations table
 CREATE TABLE IF NOT EXISTS conversations (
@@ -19,9 +21,15 @@ CREATE TABLE IF NOT EXISTS conversations (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     last_message_at TIMESTAMP WITH TIME ZONE,
+    last_message_preview TEXT,
+    last_message_sender_id UUID REFERENCES profiles(id) ON DELETE SET NULL,
     created_by UUID REFERENCES profiles(id)
 );
 
+-- Last message preview for the inbox, kept up to date by trigger_update_conversation_last_message
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_preview TEXT;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_sender_id UUID REFERENCES profiles(id) ON DELETE SET NULL;
+
 -- Create conversation participants table
 CREATE TABLE IF NOT EXISTS conversation_participants (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -49,7 +57,10 @@ CREATE TABLE IF NOT EXISTS messages (
 CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_conversation_participants_conversation_id ON conversation_participants(conversation_id);
 CREATE INDEX IF NOT EXISTS idx_conversation_participants_user_id ON conversation_participants(user_id);
-CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages(conversation_id);
+-- History is paged newest first on (created_at, id) within a conversation; this replaces the
+-- old single-column idx_messages_conversation_id
+DROP INDEX IF EXISTS idx_messages_conversation_id;
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created_at ON messages(conversation_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
 CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at DESC);
 
@@ -102,7 +113,10 @@ CREATE OR REPLACE FUNCTION update_conversation_last_message()
 RETURNS TRIGGER AS $$
 BEGIN
     UPDATE conversations
-    SET last_message_at = NOW(), updated_at = NOW()
+    SET last_message_at = NEW.created_at,
+        last_message_preview = left(NEW.content, 200),
+        last_message_sender_id = NEW.sender_id,
+        updated_at = NOW()
     WHERE id = NEW.conversation_id;
     RETURN NEW;
 END;
@@ -114,6 +128,19 @@ CREATE TRIGGER trigger_update_conversation_last_message
     FOR EACH ROW
     EXECUTE FUNCTION update_conversation_last_message();
 
+-- Fill in the preview for conversations that predate it
+UPDATE conversations c
+SET last_message_at = m.created_at,
+    last_message_preview = left(m.content, 200),
+    last_message_sender_id = m.sender_id
+FROM (
+    SELECT DISTINCT ON (conversation_id) conversation_id, created_at, content, sender_id
+    FROM messages
+    ORDER BY conversation_id, created_at DESC
+) m
+WHERE m.conversation_id = c.id
+AND c.last_message_preview IS NULL;
+
 -- Create function to update unread counts
 CREATE OR REPLACE FUNCTION update_unread_counts()
 RETURNS TRIGGER AS $$
@@ -134,3 +161,75 @@ CREATE TRIGGER trigger_update_unread_counts
     AFTER INSERT ON messages
     FOR EACH ROW
     EXECUTE FUNCTION update_unread_counts();
+
+-- Create a conversation, its participants and an optional first message in one round trip
+CREATE OR REPLACE FUNCTION create_conversation_with_message(
+    p_creator_id UUID,
+    p_participant_ids UUID[],
+    p_title TEXT DEFAULT NULL,
+    p_content TEXT DEFAULT NULL
+)
+RETURNS JSON AS $$
+DECLARE
+    new_conversation_id UUID;
+    new_message messages%ROWTYPE;
+BEGIN
+    INSERT INTO conversations (created_by, title)
+    VALUES (p_creator_id, p_title)
+    RETURNING id INTO new_conversation_id;
+
+    INSERT INTO conversation_participants (conversation_id, user_id)
+    SELECT DISTINCT new_conversation_id, participant_id
+    FROM unnest(array_prepend(p_creator_id, p_participant_ids)) AS participant_id;
+
+    IF p_content IS NOT NULL THEN
+        INSERT INTO messages (conversation_id, sender_id, content)
+        VALUES (new_conversation_id, p_creator_id, p_content)
+        RETURNING * INTO new_message;
+    END IF;
+
+    RETURN json_build_object(
+        'conversation_id', new_conversation_id,
+        'message', CASE WHEN new_message.id IS NULL THEN NULL ELSE row_to_json(new_message) END
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Full-text search over message content; search_messages() uses the same expression so it hits the index
+CREATE INDEX IF NOT EXISTS idx_messages_content_search ON messages USING GIN (to_tsvector('english', content));
+
+-- Ranked matches in the conversations a user takes part in, a page at a time. Snippets mark the
+-- matched words with chr(2) ... chr(3) so the app can escape the content and then highlight them
+CREATE OR REPLACE FUNCTION search_messages(
+    p_user_id UUID,
+    p_query TEXT,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS TABLE (
+    id UUID,
+    conversation_id UUID,
+    sender_id UUID,
+    sender_name TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    rank REAL,
+    snippet TEXT
+) AS $$
+    SELECT hit.id, hit.conversation_id, hit.sender_id, p.name, hit.created_at, hit.rank,
+           ts_headline('english', hit.content, websearch_to_tsquery('english', p_query),
+                       'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=25, MinWords=8, MaxFragments=2')
+    FROM (
+        -- Rank and page first, so that only the returned rows get a snippet
+        SELECT m.id, m.conversation_id, m.sender_id, m.created_at, m.content,
+               ts_rank_cd(to_tsvector('english', m.content), query) AS rank
+        FROM messages m
+        JOIN conversation_participants cp ON cp.conversation_id = m.conversation_id AND cp.user_id = p_user_id
+        CROSS JOIN websearch_to_tsquery('english', p_query) AS query
+        WHERE to_tsvector('english', m.content) @@ query
+        AND NOT m.is_deleted
+        ORDER BY rank DESC, m.created_at DESC, m.id
+        LIMIT p_limit OFFSET p_offset
+    ) hit
+    LEFT JOIN profiles p ON p.id = hit.sender_id
+    ORDER BY hit.rank DESC, hit.created_at DESC, hit.id;
+$$ LANGUAGE sql STABLE;
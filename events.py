@@ -0,0 +1,190 @@
+"""
+Live events for the browser over Server-Sent Events.
+
+Writers publish small JSON events (a new notification, a chat message) to
+per-user channels ("user:<id>"); every open /events stream of that user
+receives them and the page updates its badges and lists in place.
+
+The broker is picked from a URL like the token store:
+
+    memory://               in-process; a worker only reaches its own streams
+    redis://host:6379/0     shared pub/sub so any worker reaches every stream
+
+Each stream holds a worker thread while it is open, so streams end after
+max_duration seconds and the browser's EventSource reconnects on its own.
+HeldRequests caps how many threads a worker lets streams and long polls hold,
+so that they cannot take every thread away from ordinary page requests.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(event, data):
+    """One SSE frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class Subscription:
+    """Events for one open stream; slow readers drop events rather than grow without bound"""
+
+    def __init__(self, broker, channel, max_pending=100):
+        self.broker = broker
+        self.channel = channel
+        self.dropped = 0
+        self._queue = queue.Queue(max_pending)
+
+    def put(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout):
+        """Next (event, data), or None after timeout seconds without one"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Deliver events to the streams open in this process"""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, factory=Subscription):
+        """factory(broker, channel) builds the subscription, e.g. one that hands events to an event loop"""
+        subscription = factory(self, channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, event, data):
+        self.deliver(channel, event, data)
+
+    def publish_many(self, channels, event, data):
+        for channel in channels:
+            self.publish(channel, event, data)
+
+    def deliver(self, channel, event, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event, data)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+class RedisBroker(LocalBroker):
+    """Publish through Redis pub/sub; a listener thread delivers to this process's streams"""
+
+    def __init__(self, url, prefix='lms:events:'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// event broker needs the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._listener = threading.Thread(target=self._listen, name='event-broker-listener', daemon=True)
+        self._listener.start()
+
+    def publish(self, channel, event, data):
+        self.client.publish(self.prefix + channel, json.dumps({'event': event, 'data': data}, default=str))
+
+    def publish_many(self, channels, event, data):
+        payload = json.dumps({'event': event, 'data': data}, default=str)
+        pipeline = self.client.pipeline(transaction=False)
+        for channel in channels:
+            pipeline.publish(self.prefix + channel, payload)
+        pipeline.execute()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(self.prefix):]
+                    payload = json.loads(message['data'])
+                    self.deliver(channel, payload['event'], payload['data'])
+            except Exception as e:
+                logger.error("Event broker connection lost, reconnecting: %s", e)
+                time.sleep(1)
+
+
+def create_broker(url):
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return LocalBroker()
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported event broker URL: {url}")
+
+
+class HeldRequests:
+    """Per-worker cap on requests that hold their thread while waiting (event streams, long polls)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._held = 0
+
+    def acquire(self):
+        """Take a slot without waiting; False when every slot is held"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._held += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._held -= 1
+        self._slots.release()
+
+    def held(self):
+        with self._lock:
+            return self._held
+
+
+def event_stream(subscription, heartbeat=15.0, max_duration=300.0, retry_ms=3000):
+    """SSE frames for a subscription until max_duration; closes the subscription when done"""
+    deadline = time.monotonic() + max_duration
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            item = subscription.get(min(heartbeat, remaining))
+            if item is None:
+                # Comment frame: keeps proxies from closing the idle connection
+                yield ": keepalive\n\n"
+            else:
+                yield format_event(*item)
+    finally:
+        subscription.close()
@@ -0,0 +1,449 @@
+"""
+Synthetic school dataset for load tests.
+
+Generates a coherent institution - teachers, students, courses, modules,
+tasks, tests, questions, enrollments, progress, quiz attempts, submissions,
+conversations and messages - following the relations in
+database_migrations.sql, chat_schema.sql and migrations/*.sql. Rows are
+streamed table by table, so even the end-of-term preset (50k students) does
+not have to fit in memory.
+
+Output is either a directory of CSV files plus a load.sql that COPYs them into
+a local Postgres, or a SQLite file for DATA_BACKEND=offline:
+
+    python generate_dataset.py --preset end-of-term --format csv --output data/
+    (cd data && psql "$DATABASE_URL" -f load.sql)
+
+    python generate_dataset.py --preset medium --format sqlite --output school.db
+    DATA_BACKEND=offline OFFLINE_DATABASE=school.db python app.py
+
+Every generated account uses the password in DEFAULT_PASSWORD.
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from werkzeug.security import generate_password_hash
+
+DEFAULT_PASSWORD = 'password123'
+
+PRESETS = {
+    'small': {
+        'students': 200, 'teachers': 10, 'admins': 1, 'courses': 15,
+        'modules_per_course': 4, 'tasks_per_module': 5, 'tests_per_module': 1, 'questions_per_test': 5,
+        'enrollments_per_student': 3, 'progress_ratio': 0.6, 'max_quiz_attempts': 3, 'submission_ratio': 0.5,
+        'conversation_ratio': 0.3, 'messages_per_conversation': 10,
+    },
+    'medium': {
+        'students': 5000, 'teachers': 150, 'admins': 3, 'courses': 200,
+        'modules_per_course': 6, 'tasks_per_module': 5, 'tests_per_module': 1, 'questions_per_test': 10,
+        'enrollments_per_student': 4, 'progress_ratio': 0.6, 'max_quiz_attempts': 3, 'submission_ratio': 0.5,
+        'conversation_ratio': 0.4, 'messages_per_conversation': 12,
+    },
+    'end-of-term': {
+        'students': 50000, 'teachers': 1500, 'admins': 10, 'courses': 2000,
+        'modules_per_course': 8, 'tasks_per_module': 6, 'tests_per_module': 1, 'questions_per_test': 10,
+        'enrollments_per_student': 5, 'progress_ratio': 0.85, 'max_quiz_attempts': 3, 'submission_ratio': 0.8,
+        'conversation_ratio': 0.5, 'messages_per_conversation': 15,
+    },
+}
+
+# Load order: every table comes after the tables it references
+COLUMNS = {
+    'auth.users': ['id', 'email', 'created_at'],
+    'profiles': ['id', 'name', 'email', 'password_hash', 'role', 'created_at'],
+    'courses': ['id', 'title', 'description', 'category', 'level', 'duration', 'teacher_uuid', 'status',
+                'start_date', 'end_date', 'created_at', 'updated_at'],
+    'modules': ['id', 'course_id', 'title', 'description', 'order_index', 'estimated_time', 'created_at'],
+    'tasks': ['id', 'module_id', 'type', 'title', 'description', 'order_index', 'points', 'passing_score',
+              'max_attempts', 'due_date', 'estimated_time', 'created_at'],
+    'tests': ['id', 'module_id', 'title', 'description', 'type', 'order_index', 'time_limit', 'passing_score',
+              'max_attempts', 'is_mandatory', 'show_results', 'is_active', 'created_at', 'updated_at'],
+    'questions': ['id', 'test_id', 'question_text', 'question_type', 'options', 'correct_answer', 'points',
+                  'order_index', 'created_at'],
+    'enrollments': ['id', 'student_id', 'course_id', 'enrolled_at', 'status', 'progress_percentage', 'completed_at'],
+    'progress': ['id', 'student_id', 'course_id', 'module_id', 'task_id', 'status', 'completion_percentage',
+                 'completed_at', 'score', 'created_at', 'updated_at'],
+    'quiz_attempts': ['id', 'student_id', 'course_id', 'module_id', 'task_id', 'score', 'passed', 'answers',
+                      'total_questions', 'correct_answers', 'created_at', 'updated_at', 'completed_at'],
+    'submissions': ['id', 'student_id', 'task_id', 'file_url', 'file_name', 'file_size', 'file_type',
+                    'submitted_at', 'status', 'grade', 'feedback', 'created_at', 'updated_at'],
+    'conversations': ['id', 'title', 'created_at', 'updated_at', 'last_message_at', 'last_message_preview',
+                      'last_message_sender_id', 'created_by'],
+    'conversation_participants': ['id', 'conversation_id', 'user_id', 'joined_at', 'last_read_at', 'unread_count'],
+    'messages': ['id', 'conversation_id', 'sender_id', 'content', 'message_type', 'created_at', 'edited_at',
+                 'is_deleted'],
+}
+
+# Tables with user triggers that must not fire while bulk loading
+TRIGGER_TABLES = ['messages']
+
+SUBJECTS = ['Mathematics', 'Physics', 'Chemistry', 'Biology', 'History', 'Literature', 'Computer Science',
+            'Economics', 'Geography', 'Art', 'Music', 'Philosophy']
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+TASK_TYPES = ['video', 'reading', 'assignment', 'discussion']
+SENTENCES = ['Could you explain the last module again?', 'I uploaded my assignment.', 'Thanks for the feedback!',
+             'When is the quiz due?', 'Please review section two.', 'Great progress this week.',
+             'I am stuck on question three.', 'See you in the next session.']
+
+
+def new_id(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def iso(moment):
+    return moment.isoformat() if moment else None
+
+
+class SchoolGenerator:
+    """Generate the rows of a synthetic school, table by table"""
+
+    def __init__(self, scale, seed=42, now=None):
+        self.scale = dict(PRESETS['small'])
+        self.scale.update(scale)
+        self.seed = seed
+        self.now = now or datetime.now(timezone.utc).replace(microsecond=0)
+        self.term_start = self.now - timedelta(days=120)
+        self.rng = random.Random(seed)
+        self.password_hash = generate_password_hash(DEFAULT_PASSWORD)
+        self.counts = {}
+        self._plan()
+
+    def _sub_rng(self, kind, index):
+        return random.Random(f'{self.seed}-{kind}-{index}')
+
+    def _moment(self, rng, start=None, end=None):
+        start = start or self.term_start
+        end = end or self.now
+        return start + timedelta(seconds=rng.randint(0, max(0, int((end - start).total_seconds()))))
+
+    def _plan(self):
+        """Ids and structure that later tables refer back to"""
+        rng = self.rng
+        scale = self.scale
+        self.admins = [new_id(rng) for _ in range(scale['admins'])]
+        self.teachers = [new_id(rng) for _ in range(scale['teachers'])]
+        self.students = [new_id(rng) for _ in range(scale['students'])]
+
+        self.courses = []
+        for course_index in range(scale['courses']):
+            course = {'id': new_id(rng), 'teacher': self.teachers[course_index % len(self.teachers)], 'modules': []}
+            for module_index in range(scale['modules_per_course']):
+                module = {'id': new_id(rng), 'order_index': module_index + 1, 'tasks': [], 'tests': []}
+                for task_index in range(scale['tasks_per_module']):
+                    # Every module ends with its quiz when it has tests
+                    last = task_index == scale['tasks_per_module'] - 1
+                    task_type = 'quiz' if last and scale['tests_per_module'] else rng.choice(TASK_TYPES)
+                    module['tasks'].append({'id': new_id(rng), 'type': task_type, 'order_index': task_index + 1})
+                for _ in range(scale['tests_per_module']):
+                    module['tests'].append({'id': new_id(rng),
+                                            'questions': [new_id(rng) for _ in range(scale['questions_per_test'])]})
+                course['modules'].append(module)
+            self.courses.append(course)
+
+        # (student index, course index, enrolled_at, status)
+        self.enrollments = []
+        per_student = min(scale['enrollments_per_student'], len(self.courses))
+        for student_index in range(len(self.students)):
+            for course_index in rng.sample(range(len(self.courses)), per_student):
+                roll = rng.random()
+                status = 'active' if roll < 0.85 else 'completed' if roll < 0.95 else 'dropped'
+                enrolled_at = self._moment(rng, self.term_start, self.term_start + timedelta(days=30))
+                self.enrollments.append((student_index, course_index, enrolled_at, status))
+
+        self.conversations = []
+        for enrollment_index, (student_index, course_index, enrolled_at, status) in enumerate(self.enrollments):
+            first_of_student = enrollment_index == 0 or self.enrollments[enrollment_index - 1][0] != student_index
+            if first_of_student and rng.random() < scale['conversation_ratio']:
+                self.conversations.append((student_index, course_index, enrolled_at))
+
+    def _activity(self, enrollment_index):
+        """Per-task work of one enrollment; regenerated identically for every table that needs it"""
+        student_index, course_index, enrolled_at, status = self.enrollments[enrollment_index]
+        rng = self._sub_rng('enrollment', enrollment_index)
+        ratio = 1.0 if status == 'completed' else self.scale['progress_ratio']
+        activity = []
+        for module in self.courses[course_index]['modules']:
+            for task in module['tasks']:
+                if rng.random() >= ratio:
+                    continue
+                started = self._moment(rng, enrolled_at)
+                completed = status == 'completed' or rng.random() < 0.7
+                activity.append({
+                    'id': new_id(rng),
+                    'module': module,
+                    'task': task,
+                    'started_at': started,
+                    'completed_at': self._moment(rng, started) if completed else None,
+                    'score': round(rng.uniform(40, 100), 2) if task['type'] == 'quiz' else None,
+                    'attempts': rng.randint(1, self.scale['max_quiz_attempts']) if task['type'] == 'quiz' else 0,
+                    'submitted': task['type'] == 'assignment' and rng.random() < self.scale['submission_ratio'],
+                    'rng_state': rng.random(),
+                })
+        return activity
+
+    def _messages(self, conversation_index):
+        student_index, course_index, started = self.conversations[conversation_index]
+        rng = self._sub_rng('conversation', conversation_index)
+        student = self.students[student_index]
+        teacher = self.courses[course_index]['teacher']
+        count = max(1, int(rng.gauss(self.scale['messages_per_conversation'], 3)))
+        moment = started
+        messages = []
+        for _ in range(count):
+            moment = moment + timedelta(minutes=rng.randint(1, 60 * 24))
+            messages.append((new_id(rng), rng.choice([student, teacher]), rng.choice(SENTENCES), min(moment, self.now)))
+        return student, teacher, messages
+
+    # Tables
+
+    def tables(self):
+        """Yield (table, columns, rows) in load order; rows are generated lazily"""
+        for table, columns in COLUMNS.items():
+            method = getattr(self, '_rows_' + table.replace('.', '_'))
+            yield table, columns, self._counted(table, method())
+
+    def _counted(self, table, rows):
+        self.counts[table] = 0
+        for row in rows:
+            self.counts[table] += 1
+            yield row
+
+    def _people(self):
+        for index, admin in enumerate(self.admins):
+            yield admin, f'Admin {index + 1}', f'admin{index + 1}@school.test', 'admin'
+        for index, teacher in enumerate(self.teachers):
+            yield teacher, f'Teacher {index + 1}', f'teacher{index + 1}@school.test', 'teacher'
+        for index, student in enumerate(self.students):
+            yield student, f'Student {index + 1}', f'student{index + 1}@school.test', 'student'
+
+    def _rows_auth_users(self):
+        for person_id, name, email, role in self._people():
+            yield (person_id, email, iso(self.term_start))
+
+    def _rows_profiles(self):
+        for person_id, name, email, role in self._people():
+            yield (person_id, name, email, self.password_hash, role, iso(self.term_start))
+
+    def _rows_courses(self):
+        rng = self._sub_rng('courses', 0)
+        for index, course in enumerate(self.courses):
+            subject = SUBJECTS[index % len(SUBJECTS)]
+            yield (course['id'], f'{subject} {index + 1}', f'An introduction to {subject.lower()}.', subject,
+                   rng.choice(LEVELS), f"{len(course['modules'])} weeks", course['teacher'], 'active',
+                   self.term_start.date().isoformat(), (self.now + timedelta(days=14)).date().isoformat(),
+                   iso(self.term_start), iso(self.term_start))
+
+    def _rows_modules(self):
+        for course in self.courses:
+            for module in course['modules']:
+                yield (module['id'], course['id'], f"Module {module['order_index']}", 'Module overview',
+                       module['order_index'], '1 week', iso(self.term_start))
+
+    def _rows_tasks(self):
+        for course in self.courses:
+            for module in course['modules']:
+                for task in module['tasks']:
+                    due_date = None
+                    if task['type'] == 'assignment':
+                        due_date = (self.term_start + timedelta(days=7 * (module['order_index'] + 1))).date().isoformat()
+                    yield (task['id'], module['id'], task['type'], f"{task['type'].title()} {task['order_index']}",
+                           f"{task['type'].title()} for module {module['order_index']}", task['order_index'], 10,
+                           70, 3, due_date, '30 minutes', iso(self.term_start))
+
+    def _rows_tests(self):
+        for course in self.courses:
+            for module in course['modules']:
+                for index, test in enumerate(module['tests']):
+                    yield (test['id'], module['id'], f"Module {module['order_index']} quiz", 'End of module quiz',
+                           'quiz', index + 1, 30, 70, 3, True, True, True, iso(self.term_start), iso(self.term_start))
+
+    def _rows_questions(self):
+        for course in self.courses:
+            for module in course['modules']:
+                for test in module['tests']:
+                    for index, question_id in enumerate(test['questions']):
+                        yield (question_id, test['id'], f'Question {index + 1}', 'multiple_choice',
+                               ['Option A', 'Option B', 'Option C', 'Option D'], 'Option A', 1, index + 1,
+                               iso(self.term_start))
+
+    def _rows_enrollments(self):
+        rng = self._sub_rng('enrollments', 0)
+        for student_index, course_index, enrolled_at, status in self.enrollments:
+            completed_at = self._moment(rng, enrolled_at) if status == 'completed' else None
+            percentage = 100 if status == 'completed' else round(rng.uniform(0, 95), 2)
+            yield (new_id(rng), self.students[student_index], self.courses[course_index]['id'], iso(enrolled_at),
+                   status, percentage, iso(completed_at))
+
+    def _rows_progress(self):
+        for enrollment_index, (student_index, course_index, _, _) in enumerate(self.enrollments):
+            for item in self._activity(enrollment_index):
+                status = 'completed' if item['completed_at'] else 'in_progress'
+                yield (item['id'], self.students[student_index], self.courses[course_index]['id'], item['module']['id'],
+                       item['task']['id'], status, 100 if item['completed_at'] else 50, iso(item['completed_at']),
+                       item['score'], iso(item['started_at']), iso(item['completed_at'] or item['started_at']))
+
+    def _rows_quiz_attempts(self):
+        total = self.scale['questions_per_test']
+        for enrollment_index, (student_index, course_index, _, _) in enumerate(self.enrollments):
+            for item in self._activity(enrollment_index):
+                rng = random.Random(item['rng_state'])
+                moment = item['started_at']
+                for attempt in range(item['attempts']):
+                    last = attempt == item['attempts'] - 1
+                    score = item['score'] if last else round(rng.uniform(20, 69), 2)
+                    correct = int(round(score / 100 * total))
+                    moment = self._moment(rng, moment, max(moment, item['completed_at'] or self.now))
+                    yield (new_id(rng), self.students[student_index], self.courses[course_index]['id'],
+                           item['module']['id'], item['task']['id'], score, score >= 70, {'submitted': True},
+                           total, correct, iso(moment), iso(moment), iso(moment))
+
+    def _rows_submissions(self):
+        for enrollment_index, (student_index, _, _, _) in enumerate(self.enrollments):
+            for item in self._activity(enrollment_index):
+                if not item['submitted']:
+                    continue
+                rng = random.Random(item['rng_state'])
+                submitted_at = item['completed_at'] or item['started_at']
+                graded = rng.random() < 0.6
+                yield (new_id(rng), self.students[student_index], item['task']['id'],
+                       f"https://storage.school.test/submissions/{item['id']}.pdf", 'assignment.pdf',
+                       rng.randint(20000, 5000000), 'application/pdf', iso(submitted_at),
+                       'graded' if graded else 'submitted', round(rng.uniform(50, 100), 2) if graded else None,
+                       'Good work.' if graded else None, iso(submitted_at), iso(submitted_at))
+
+    def _rows_conversations(self):
+        for index, (student_index, course_index, started) in enumerate(self.conversations):
+            student, teacher, messages = self._messages(index)
+            yield (new_id(self._sub_rng('conversation-id', index)), 'Course question', iso(started),
+                   iso(messages[-1][3]), iso(messages[-1][3]), messages[-1][2][:200], messages[-1][1], student)
+
+    def _rows_conversation_participants(self):
+        for index, (student_index, course_index, started) in enumerate(self.conversations):
+            conversation_id = new_id(self._sub_rng('conversation-id', index))
+            student, teacher, messages = self._messages(index)
+            rng = self._sub_rng('participants', index)
+            for user in (student, teacher):
+                # Each participant has read up to a random point of the conversation
+                read_upto = rng.randint(0, len(messages))
+                last_read_at = messages[read_upto - 1][3] if read_upto else None
+                unread = sum(1 for message in messages[read_upto:] if message[1] != user)
+                yield (new_id(rng), conversation_id, user, iso(started), iso(last_read_at), unread)
+
+    def _rows_messages(self):
+        for index in range(len(self.conversations)):
+            conversation_id = new_id(self._sub_rng('conversation-id', index))
+            student, teacher, messages = self._messages(index)
+            for message_id, sender, content, moment in messages:
+                yield (message_id, conversation_id, sender, content, 'text', iso(moment), None, False)
+
+    def sample(self):
+        """Ids of a student, the course they are enrolled in and its teacher, for benchmarks"""
+        student_index, course_index, _, _ = self.enrollments[0]
+        course = self.courses[course_index]
+        module = course['modules'][0]
+        quiz = next((task for task in module['tasks'] if task['type'] == 'quiz'), module['tasks'][0])
+        lesson = next((task for task in module['tasks'] if task['type'] != 'quiz'), module['tasks'][0])
+        return {
+            'admin_id': self.admins[0] if self.admins else None,
+            'teacher_id': course['teacher'],
+            'student_id': self.students[student_index],
+            'course_id': course['id'],
+            'module_id': module['id'],
+            'task_id': quiz['id'],
+            'lesson_task_id': lesson['id'],
+            'test_id': module['tests'][0]['id'] if module['tests'] else None,
+        }
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def write_csv(generator, directory):
+    """Write one CSV per table plus load.sql, which COPYs them into Postgres in order"""
+    os.makedirs(directory, exist_ok=True)
+    copy_lines = []
+    for table, columns, rows in generator.tables():
+        file_name = table.replace('.', '_') + '.csv'
+        with open(os.path.join(directory, file_name), 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([csv_value(value) for value in row])
+        copy_lines.append(f"\\copy {table} ({', '.join(columns)}) FROM '{file_name}' WITH (FORMAT csv, HEADER true)")
+        print(f"  {table}: {generator.counts[table]} rows")
+
+    with open(os.path.join(directory, 'load.sql'), 'w', encoding='utf-8') as load_file:
+        load_file.write('-- Generated by generate_dataset.py. Run from this directory after the schema files\n')
+        load_file.write('-- (see migrations/local_postgres_bootstrap.sql): psql "$DATABASE_URL" -f load.sql\n')
+        load_file.write('BEGIN;\n')
+        for table in TRIGGER_TABLES:
+            load_file.write(f'ALTER TABLE {table} DISABLE TRIGGER USER;\n')
+        load_file.write('\n'.join(copy_lines) + '\n')
+        for table in TRIGGER_TABLES:
+            load_file.write(f'ALTER TABLE {table} ENABLE TRIGGER USER;\n')
+        load_file.write('COMMIT;\nANALYZE;\n')
+
+
+def load_offline(generator, client):
+    """Bulk-load the dataset into an OfflineClient"""
+    for table, columns, rows in generator.tables():
+        if table not in client.tables:
+            # auth.users is not modelled offline
+            for _ in rows:
+                pass
+            continue
+        client.bulk_load(table, columns, rows)
+        print(f"  {table}: {generator.counts[table]} rows")
+
+
+def add_scale_arguments(parser):
+    """Options shared by this script and the benchmark"""
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small', help='base dataset size')
+    parser.add_argument('--seed', type=int, default=42, help='random seed, the same seed gives the same data')
+    for name, value in PRESETS['small'].items():
+        parser.add_argument('--' + name.replace('_', '-'), dest=name, type=type(value), default=None,
+                            help=f'override the preset (small: {value})')
+
+
+def scale_from_args(args):
+    scale = dict(PRESETS[args.preset])
+    for name in PRESETS['small']:
+        if getattr(args, name, None) is not None:
+            scale[name] = getattr(args, name)
+    return scale
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic school for load tests.')
+    add_scale_arguments(parser)
+    parser.add_argument('--format', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--output', required=True, help='directory for csv, database file for sqlite')
+    args = parser.parse_args(argv)
+
+    generator = SchoolGenerator(scale_from_args(args), seed=args.seed)
+    print(f"Generating {args.preset} dataset ({generator.scale['students']} students) into {args.output}")
+    if args.format == 'csv':
+        write_csv(generator, args.output)
+    else:
+        from offline_backend import OfflineClient
+        load_offline(generator, OfflineClient(args.output))
+    print(f"Done. Every account's password is '{DEFAULT_PASSWORD}'.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
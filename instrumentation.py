@@ -0,0 +1,193 @@
+"""
+Per-request instrumentation of backend queries.
+
+instrument_client() wraps a Supabase client (or the offline/hybrid stand-ins)
+so that every .execute() made through table() or rpc() is timed. Queries made
+while handling a request are collected on flask.g and reported in a
+Server-Timing header, an optional HTML debug panel (QUERY_DEBUG_PANEL=1) and a
+per-route query budget check. Over-budget requests log a warning, or raise
+QueryBudgetExceeded in test mode (app.testing or QUERY_BUDGET_STRICT=1).
+
+Other modules can subscribe to every query, including ones made outside a
+request, by appending observer(table, operation, duration, rows, failed) to
+query_observers.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context, request
+from markupsafe import escape
+
+logger = logging.getLogger(__name__)
+
+WRITE_OPERATIONS = ('insert', 'update', 'upsert', 'delete')
+
+# Called as observer(table, operation, duration_seconds, rows, failed) for every query
+query_observers = []
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in test mode when a request makes more backend queries than its budget"""
+
+
+def instrument_client(client):
+    """Wrap a client so that its queries are recorded"""
+    if isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+class InstrumentedClient:
+    """Proxy around a Supabase client that times every table() and rpc() query"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, table_name):
+        return InstrumentedQuery(self._client.table(table_name), table_name, 'select')
+
+    from_ = table
+
+    def rpc(self, fn, params=None, *args, **kwargs):
+        return InstrumentedQuery(self._client.rpc(fn, params or {}, *args, **kwargs), f'rpc:{fn}', 'rpc')
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class InstrumentedQuery:
+    """Proxy around a request builder; follows the chain and times execute()"""
+
+    __slots__ = ('_builder', '_table', '_operation')
+
+    def __init__(self, builder, table, operation):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name):
+        attribute = getattr(self._builder, name)
+        operation = name if name in WRITE_OPERATIONS else self._operation
+        if not callable(attribute):
+            # e.g. the not_ property
+            return self._wrap(attribute, operation)
+
+        def call(*args, **kwargs):
+            return self._wrap(attribute(*args, **kwargs), operation)
+        return call
+
+    def _wrap(self, result, operation):
+        if hasattr(result, 'execute'):
+            return InstrumentedQuery(result, self._table, operation)
+        return result
+
+    def execute(self):
+        started = time.perf_counter()
+        rows = 0
+        failed = True
+        try:
+            response = self._builder.execute()
+            data = getattr(response, 'data', None)
+            rows = len(data) if isinstance(data, list) else (1 if data else 0)
+            failed = False
+            return response
+        finally:
+            record_query(self._table, self._operation, time.perf_counter() - started, rows, failed)
+
+
+def record_query(table, operation, duration, rows, failed=False):
+    """Record one backend query for the current request and notify observers"""
+    for observer in query_observers:
+        observer(table, operation, duration, rows, failed)
+    if has_request_context():
+        queries = g.get('backend_queries')
+        if queries is not None:
+            queries.append((table, operation, duration, rows, failed))
+
+
+def summarize(queries):
+    """Group queries by (table, operation): count, total seconds and rows"""
+    summary = OrderedDict()
+    for table, operation, duration, rows, failed in queries:
+        entry = summary.setdefault((table, operation), [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] += rows
+    return sorted(summary.items(), key=lambda item: item[1][0], reverse=True)
+
+
+def parse_budgets(value):
+    """Parse "endpoint=limit,endpoint=limit" into a dict"""
+    budgets = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            endpoint, limit = item.split('=', 1)
+            budgets[endpoint.strip()] = int(limit)
+    return budgets
+
+
+class QueryInstrumentation:
+    """Flask extension that reports the queries of each request"""
+
+    def __init__(self, app=None):
+        self.default_budget = int(os.getenv('QUERY_BUDGET_DEFAULT', '50'))
+        self.budgets = parse_budgets(os.getenv('QUERY_BUDGETS'))
+        self.strict = os.getenv('QUERY_BUDGET_STRICT', 'false').lower() in ('1', 'true', 'yes')
+        self.debug_panel = os.getenv('QUERY_DEBUG_PANEL', 'false').lower() in ('1', 'true', 'yes')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.extensions['query_instrumentation'] = self
+
+    def budget_for(self, endpoint):
+        return self.budgets.get(endpoint, self.default_budget)
+
+    def _before_request(self):
+        g.backend_queries = []
+        g.request_started = time.perf_counter()
+
+    def _after_request(self, response):
+        queries = g.get('backend_queries')
+        if queries is None:
+            return response
+
+        total = (time.perf_counter() - g.request_started) * 1000
+        backend = sum(query[2] for query in queries) * 1000
+        response.headers.add('Server-Timing', f'db;dur={backend:.1f};desc="{len(queries)} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total:.1f}')
+
+        endpoint = request.endpoint or 'unknown'
+        budget = self.budget_for(endpoint)
+        if budget and len(queries) > budget:
+            top = ', '.join(f'{table}.{operation} x{count}' for (table, operation), (count, _, _) in summarize(queries)[:3])
+            message = f"{endpoint} made {len(queries)} backend queries (budget {budget}): {top}"
+            if self.strict or current_app.testing:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        if self.debug_panel and response.mimetype == 'text/html' and not response.direct_passthrough:
+            self._inject_panel(response, queries, backend, total, budget)
+        return response
+
+    def _inject_panel(self, response, queries, backend, total, budget):
+        rows = ''.join(
+            f'<tr><td>{escape(table)}</td><td>{escape(operation)}</td><td>{count}</td>'
+            f'<td>{seconds * 1000:.1f}</td><td>{row_count}</td></tr>'
+            for (table, operation), (count, seconds, row_count) in summarize(queries)
+        )
+        panel = (
+            '<div id="query-debug-panel" style="position:fixed;bottom:0;right:0;z-index:9999;max-height:40vh;'
+            'overflow:auto;background:#111;color:#eee;font:12px monospace;padding:8px;opacity:.92">'
+            f'<strong>{len(queries)} queries (budget {budget}) - db {backend:.1f} ms / total {total:.1f} ms</strong>'
+            '<table><tr><th>table</th><th>op</th><th>calls</th><th>ms</th><th>rows</th></tr>'
+            f'{rows}</table></div>'
+        )
+        html = response.get_data(as_text=True)
+        if '</body>' in html:
+            response.set_data(html.replace('</body>', panel + '</body>', 1))
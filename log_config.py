@@ -0,0 +1,118 @@
+"""
+Non-blocking, leveled logging for the web app.
+
+configure_logging() puts a QueueHandler on the root logger, so request threads
+only enqueue records; a QueueListener thread formats them and writes to stdout.
+Modules log through logging.getLogger(__name__), and keyword context passed via
+extra={...} is written as key=value pairs (or JSON fields with LOG_FORMAT=json).
+
+LOG_LEVEL sets the default level (INFO), LOG_LEVELS overrides it per logger,
+e.g. "app=DEBUG,app.otp=WARNING,werkzeug=WARNING". Request and task payload
+dumps go through log_payload() and are only written when LOG_PAYLOADS=true and
+the logger is at DEBUG.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Attributes every LogRecord has; anything else was passed through extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+
+
+class KeyValueFormatter(logging.Formatter):
+    """timestamp level logger message key=value ..."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = ' '.join(f'{key}={value!r}' if isinstance(value, str) and ' ' in value else f'{key}={value}'
+                          for key, value in record_fields(record).items())
+        return f'{line} {fields}' if fields else line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting, tracebacks included, to the listener thread's formatter"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Tracebacks can't cross the queue lazily; render them now
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(value):
+    """Parse "logger=LEVEL,logger=LEVEL" into a dict"""
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def payloads_enabled():
+    return os.getenv('LOG_PAYLOADS', 'false').lower() in ('1', 'true', 'yes')
+
+
+def log_payload(logger, message, **payload):
+    """Debug dump of a request or record, off unless LOG_PAYLOADS is set"""
+    if payloads_enabled() and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(message, extra=payload)
+
+
+def configure_logging():
+    """Route all logging through a queue and a single writer thread; safe to call twice"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text') == 'json' else KeyValueFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.getenv('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
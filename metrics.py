@@ -0,0 +1,225 @@
+"""
+Prometheus metrics in the text exposition format, served at /metrics.
+
+Labels are kept to bounded values: Flask endpoint names (never raw URLs with
+course/module ids), table names and query operations. Gauges whose value is
+read on demand (store sizes, queue lengths) are registered as callbacks, and
+caches report their hit/miss counters through register_cache().
+
+Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from flask import Response, abort, g, request
+
+logger = logging.getLogger(__name__)
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+                                for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackMetric(Metric):
+    """Metric read when /metrics is scraped; callback returns a number or {label values: number}"""
+
+    def __init__(self, name, documentation, callback, labels=(), kind='gauge'):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self.kind = kind
+
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error("Error collecting metric %s: %s", self.name, e)
+            return self.header()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}'
+                                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        lines = self.header()
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", format_value(bound))])} '
+                             f'{bucket_count}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Metrics:
+    """Registry of the app's metrics plus the Flask hooks that feed the request metrics"""
+
+    def __init__(self, app=None):
+        self._metrics = []
+        self._caches = {}
+        self.requests = self.histogram('lms_http_request_duration_seconds', 'Request latency by Flask endpoint',
+                                       ('endpoint', 'method', 'status'))
+        self.in_flight = self.gauge('lms_http_requests_in_flight', 'Requests currently being handled')
+        self.queries = self.histogram('lms_backend_query_duration_seconds', 'Backend query latency by table and operation',
+                                      ('table', 'operation'), buckets=QUERY_BUCKETS)
+        self.query_errors = self.counter('lms_backend_query_errors_total', 'Backend queries that raised',
+                                         ('table', 'operation'))
+        self.query_rows = self.counter('lms_backend_query_rows_total', 'Rows returned by backend queries',
+                                       ('table', 'operation'))
+        self.callback_counter('lms_cache_hits_total', 'Cache hits by cache',
+                            lambda: {(name,): stats()[0] for name, stats in self._caches.items()}, ('cache',))
+        self.callback_counter('lms_cache_misses_total', 'Cache misses by cache',
+                            lambda: {(name,): stats()[1] for name, stats in self._caches.items()}, ('cache',))
+        self.callback_gauge('lms_cache_hit_ratio', 'Cache hit ratio by cache', self._hit_ratios, ('cache',))
+        if app is not None:
+            self.init_app(app)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def callback_gauge(self, name, documentation, callback, labels=()):
+        return self._register(CallbackMetric(name, documentation, callback, labels))
+
+    def callback_counter(self, name, documentation, callback, labels=()):
+        return self._register(CallbackMetric(name, documentation, callback, labels, kind='counter'))
+
+    def register_cache(self, name, stats):
+        """Report a cache's hit ratio; stats() returns (hits, misses)"""
+        self._caches[name] = stats
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _hit_ratios(self):
+        ratios = {}
+        for name, stats in self._caches.items():
+            hits, misses = stats()
+            ratios[(name,)] = hits / (hits + misses) if hits + misses else 0.0
+        return ratios
+
+    def observe_query(self, table, operation, duration, rows, failed):
+        """Observer for instrumentation.query_observers"""
+        self.queries.observe(duration, table, operation)
+        self.query_rows.inc(table, operation, amount=rows)
+        if failed:
+            self.query_errors.inc(table, operation)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    # Flask integration
+
+    def init_app(self, app, path='/metrics'):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule(path, 'metrics', self._metrics_view)
+        app.extensions['metrics'] = self
+
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        self.in_flight.dec()
+        status = g.pop('metrics_status', 500)
+        self.requests.observe(time.perf_counter() - started, request.endpoint or 'unmatched', request.method,
+                              str(status))
+
+    def _metrics_view(self):
+        token = os.getenv('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
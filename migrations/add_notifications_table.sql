@@ -0,0 +1,107 @@
+-- Notifications and per-user unread counters
+--
+-- One row per recipient is written when an event happens (fan-out on write);
+-- notification_counters.unread_count is kept up to date by a trigger so the
+-- unread badge is a primary key lookup instead of a COUNT(*).
+CREATE TABLE IF NOT EXISTS public.notifications (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES profiles(id) ON DELETE CASCADE,
+    type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    priority TEXT NOT NULL DEFAULT 'medium' CHECK (priority IN ('low', 'medium', 'high')),
+    course_id UUID REFERENCES courses(id) ON DELETE CASCADE,
+    course_name TEXT,
+    link TEXT,
+    read_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Newest-first pages per user (keyset on created_at, ties broken on id)
+DROP INDEX IF EXISTS idx_notifications_user_created_at;
+CREATE INDEX IF NOT EXISTS idx_notifications_user_created_at_id ON public.notifications(user_id, created_at DESC, id DESC);
+-- Mark-all-read only touches the unread rows
+CREATE INDEX IF NOT EXISTS idx_notifications_user_unread ON public.notifications(user_id) WHERE read_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS public.notification_counters (
+    user_id UUID PRIMARY KEY REFERENCES profiles(id) ON DELETE CASCADE,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Keep unread_count in step with inserts, reads/unreads and deletes. The triggers
+-- run once per statement and read the changed rows from transition tables, so a
+-- bulk insert or mark-all-read is one counter write per user, not one per row.
+CREATE OR REPLACE FUNCTION update_notification_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO notification_counters (user_id, unread_count, updated_at)
+        SELECT user_id, COUNT(*), NOW() FROM new_rows WHERE read_at IS NULL GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread_count = notification_counters.unread_count + EXCLUDED.unread_count, updated_at = NOW();
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- +1 for every row marked unread, -1 for every row marked read
+        WITH changes AS (
+            SELECT n.user_id, SUM(CASE WHEN n.read_at IS NULL THEN 1 ELSE -1 END) AS delta
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE (o.read_at IS NULL) <> (n.read_at IS NULL)
+            GROUP BY n.user_id
+        ), decremented AS (
+            UPDATE notification_counters c
+            SET unread_count = GREATEST(c.unread_count + changes.delta, 0), updated_at = NOW()
+            FROM changes
+            WHERE c.user_id = changes.user_id AND changes.delta < 0
+        )
+        INSERT INTO notification_counters (user_id, unread_count, updated_at)
+        SELECT user_id, delta, NOW() FROM changes WHERE delta > 0
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread_count = notification_counters.unread_count + EXCLUDED.unread_count, updated_at = NOW();
+    ELSE
+        UPDATE notification_counters c
+        SET unread_count = GREATEST(c.unread_count - d.unread, 0), updated_at = NOW()
+        FROM (SELECT user_id, COUNT(*) AS unread FROM old_rows WHERE read_at IS NULL GROUP BY user_id) d
+        WHERE c.user_id = d.user_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event and no column list
+DROP TRIGGER IF EXISTS trigger_update_notification_counters ON public.notifications;
+DROP TRIGGER IF EXISTS trigger_notification_counters_insert ON public.notifications;
+CREATE TRIGGER trigger_notification_counters_insert
+    AFTER INSERT ON public.notifications
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_notification_counters();
+
+DROP TRIGGER IF EXISTS trigger_notification_counters_update ON public.notifications;
+CREATE TRIGGER trigger_notification_counters_update
+    AFTER UPDATE ON public.notifications
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_notification_counters();
+
+DROP TRIGGER IF EXISTS trigger_notification_counters_delete ON public.notifications;
+CREATE TRIGGER trigger_notification_counters_delete
+    AFTER DELETE ON public.notifications
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_notification_counters();
+
+-- Notifications are written by the server with the service role; users can read their own
+ALTER TABLE public.notifications ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.notification_counters ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Users can view their own notifications" ON public.notifications;
+CREATE POLICY "Users can view their own notifications"
+    ON public.notifications
+    FOR SELECT
+    USING (auth.uid() = user_id);
+
+DROP POLICY IF EXISTS "Users can view their own notification counter" ON public.notification_counters;
+CREATE POLICY "Users can view their own notification counter"
+    ON public.notification_counters
+    FOR SELECT
+    USING (auth.uid() = user_id);
@@ -0,0 +1,37 @@
+-- Tests and questions tables
+-- These were originally created in the Supabase dashboard; this file records
+-- their structure so a fresh database (local Postgres or the offline stand-in)
+-- can be built from the SQL files alone. Safe to run on an existing project.
+
+CREATE TABLE IF NOT EXISTS public.tests (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    module_id UUID REFERENCES modules(id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    description TEXT,
+    type TEXT DEFAULT 'quiz',
+    order_index INTEGER DEFAULT 1,
+    instructions TEXT,
+    time_limit INTEGER,
+    passing_score INTEGER DEFAULT 70,
+    max_attempts INTEGER DEFAULT 3,
+    is_mandatory BOOLEAN DEFAULT true,
+    show_results BOOLEAN DEFAULT true,
+    is_active BOOLEAN DEFAULT true,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS public.questions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    test_id UUID REFERENCES tests(id) ON DELETE CASCADE,
+    question_text TEXT NOT NULL,
+    question_type TEXT DEFAULT 'multiple_choice',
+    options JSONB,
+    correct_answer TEXT,
+    points INTEGER DEFAULT 1,
+    order_index INTEGER DEFAULT 1,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_tests_module ON tests(module_id, order_index);
+CREATE INDEX IF NOT EXISTS idx_questions_test ON questions(test_id, order_index);
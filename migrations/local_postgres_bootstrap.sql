@@ -0,0 +1,71 @@
+-- Bootstrap a plain local Postgres so database_migrations.sql can be loaded
+-- without a Supabase project (used to benchmark DATA_BACKEND=postgres).
+--
+-- Load order:
+--   psql "$DATABASE_URL" -f migrations/local_postgres_bootstrap.sql
+--   psql "$DATABASE_URL" -f database_migrations.sql
+--   psql "$DATABASE_URL" -f migrations/add_quiz_attempts_table.sql
+--   psql "$DATABASE_URL" -f migrations/add_completed_at_to_quiz_attempts.sql
+--   psql "$DATABASE_URL" -f migrations/add_notifications_table.sql
+--
+-- Do NOT run this against a Supabase project, it already provides all of this.
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+-- Roles referenced by the policies and grants
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'anon') THEN
+        CREATE ROLE anon NOLOGIN;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'authenticated') THEN
+        CREATE ROLE authenticated NOLOGIN;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'service_role') THEN
+        CREATE ROLE service_role NOLOGIN BYPASSRLS;
+    END IF;
+END
+$$;
+
+-- Minimal auth schema: users table and the JWT helper functions used in policies
+CREATE SCHEMA IF NOT EXISTS auth;
+
+CREATE TABLE IF NOT EXISTS auth.users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    email TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION auth.jwt()
+RETURNS jsonb AS $$
+    SELECT coalesce(nullif(current_setting('request.jwt.claims', true), ''), '{}')::jsonb;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION auth.uid()
+RETURNS uuid AS $$
+    SELECT nullif(auth.jwt() ->> 'sub', '')::uuid;
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION auth.role()
+RETURNS text AS $$
+    SELECT auth.jwt() ->> 'role';
+$$ LANGUAGE sql STABLE;
+
+-- profiles is created in the Supabase dashboard, not in database_migrations.sql
+CREATE TABLE IF NOT EXISTS profiles (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT,
+    role TEXT NOT NULL DEFAULT 'student',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- database_migrations.sql drops policies on these tables before it drops and
+-- recreates them, so they have to exist (empty placeholders are enough)
+CREATE TABLE IF NOT EXISTS progress (id UUID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS courses (id UUID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS modules (id UUID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS tasks (id UUID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS prerequisites (id UUID PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS enrollments (id UUID PRIMARY KEY);
@@ -0,0 +1,15 @@
+-- The app now performs privileged writes with the service-role key and no
+-- longer calls disable_rls_for_admin()/enable_rls_for_admin(). Those functions
+-- run ALTER TABLE on seven tables (ACCESS EXCLUSIVE locks), so make sure
+-- regular API keys can no longer invoke them.
+REVOKE EXECUTE ON FUNCTION public.disable_rls_for_admin() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION public.enable_rls_for_admin() FROM PUBLIC, anon, authenticated;
+
+-- Restore RLS in case a request died between the two calls
+ALTER TABLE courses ENABLE ROW LEVEL SECURITY;
+ALTER TABLE modules ENABLE ROW LEVEL SECURITY;
+ALTER TABLE tasks ENABLE ROW LEVEL SECURITY;
+ALTER TABLE progress ENABLE ROW LEVEL SECURITY;
+ALTER TABLE prerequisites ENABLE ROW LEVEL SECURITY;
+ALTER TABLE enrollments ENABLE ROW LEVEL SECURITY;
+ALTER TABLE submissions ENABLE ROW LEVEL SECURITY;
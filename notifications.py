@@ -0,0 +1,136 @@
+"""
+In-app notifications.
+
+Events (grading, submissions, enrollments, new modules) write one row per
+recipient into the notifications table in bulk inserts. A trigger keeps
+notification_counters.unread_count in step, so the unread badge shown on every
+page is a single primary key read. Lists are paged newest first with a
+(created_at, id) cursor rather than an offset.
+"""
+
+import base64
+import uuid
+from datetime import datetime, timezone
+
+from postgrest.types import ReturnMethod
+
+ICONS = {
+    'grade': 'fa-graduation-cap',
+    'submission': 'fa-file-upload',
+    'enrollment': 'fa-user-plus',
+    'module': 'fa-bullhorn',
+}
+DEFAULT_ICON = 'fa-bell'
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just after a notification in newest-first order"""
+    return base64.urlsafe_b64encode(f"{row['created_at']}|{row['id']}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; ValueError if it was not made by encode_cursor"""
+    try:
+        created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        # Both end up inside a PostgREST or=() filter, so only let well-formed values through
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(notification_id))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class Notifications:
+    """Write, list and mark notifications through the service clients"""
+
+    def __init__(self, clients, batch_size=1000):
+        self.clients = clients
+        self.batch_size = batch_size
+
+    def notify(self, user_ids, type, title, message, priority='medium', course_id=None, course_name=None, link=None):
+        """Send the same notification to every user in user_ids; returns the number written"""
+        recipients = list(dict.fromkeys(str(user_id) for user_id in user_ids if user_id))
+        if not recipients:
+            return 0
+        created_at = utc_now()
+        rows = [{
+            'user_id': user_id,
+            'type': type,
+            'title': title,
+            'message': message,
+            'priority': priority,
+            'course_id': course_id,
+            'course_name': course_name,
+            'link': link,
+            'created_at': created_at
+        } for user_id in recipients]
+        with self.clients.checkout() as client:
+            for start in range(0, len(rows), self.batch_size):
+                client.table('notifications').insert(rows[start:start + self.batch_size], returning=ReturnMethod.minimal).execute()
+        return len(rows)
+
+    def course_student_ids(self, course_id):
+        """Ids of the students actively enrolled in a course, read in keyset pages"""
+        student_ids = []
+        last_id = None
+        with self.clients.checkout() as client:
+            while True:
+                query = (client.table('enrollments').select('student_id')
+                         .eq('course_id', course_id).eq('status', 'active')
+                         .order('student_id').limit(self.batch_size))
+                if last_id is not None:
+                    query = query.gt('student_id', last_id)
+                rows = query.execute().data or []
+                student_ids.extend(row['student_id'] for row in rows)
+                if len(rows) < self.batch_size:
+                    return student_ids
+                last_id = rows[-1]['student_id']
+
+    def list(self, user_id, limit=20, before=None):
+        """One page of a user's notifications, newest first; returns (items, next cursor or None).
+
+        ValueError if before is not a cursor returned by an earlier call."""
+        if before:
+            created_at, notification_id = decode_cursor(before)
+        with self.clients.checkout() as client:
+            query = (client.table('notifications')
+                     .select('id, type, title, message, priority, course_id, course_name, link, read_at, created_at')
+                     .eq('user_id', user_id)
+                     .order('created_at', desc=True)
+                     .order('id', desc=True)
+                     .limit(limit + 1))
+            if before:
+                # Notifications written in one bulk insert share created_at, so ties are broken on id
+                query = query.or_(f'created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{notification_id})')
+            rows = query.execute().data or []
+
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        items = []
+        for row in rows[:limit]:
+            row['read'] = row['read_at'] is not None
+            row['timestamp'] = row['created_at']
+            row['icon'] = ICONS.get(row['type'], DEFAULT_ICON)
+            items.append(row)
+        return items, next_cursor
+
+    def unread_count(self, user_id):
+        with self.clients.checkout() as client:
+            rows = client.table('notification_counters').select('unread_count').eq('user_id', user_id).execute().data
+        return rows[0]['unread_count'] if rows else 0
+
+    def mark_read(self, user_id, notification_id):
+        """Mark one of the user's notifications as read; True if it was unread"""
+        with self.clients.checkout() as client:
+            result = (client.table('notifications').update({'read_at': utc_now()})
+                      .eq('id', notification_id).eq('user_id', user_id).is_('read_at', 'null')
+                      .execute())
+        return bool(result.data)
+
+    def mark_all_read(self, user_id):
+        """Mark every unread notification of the user as read in one statement"""
+        with self.clients.checkout() as client:
+            (client.table('notifications').update({'read_at': utc_now()}, returning=ReturnMethod.minimal)
+             .eq('user_id', user_id).is_('read_at', 'null')
+             .execute())
@@ -0,0 +1,840 @@
+"""
+Offline stand-in for the Supabase client, backed by SQLite.
+
+Tables are built from the project's own SQL files (database_migrations.sql,
+chat_schema.sql and migrations/*.sql), so the schema follows the real one.
+OfflineClient implements the part of the query builder the app uses: select
+(including embedded resources such as "profiles!messages_sender_id_fkey(name)"
+and "!inner" joins), eq/neq/gt/gte/lt/lte/like/ilike/in_/is_/filter/not_,
+order, limit, range, single, insert, update, upsert, delete and rpc.
+
+Enable it with DATA_BACKEND=offline; OFFLINE_DATABASE picks the SQLite file
+(default: in-memory).
+"""
+
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+
+from postgrest import APIResponse
+from postgrest.exceptions import APIError
+
+from sql_backend import LOGIC_OPERATORS, RecordingQuery, UnsupportedQuery, compile_where, parse_query, quote_identifier
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Applied in order, the same way they are run against a real database
+SCHEMA_FILES = [
+    'migrations/local_postgres_bootstrap.sql',
+    'database_migrations.sql',
+    'migrations/add_tests_and_questions_tables.sql',
+    'chat_schema.sql',
+    'migrations/add_quiz_attempts_table.sql',
+    'migrations/add_completed_at_to_quiz_attempts.sql',
+    'migrations/add_notifications_table.sql',
+]
+
+# SQLite FTS5 inverted indexes standing in for the Postgres full-text (GIN) indexes, keyed by table
+OFFLINE_SEARCH_INDEXES = {
+    'messages': "CREATE VIRTUAL TABLE IF NOT EXISTS messages_search USING fts5(content, content='messages', tokenize='porter unicode61')",
+}
+
+# SQLite versions of the plpgsql triggers in chat_schema.sql and the migrations, keyed by table
+# (SQLite only has row triggers; they keep the same counts as the statement-level Postgres ones)
+OFFLINE_TRIGGERS = {'messages': [
+    '''CREATE TRIGGER IF NOT EXISTS trigger_update_conversation_last_message
+       AFTER INSERT ON messages
+       BEGIN
+           UPDATE conversations
+           SET last_message_at = NEW.created_at, last_message_preview = substr(NEW.content, 1, 200),
+               last_message_sender_id = NEW.sender_id, updated_at = NEW.created_at
+           WHERE id = NEW.conversation_id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_update_unread_counts
+       AFTER INSERT ON messages
+       BEGIN
+           UPDATE conversation_participants
+           SET unread_count = coalesce(unread_count, 0) + 1
+           WHERE conversation_id = NEW.conversation_id
+           AND user_id != NEW.sender_id;
+       END''',
+    # Keep messages_search in step, as the GIN index on messages is
+    '''CREATE TRIGGER IF NOT EXISTS trigger_messages_search_insert
+       AFTER INSERT ON messages
+       BEGIN
+           INSERT INTO messages_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_messages_search_update
+       AFTER UPDATE OF content ON messages
+       BEGIN
+           INSERT INTO messages_search (messages_search, rowid, content) VALUES ('delete', OLD.rowid, OLD.content);
+           INSERT INTO messages_search (rowid, content) VALUES (NEW.rowid, NEW.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_messages_search_delete
+       AFTER DELETE ON messages
+       BEGIN
+           INSERT INTO messages_search (messages_search, rowid, content) VALUES ('delete', OLD.rowid, OLD.content);
+       END''',
+], 'notifications': [
+    '''CREATE TRIGGER IF NOT EXISTS trigger_notification_counters_insert
+       AFTER INSERT ON notifications
+       WHEN NEW.read_at IS NULL
+       BEGIN
+           INSERT INTO notification_counters (user_id, unread_count, updated_at)
+           VALUES (NEW.user_id, 1, strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+           ON CONFLICT (user_id) DO UPDATE
+           SET unread_count = unread_count + 1, updated_at = excluded.updated_at;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_notification_counters_read
+       AFTER UPDATE OF read_at ON notifications
+       WHEN OLD.read_at IS NULL AND NEW.read_at IS NOT NULL
+       BEGIN
+           UPDATE notification_counters
+           SET unread_count = max(unread_count - 1, 0), updated_at = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')
+           WHERE user_id = NEW.user_id;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_notification_counters_unread
+       AFTER UPDATE OF read_at ON notifications
+       WHEN OLD.read_at IS NOT NULL AND NEW.read_at IS NULL
+       BEGIN
+           INSERT INTO notification_counters (user_id, unread_count, updated_at)
+           VALUES (NEW.user_id, 1, strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+           ON CONFLICT (user_id) DO UPDATE
+           SET unread_count = unread_count + 1, updated_at = excluded.updated_at;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS trigger_notification_counters_delete
+       AFTER DELETE ON notifications
+       WHEN OLD.read_at IS NULL
+       BEGIN
+           UPDATE notification_counters
+           SET unread_count = max(unread_count - 1, 0), updated_at = strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')
+           WHERE user_id = OLD.user_id;
+       END''',
+]}
+
+TABLE_CONSTRAINTS = ('constraint', 'unique', 'primary', 'check', 'foreign', 'exclude')
+
+_EMBED = re.compile(r'^(?:(\w+):)?(\w+)((?:!\w+)*)\((.*)\)$', re.S)
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def split_sql(text):
+    """Split a SQL script into statements, respecting quotes, comments and $$ bodies"""
+    statements = []
+    current = []
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if text.startswith('--', i):
+            end = text.find('\n', i)
+            i = length if end == -1 else end
+            continue
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            continue
+        if char == "'":
+            end = i + 1
+            while end < length:
+                if text[end] == "'" and text.startswith("''", end):
+                    end += 2
+                    continue
+                if text[end] == "'":
+                    break
+                end += 1
+            current.append(text[i:end + 1])
+            i = end + 1
+            continue
+        if text.startswith('$$', i):
+            end = text.find('$$', i + 2)
+            end = length if end == -1 else end + 2
+            current.append(text[i:end])
+            i = end
+            continue
+        if char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def split_top_level(text, separator=','):
+    """Split on separator, ignoring separators nested in parentheses or quotes"""
+    parts = []
+    depth = 0
+    quoted = False
+    current = []
+    for char in text:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == separator and depth == 0 and not quoted:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+def table_name(name):
+    """Strip the public schema; tables in other schemas (auth.*) are not modelled"""
+    name = name.strip().strip('"').lower()
+    if name.startswith('public.'):
+        name = name[len('public.'):]
+    return None if '.' in name else name
+
+
+def column_kind(type_sql):
+    type_sql = type_sql.lower()
+    if type_sql.startswith(('int', 'bigint', 'smallint', 'serial', 'bigserial')):
+        return 'integer'
+    if type_sql.startswith(('decimal', 'numeric', 'float', 'real', 'double')):
+        return 'real'
+    if type_sql.startswith('bool'):
+        return 'boolean'
+    if type_sql.startswith('json'):
+        return 'json'
+    if type_sql.endswith('[]'):
+        return 'json'
+    return 'text'
+
+
+def parse_default(definition):
+    """Return ('uuid'|'now'|'value', value) for a column DEFAULT clause, or None"""
+    match = re.search(r"\bDEFAULT\s+('(?:[^']|'')*'|[\w.]+\s*\((?:[^()]|\([^()]*\))*\)|[\w.+-]+)", definition, re.I)
+    if not match:
+        return None
+    token = match.group(1)
+    lowered = token.lower()
+    if 'gen_random_uuid' in lowered or 'uuid_generate' in lowered:
+        return ('uuid', None)
+    if 'now(' in lowered or 'current_timestamp' in lowered:
+        return ('now', None)
+    if lowered == 'current_date':
+        return ('today', None)
+    if token.startswith("'"):
+        value = token[1:-1].replace("''", "'")
+        return ('value', value)
+    if lowered in ('true', 'false'):
+        return ('value', lowered == 'true')
+    if lowered == 'null':
+        return None
+    try:
+        return ('value', int(token))
+    except ValueError:
+        pass
+    try:
+        return ('value', float(token))
+    except ValueError:
+        return None
+
+
+def parse_column(definition):
+    """Parse one column definition from a CREATE TABLE body"""
+    match = re.match(r'"?(\w+)"?\s+(.+)$', definition, re.S)
+    name = match.group(1).lower()
+    rest = match.group(2)
+    type_match = re.match(r'(timestamp\s+with(?:out)?\s+time\s+zone|double\s+precision|character\s+varying|[\w]+(?:\s*\([^)]*\))?(?:\[\])?)', rest, re.I)
+    type_sql = type_match.group(1) if type_match else 'text'
+    references = re.search(r'\bREFERENCES\s+([\w."]+)\s*(?:\(\s*"?(\w+)"?\s*\))?', rest, re.I)
+    return {
+        'name': name,
+        'kind': column_kind(type_sql),
+        'default': parse_default(rest),
+        'not_null': bool(re.search(r'\bNOT\s+NULL\b', rest, re.I)),
+        'primary_key': bool(re.search(r'\bPRIMARY\s+KEY\b', rest, re.I)),
+        'unique': bool(re.search(r'\bUNIQUE\b', rest, re.I)),
+        'references': (table_name(references.group(1)), (references.group(2) or 'id').lower()) if references else None,
+        'cascade': bool(re.search(r'\bON\s+DELETE\s+CASCADE\b', rest, re.I)),
+    }
+
+
+def load_schema(paths):
+    """Replay CREATE/DROP/ALTER TABLE and CREATE INDEX statements into a schema model"""
+    tables = {}
+    indexes = []
+    for path in paths:
+        with open(path, encoding='utf-8') as sql_file:
+            statements = split_sql(sql_file.read())
+
+        for statement in statements:
+            compact = ' '.join(statement.split())
+            lowered = compact.lower()
+
+            match = re.match(r'create table (if not exists )?([\w."]+)\s*\((.*)\)$', compact, re.I | re.S)
+            if match:
+                name = table_name(match.group(2))
+                if name is None or (name in tables and match.group(1)):
+                    continue
+                columns = {}
+                unique = []
+                primary_key = None
+                for item in split_top_level(match.group(3)):
+                    first_word = re.match(r'\w*', item).group(0).lower()
+                    if first_word in TABLE_CONSTRAINTS:
+                        keys = re.search(r'(unique|primary\s+key)\s*\(([^)]*)\)', item, re.I)
+                        if keys:
+                            key_columns = [column.strip().strip('"').lower() for column in keys.group(2).split(',')]
+                            if keys.group(1).lower() == 'unique':
+                                unique.append(key_columns)
+                            else:
+                                primary_key = key_columns
+                        continue
+                    column = parse_column(item)
+                    columns[column['name']] = column
+                    if column['primary_key']:
+                        primary_key = [column['name']]
+                    if column['unique'] and not column['primary_key']:
+                        unique.append([column['name']])
+                tables[name] = {'name': name, 'columns': columns, 'primary_key': primary_key or ['id'], 'unique': unique}
+                continue
+
+            match = re.match(r'drop table (if exists )?(.+?)( cascade| restrict)?$', compact, re.I)
+            if match:
+                for name in match.group(2).split(','):
+                    tables.pop(table_name(name), None)
+                continue
+
+            match = re.match(r'alter table (?:only )?([\w."]+) add column (if not exists )?(.+)$', compact, re.I)
+            if match:
+                table = tables.get(table_name(match.group(1)))
+                if table is not None:
+                    column = parse_column(match.group(3))
+                    if column['name'] not in table['columns']:
+                        table['columns'][column['name']] = column
+                continue
+
+            match = re.match(r'create (unique )?index (?:concurrently )?(?:if not exists )?(\w+) on ([\w."]+)\s*\(([^()]*)\)$', compact, re.I)
+            if match and 'using' not in lowered.split(' on ')[1]:
+                name = table_name(match.group(3))
+                if name:
+                    indexes.append((match.group(2), name, match.group(4), bool(match.group(1))))
+
+    # Foreign keys in PostgREST's default naming, used to resolve embedded resources
+    for table in tables.values():
+        table['foreign_keys'] = {}
+        for column in table['columns'].values():
+            if column['references'] and column['references'][0] in tables:
+                table['foreign_keys'][f"{table['name']}_{column['name']}_fkey"] = (column['name'], column['references'][0], column['references'][1])
+    return tables, indexes
+
+
+def table_ddl(table, tables):
+    """SQLite CREATE TABLE statement for a table from the schema model"""
+    parts = []
+    for column in table['columns'].values():
+        affinity = {'integer': 'INTEGER', 'real': 'REAL', 'boolean': 'INTEGER'}.get(column['kind'], 'TEXT')
+        part = f"{quote_identifier(column['name'])} {affinity}"
+        # Python fills in defaults for builder inserts; these cover bulk loads
+        if column['default'] and column['default'][0] == 'now':
+            part += " DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+        elif column['default'] and column['default'][0] == 'value':
+            value = column['default'][1]
+            if isinstance(value, str):
+                part += " DEFAULT '" + value.replace("'", "''") + "'"
+            else:
+                part += f" DEFAULT {int(value) if isinstance(value, bool) else value}"
+        if column['not_null']:
+            part += ' NOT NULL'
+        if column['references'] and column['references'][0] in tables:
+            target_table, target_column = column['references']
+            part += f" REFERENCES {quote_identifier(target_table)}({quote_identifier(target_column)})"
+            if column['cascade']:
+                part += ' ON DELETE CASCADE'
+        parts.append(part)
+    parts.append(f"PRIMARY KEY ({', '.join(quote_identifier(c) for c in table['primary_key'])})")
+    for key_columns in table['unique']:
+        parts.append(f"UNIQUE ({', '.join(quote_identifier(c) for c in key_columns)})")
+    return f"CREATE TABLE IF NOT EXISTS {quote_identifier(table['name'])} ({', '.join(parts)})"
+
+
+class OfflineQuery(RecordingQuery):
+    """Query builder for OfflineClient; see RecordingQuery"""
+
+
+class OfflineRpc:
+    def __init__(self, client, name, params):
+        self._client = client
+        self.name = name
+        self.params = params or {}
+
+    def execute(self):
+        return self._client._execute_rpc(self)
+
+
+class OfflineClient:
+    """SQLite-backed replacement for supabase.Client used for local load tests"""
+
+    def __init__(self, database=':memory:', schema_files=None):
+        paths = [os.path.join(BASE_DIR, path) for path in (schema_files or SCHEMA_FILES)]
+        self.tables, indexes = load_schema(paths)
+        self.database = database
+        self.functions = {}
+        # Called as listener(kind, name) for every executed query, e.g. to count them
+        self.listeners = []
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.execute('PRAGMA journal_mode = WAL' if database != ':memory:' else 'PRAGMA journal_mode = MEMORY')
+
+        with self._lock:
+            for table in self._creation_order():
+                self._conn.execute(table_ddl(table, self.tables))
+            for name, table, columns, unique in indexes:
+                if table in self.tables:
+                    self._conn.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {quote_identifier(name)} "
+                                       f"ON {quote_identifier(table)} ({columns})")
+            for table, search_index in OFFLINE_SEARCH_INDEXES.items():
+                if table in self.tables:
+                    self._conn.execute(search_index)
+            for triggers in OFFLINE_TRIGGERS.values():
+                for trigger in triggers:
+                    self._conn.execute(trigger)
+
+        # Python versions of the plpgsql functions the app calls through rpc()
+        self.register_function('create_conversation_with_message', self._create_conversation_with_message)
+        self.register_function('search_messages', self._search_messages)
+
+    def table(self, table_name):
+        return OfflineQuery(self, table_name)
+
+    from_ = table
+
+    def rpc(self, name, params=None):
+        return OfflineRpc(self, name, params)
+
+    def register_function(self, name, function):
+        """Make function(conn, **params) callable through rpc(name, params)"""
+        self.functions[name] = function
+
+    def bulk_load(self, table_name, columns, rows, batch_size=5000):
+        """Insert pre-generated rows directly, without firing triggers (like COPY with triggers disabled)"""
+        table = self.tables[table_name]
+        definitions = [table['columns'][column] for column in columns]
+        sql = (f"INSERT INTO {quote_identifier(table_name)} ({', '.join(quote_identifier(c) for c in columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        loaded = 0
+        with self._lock:
+            trigger_names = [re.search(r'CREATE TRIGGER IF NOT EXISTS (\w+)', trigger).group(1)
+                             for trigger in OFFLINE_TRIGGERS.get(table_name, [])]
+            for name in trigger_names:
+                self._conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            try:
+                batch = []
+                for row in rows:
+                    batch.append([self._encode(definition, value) for definition, value in zip(definitions, row)])
+                    if len(batch) >= batch_size:
+                        self._insert_batch(sql, batch)
+                        loaded += len(batch)
+                        batch = []
+                if batch:
+                    self._insert_batch(sql, batch)
+                    loaded += len(batch)
+            finally:
+                for trigger in OFFLINE_TRIGGERS.get(table_name, []):
+                    self._conn.execute(trigger)
+            if table_name in OFFLINE_SEARCH_INDEXES:
+                # The search triggers were off too; index the loaded rows in one pass
+                self._conn.execute(f"INSERT INTO {table_name}_search ({table_name}_search) VALUES ('rebuild')")
+        return loaded
+
+    def _insert_batch(self, sql, batch):
+        self._conn.execute('BEGIN')
+        try:
+            self._conn.executemany(sql, batch)
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    def __getattr__(self, name):
+        raise AttributeError(f"'{name}' is not available with DATA_BACKEND=offline")
+
+    # Execution
+
+    def _notify(self, kind, name):
+        for listener in self.listeners:
+            listener(kind, name)
+
+    def _execute_rpc(self, rpc):
+        self._notify('rpc', rpc.name)
+        function = self.functions.get(rpc.name)
+        if function is None:
+            raise APIError({'message': f'Could not find the function public.{rpc.name}', 'code': 'PGRST202'})
+        with self._lock:
+            # Like postgrest-py, take the result as is: functions may return an object rather than rows
+            return APIResponse.model_construct(data=function(self._conn, **rpc.params), count=None)
+
+    def _execute(self, recorded):
+        if recorded.table not in self.tables:
+            raise APIError({'message': f'relation "public.{recorded.table}" does not exist', 'code': '42P01'})
+        query = parse_query(recorded.table, recorded.calls)
+        self._notify(query['action'], recorded.table)
+        handler = getattr(self, f"_run_{query['action']}")
+        try:
+            with self._lock:
+                if query['action'] == 'select':
+                    data, count = handler(query)
+                else:
+                    # Writes are atomic per request, as they are through PostgREST
+                    self._conn.execute('BEGIN')
+                    try:
+                        data, count = handler(query)
+                    except BaseException:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                    self._conn.execute('COMMIT')
+        except sqlite3.IntegrityError as e:
+            code = '23505' if 'UNIQUE' in str(e) else '23503' if 'FOREIGN KEY' in str(e) else '23502'
+            raise APIError({'message': str(e), 'code': code})
+        except sqlite3.Error as e:
+            raise APIError({'message': str(e), 'code': 'XX000'})
+
+        if query['single']:
+            if len(data) == 1:
+                data = data[0]
+            elif not data and query['single'] == 'maybe_single':
+                data = None
+            else:
+                raise APIError({'message': 'JSON object requested, multiple (or no) rows returned', 'code': 'PGRST116'})
+        return APIResponse(data=data, count=count)
+
+    def _run_select(self, query):
+        table = self.tables[query['table']]
+        items = self._parse_select(query['columns'])
+        has_inner = any(item['inner'] for item in items if item['type'] == 'embed')
+
+        where_sql, params = self._where(table, query['filters'])
+        sql = f"SELECT * FROM {quote_identifier(table['name'])}{where_sql}"
+        if query['order']:
+            sql += ' ORDER BY ' + ', '.join(self._order_term(table, term) for term in query['order'])
+        if not has_inner:
+            sql += self._limit_sql(query)
+        rows = [self._decode(table, row) for row in self._conn.execute(sql, params)]
+
+        rows = self._embed(table, rows, items)
+        count = None
+        if has_inner:
+            if query['count']:
+                count = len(rows)
+            offset = query['offset'] or 0
+            rows = rows[offset:offset + query['limit'] if query['limit'] is not None else None]
+        elif query['count']:
+            count = self._conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(table['name'])}{where_sql}", params).fetchone()[0]
+        return [self._project(row, items) for row in rows], count
+
+    def _run_insert(self, query):
+        table = self.tables[query['table']]
+        rows = query['payload'] if isinstance(query['payload'], list) else [query['payload']]
+        return [self._insert_row(table, row) for row in rows], (len(rows) if query['count'] else None)
+
+    def _run_upsert(self, query):
+        table = self.tables[query['table']]
+        options = query['options']
+        rows = query['payload'] if isinstance(query['payload'], list) else [query['payload']]
+        conflict = options.get('on_conflict') or ','.join(table['primary_key'])
+        conflict_columns = [column.strip() for column in conflict.split(',') if column.strip()]
+
+        result = []
+        for row in rows:
+            key_filters = [(column, 'eq', row.get(column), False) for column in conflict_columns]
+            where_sql, params = self._where(table, key_filters)
+            existing = self._conn.execute(f"SELECT * FROM {quote_identifier(table['name'])}{where_sql}", params).fetchone()
+            if existing is None:
+                result.append(self._insert_row(table, row))
+            elif not options.get('ignore_duplicates'):
+                changes = {column: value for column, value in row.items() if column not in conflict_columns}
+                if options.get('default_to_null', True):
+                    for column in table['columns']:
+                        if column not in row and column not in conflict_columns and column not in table['primary_key']:
+                            changes[column] = None
+                result.extend(self._update_rows(table, changes, key_filters))
+        return result, (len(result) if query['count'] else None)
+
+    def _run_update(self, query):
+        table = self.tables[query['table']]
+        rows = self._update_rows(table, query['payload'], query['filters'])
+        return rows, (len(rows) if query['count'] else None)
+
+    def _run_delete(self, query):
+        table = self.tables[query['table']]
+        where_sql, params = self._where(table, query['filters'])
+        rows = [self._decode(table, row) for row in
+                self._conn.execute(f"DELETE FROM {quote_identifier(table['name'])}{where_sql} RETURNING *", params)]
+        return rows, (len(rows) if query['count'] else None)
+
+    # Helpers
+
+    def _creation_order(self):
+        """Tables ordered so that referenced tables are created first"""
+        ordered = []
+        seen = set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for column in self.tables[name]['columns'].values():
+                target = column['references'][0] if column['references'] else None
+                if target in self.tables and target != name:
+                    visit(target)
+            ordered.append(self.tables[name])
+
+        for name in self.tables:
+            visit(name)
+        return ordered
+
+    def _create_conversation_with_message(self, conn, p_creator_id, p_participant_ids, p_title=None, p_content=None):
+        """create_conversation_with_message() from chat_schema.sql"""
+        conn.execute('BEGIN')
+        try:
+            conversation = self._insert_row(self.tables['conversations'], {'created_by': p_creator_id, 'title': p_title})
+            for user_id in dict.fromkeys([p_creator_id] + list(p_participant_ids)):
+                self._insert_row(self.tables['conversation_participants'],
+                                 {'conversation_id': conversation['id'], 'user_id': user_id})
+            message = None
+            if p_content is not None:
+                message = self._insert_row(self.tables['messages'], {
+                    'conversation_id': conversation['id'], 'sender_id': p_creator_id, 'content': p_content
+                })
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return {'conversation_id': conversation['id'], 'message': message}
+
+    def _search_messages(self, conn, p_user_id, p_query, p_limit=20, p_offset=0):
+        """search_messages() from chat_schema.sql, over the messages_search FTS5 index"""
+        # Every word has to match, like websearch_to_tsquery() without operators
+        terms = re.findall(r'\w+', p_query.lower())
+        if not terms:
+            return []
+        rows = conn.execute(
+            "SELECT m.id, m.conversation_id, m.sender_id, p.name AS sender_name, m.created_at, "
+            "-bm25(messages_search) AS rank, "
+            "snippet(messages_search, 0, char(2), char(3), ' ... ', 25) AS snippet "
+            "FROM messages_search "
+            "JOIN messages m ON m.rowid = messages_search.rowid "
+            "JOIN conversation_participants cp ON cp.conversation_id = m.conversation_id AND cp.user_id = ? "
+            "LEFT JOIN profiles p ON p.id = m.sender_id "
+            "WHERE messages_search MATCH ? AND NOT coalesce(m.is_deleted, 0) "
+            "ORDER BY bm25(messages_search), m.created_at DESC, m.id LIMIT ? OFFSET ?",
+            [p_user_id, ' '.join(f'"{term}"' for term in terms), p_limit, p_offset]).fetchall()
+        return [dict(row) for row in rows]
+
+    def _insert_row(self, table, row):
+        now = utc_now()
+        values = {}
+        for name, column in table['columns'].items():
+            if name in row:
+                values[name] = self._encode(column, row[name])
+            elif column['default'] is not None:
+                kind, value = column['default']
+                if kind == 'uuid':
+                    values[name] = str(uuid.uuid4())
+                elif kind == 'now':
+                    values[name] = now
+                elif kind == 'today':
+                    values[name] = datetime.date.today().isoformat()
+                else:
+                    values[name] = self._encode(column, value)
+        unknown = set(row) - set(table['columns'])
+        if unknown:
+            raise APIError({'message': f"Could not find the '{sorted(unknown)[0]}' column of '{table['name']}' in the schema cache",
+                            'code': 'PGRST204'})
+
+        columns = list(values)
+        sql = (f"INSERT INTO {quote_identifier(table['name'])} ({', '.join(quote_identifier(c) for c in columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)}) RETURNING *")
+        return self._decode(table, self._conn.execute(sql, [values[c] for c in columns]).fetchone())
+
+    def _update_rows(self, table, changes, filters):
+        unknown = set(changes) - set(table['columns'])
+        if unknown:
+            raise APIError({'message': f"Could not find the '{sorted(unknown)[0]}' column of '{table['name']}' in the schema cache",
+                            'code': 'PGRST204'})
+        if not changes:
+            return []
+        assignments = ', '.join(f"{quote_identifier(column)} = ?" for column in changes)
+        values = [self._encode(table['columns'][column], value) for column, value in changes.items()]
+        where_sql, params = self._where(table, filters)
+        sql = f"UPDATE {quote_identifier(table['name'])} SET {assignments}{where_sql} RETURNING *"
+        return [self._decode(table, row) for row in self._conn.execute(sql, values + params)]
+
+    def _where(self, table, filters):
+        return compile_where(self._convert_filters(table, filters), placeholder='?')
+
+    def _convert_filters(self, table, filters):
+        """Check filter columns and encode their values the way they are stored"""
+        converted = []
+        for column, operator, value, negate in filters:
+            if operator in LOGIC_OPERATORS:
+                converted.append((column, operator, self._convert_filters(table, value), negate))
+                continue
+            if column not in table['columns']:
+                raise UnsupportedQuery(f"filter on {table['name']}.{column}")
+            definition = table['columns'][column]
+            if operator == 'in':
+                value = [self._encode(definition, item) for item in value]
+            elif operator != 'is':
+                value = self._encode(definition, value)
+            converted.append((column, operator, value, negate))
+        return converted
+
+    def _order_term(self, table, term):
+        column, desc, nullsfirst = term
+        if column not in table['columns']:
+            raise UnsupportedQuery(f"order by {table['name']}.{column}")
+        # Postgres puts NULLs last in ascending order and first in descending order
+        if nullsfirst is None:
+            nullsfirst = desc
+        return f"{quote_identifier(column)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nullsfirst else 'LAST'}"
+
+    def _limit_sql(self, query):
+        if query['limit'] is None and not query['offset']:
+            return ''
+        sql = f" LIMIT {int(query['limit']) if query['limit'] is not None else -1}"
+        if query['offset']:
+            sql += f" OFFSET {int(query['offset'])}"
+        return sql
+
+    def _encode(self, column, value):
+        if value is None:
+            return None
+        if column['kind'] == 'boolean':
+            if isinstance(value, str):
+                return 1 if value.lower() in ('true', 't', '1') else 0
+            return 1 if value else 0
+        if column['kind'] == 'json':
+            return value if isinstance(value, str) else json.dumps(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return value
+
+    def _decode(self, table, row):
+        data = dict(row)
+        for name, value in data.items():
+            if value is None:
+                continue
+            kind = table['columns'][name]['kind']
+            if kind == 'boolean':
+                data[name] = bool(value)
+            elif kind == 'json':
+                try:
+                    data[name] = json.loads(value)
+                except (TypeError, ValueError):
+                    pass
+        return data
+
+    # Embedded resources
+
+    def _parse_select(self, columns):
+        items = []
+        for part in split_top_level(' '.join(columns.split())):
+            match = _EMBED.match(part.replace(' ', ''))
+            if match:
+                hints = [hint for hint in match.group(3).split('!') if hint]
+                items.append({
+                    'type': 'embed',
+                    'alias': match.group(1) or match.group(2),
+                    'table': match.group(2),
+                    'inner': 'inner' in hints,
+                    'hint': next((hint for hint in hints if hint not in ('inner', 'left')), None),
+                    'items': self._parse_select(match.group(4)),
+                })
+            elif part == '*':
+                items.append({'type': 'star'})
+            else:
+                alias, _, name = part.rpartition(':')
+                name = name.split('::')[0]
+                items.append({'type': 'column', 'name': name, 'alias': alias or name})
+        return items or [{'type': 'star'}]
+
+    def _relation(self, parent, embed):
+        """Find how embed['table'] joins to parent: ('one'|'many', parent_column, child_column)"""
+        target = embed['table']
+        if target not in self.tables:
+            raise APIError({'message': f"Could not find a relationship between '{parent['name']}' and '{target}'", 'code': 'PGRST200'})
+        child = self.tables[target]
+        hint = embed['hint']
+
+        candidates = []
+        for name, (column, referenced, referenced_column) in parent['foreign_keys'].items():
+            if referenced == target and (hint is None or hint in (name, column)):
+                candidates.append(('one', column, referenced_column))
+        for name, (column, referenced, referenced_column) in child['foreign_keys'].items():
+            if referenced == parent['name'] and (hint is None or hint in (name, column)):
+                candidates.append(('many', referenced_column, column))
+
+        if not candidates:
+            raise APIError({'message': f"Could not find a relationship between '{parent['name']}' and '{target}'", 'code': 'PGRST200'})
+        if len(candidates) > 1:
+            raise APIError({'message': f"Could not embed because more than one relationship was found for '{parent['name']}' and '{target}'",
+                            'code': 'PGRST201'})
+        return candidates[0]
+
+    def _embed(self, table, rows, items):
+        for item in items:
+            if item['type'] != 'embed' or not rows:
+                continue
+            child = self.tables.get(item['table'])
+            cardinality, parent_column, child_column = self._relation(table, item)
+            keys = list({row[parent_column] for row in rows if row.get(parent_column) is not None})
+
+            related = {}
+            if keys:
+                sql = (f"SELECT * FROM {quote_identifier(child['name'])} "
+                       f"WHERE {quote_identifier(child_column)} IN ({', '.join('?' for _ in keys)})")
+                children = [self._decode(child, row) for row in self._conn.execute(sql, keys)]
+                children = self._embed(child, children, item['items'])
+                for child_row in children:
+                    related.setdefault(child_row[child_column], []).append(self._project(child_row, item['items']))
+
+            kept = []
+            for row in rows:
+                matches = related.get(row.get(parent_column), [])
+                if cardinality == 'one':
+                    row['__embed__' + item['alias']] = matches[0] if matches else None
+                else:
+                    row['__embed__' + item['alias']] = matches
+                if not item['inner'] or matches:
+                    kept.append(row)
+            rows = kept
+        return rows
+
+    def _project(self, row, items):
+        result = {}
+        for item in items:
+            if item['type'] == 'star':
+                result.update({key: value for key, value in row.items() if not key.startswith('__embed__')})
+            elif item['type'] == 'column':
+                if item['name'] not in row:
+                    raise APIError({'message': f"column {item['name']} does not exist", 'code': '42703'})
+                result[item['alias']] = row[item['name']]
+            else:
+                result[item['alias']] = row.get('__embed__' + item['alias'])
+        return result
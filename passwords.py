@@ -0,0 +1,131 @@
+"""
+Password hashing on a pool of worker processes.
+
+scrypt/PBKDF2 hold the GIL for tens to hundreds of milliseconds, which stalls
+every other request thread in the worker. hash_password() and
+verify_password() run werkzeug's generate_password_hash/check_password_hash
+in a bounded ProcessPoolExecutor instead, so the calling thread only waits on
+a future.
+
+PASSWORD_HASH_METHOD is any werkzeug method string (default "scrypt", e.g.
+"scrypt:65536:8:1" or "pbkdf2:sha256:1000000") and PASSWORD_HASH_WORKERS the
+pool size (0 hashes on the calling thread). At most PASSWORD_HASH_MAX_PENDING
+hashes are queued or running at once; beyond that, and when a hash times out,
+HashingBusy is raised straight away so that a login burst fails fast instead of
+queueing work nobody waits for. needs_rehash() tells login when a stored hash was made with other
+parameters, so it can be upgraded while the plaintext is at hand.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+# Read by start_pool(), after the app has loaded .env
+HASH_METHOD = 'scrypt'
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+# Hashes are a few hundred milliseconds at most; anything slower means the pool is stuck
+HASH_TIMEOUT = 10.0
+# Queued plus running hashes; a few per process keeps every process busy without a backlog
+HASH_MAX_PENDING = 4 * HASH_WORKERS
+
+_pool = None
+_pending = None
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(RuntimeError):
+    """The hashing pool is saturated or too slow; the user should simply try again"""
+
+    def __init__(self, message='The server is busy signing other people in. Please try again in a moment.'):
+        super().__init__(message)
+
+
+def start_pool():
+    """Start the hashing processes.
+
+    Called while the web worker is still single-threaded: on POSIX the pool
+    forks, and forking before the app's background threads exist keeps the
+    children free of their locks (and avoids re-importing the app the way
+    spawn would).
+    """
+    global _pool, _pending, HASH_METHOD, HASH_WORKERS, HASH_TIMEOUT, HASH_MAX_PENDING
+    with _pool_lock:
+        HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', HASH_METHOD)
+        HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(HASH_WORKERS)))
+        HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', str(HASH_TIMEOUT)))
+        HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', str(4 * max(HASH_WORKERS, 1))))
+        if _pending is None:
+            _pending = threading.BoundedSemaphore(HASH_MAX_PENDING)
+        if _pool is None and HASH_WORKERS > 0:
+            method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(HASH_WORKERS, mp_context=multiprocessing.get_context(method))
+            # With fork every process is started by the first submit
+            _pool.submit(int).result()
+    return _pool
+
+
+def _run(fn, *args):
+    global _pool
+    if HASH_WORKERS <= 0:
+        # PASSWORD_HASH_WORKERS=0, read by start_pool(): hash on the calling thread
+        return fn(*args)
+    pool = _pool or start_pool()
+    if pool is None:
+        return fn(*args)
+    if not _pending.acquire(blocking=False):
+        logger.warning("Password hashing pool is saturated (%s pending), rejecting", HASH_MAX_PENDING)
+        raise HashingBusy()
+    try:
+        try:
+            future = pool.submit(fn, *args)
+        except BaseException:
+            _pending.release()
+            raise
+        # The slot is freed when the hash finishes or is cancelled, not when we stop waiting for it
+        future.add_done_callback(lambda _: _pending.release())
+        return future.result(timeout=HASH_TIMEOUT)
+    except TimeoutError:
+        # Drop it if it hasn't started; a running hash can't be stopped but still holds its slot
+        future.cancel()
+        logger.error("Password hashing took longer than %ss", HASH_TIMEOUT)
+        raise HashingBusy()
+    except BrokenProcessPool:
+        # A hashing process died; hash inline this time and build a new pool for the next call
+        logger.error("Password hashing pool is broken, restarting it")
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return fn(*args)
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    if not password_hash or not password:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def method_prefix():
+    """The "method:params" part of hashes made with the configured method, as werkzeug fills it in"""
+    method, *args = HASH_METHOD.split(':')
+    if method == 'scrypt' and not args:
+        args = [str(2 ** 15), '8', '1']
+    elif method == 'pbkdf2':
+        args = (args or ['sha256'])[:2]
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join([method, *args])
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != method_prefix()
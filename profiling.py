@@ -0,0 +1,140 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+A fraction of requests (PROFILE_SAMPLE_RATE) is run under cProfile, as is any
+request whose X-Profile-Token header matches PROFILE_TOKEN. When a profiled
+request takes longer than PROFILE_THRESHOLD_MS its stats are written to
+PROFILE_DIR as <id>.prof (loadable with pstats or snakeviz) next to <id>.json
+holding the endpoint, path and timing. Only the newest PROFILE_KEEP profiles
+are kept. list_profiles() and profile_report() back the admin profiles page.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_ID = re.compile(r'^[\w.-]+$')
+SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+
+class RequestProfiler:
+    """Flask extension that profiles sampled requests and keeps the slow ones"""
+
+    def __init__(self, app=None):
+        self.sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+        self.token = os.getenv('PROFILE_TOKEN')
+        self.threshold_ms = float(os.getenv('PROFILE_THRESHOLD_MS', '500'))
+        self.directory = os.getenv('PROFILE_DIR', 'profiles')
+        self.keep = int(os.getenv('PROFILE_KEEP', '100'))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.extensions['profiler'] = self
+
+    def should_profile(self):
+        if self.token and request.headers.get(PROFILE_HEADER) == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before_request(self):
+        if not self.should_profile():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter
+            return
+        g.profile = profile
+        g.profile_started = time.perf_counter()
+
+    def _after_request(self, response):
+        if 'profile' in g:
+            g.profile_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        duration_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        try:
+            self.save(profile, duration_ms, g.pop('profile_status', 500))
+        except Exception as e:
+            logger.error("Error saving request profile: %s", e)
+
+    def save(self, profile, duration_ms, status):
+        """Write a profile and its metadata, then drop the oldest beyond PROFILE_KEEP"""
+        os.makedirs(self.directory, exist_ok=True)
+        now = datetime.now(timezone.utc)
+        endpoint = request.endpoint or 'unmatched'
+        profile_id = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{endpoint}"
+        profile.dump_stats(os.path.join(self.directory, f'{profile_id}.prof'))
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w') as meta_file:
+            json.dump({
+                'id': profile_id,
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': status,
+                'duration_ms': round(duration_ms, 1),
+                'recorded_at': now.isoformat(),
+            }, meta_file)
+        self.prune()
+
+    def prune(self):
+        ids = sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.json'))
+        for profile_id in ids[:-self.keep] if self.keep > 0 else []:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self, limit=50):
+        """Metadata of the saved profiles, slowest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as meta_file:
+                    profiles.append(json.load(meta_file))
+            except (OSError, ValueError):
+                continue
+        profiles.sort(key=lambda profile: profile.get('duration_ms', 0), reverse=True)
+        return profiles[:limit]
+
+    def profile_report(self, profile_id, sort='cumulative', limit=60):
+        """pstats text for one saved profile, or None if it does not exist"""
+        if not PROFILE_ID.match(profile_id):
+            return None
+        if sort not in SORT_KEYS:
+            sort = 'cumulative'
+        path = os.path.join(self.directory, f'{profile_id}.prof')
+        if not os.path.exists(path):
+            return None
+        stream = io.StringIO()
+        pstats.Stats(path, stream=stream).strip_dirs().sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
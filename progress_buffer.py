@@ -0,0 +1,108 @@
+"""
+Write-behind buffer for task view tracking.
+
+Opening a task records an "in_progress" row in the progress table. Instead of
+writing that row on the request thread, views are collected here and
+batch-upserted in the background with ON CONFLICT DO NOTHING semantics.
+"""
+
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressViewBuffer:
+    """Collect first-view progress rows and upsert them in batches"""
+
+    def __init__(self, clients, flush_interval=5.0, max_batch=500):
+        self.clients = clients
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background flusher and flush once more on shutdown"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='progress-view-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher and write out anything still pending"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def record_view(self, student_id, course_id, module_id, task_id):
+        """Queue an in_progress row for a student's first view of a task"""
+        key = (str(student_id), str(task_id))
+        with self._lock:
+            self._pending.setdefault(key, {
+                'student_id': student_id,
+                'course_id': course_id,
+                'module_id': module_id,
+                'task_id': task_id,
+                'status': 'in_progress'
+            })
+            pending_count = len(self._pending)
+
+        if pending_count >= self.max_batch:
+            self._wakeup.set()
+
+    def discard(self, student_id, task_id):
+        """Drop a queued view, e.g. when the caller writes the progress row itself"""
+        with self._lock:
+            return self._pending.pop((str(student_id), str(task_id)), None) is not None
+
+    def pending(self):
+        """Number of views waiting to be written"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Upsert every queued view in batches of max_batch rows"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending = self._pending
+            self._pending = {}
+
+        rows = list(pending.values())
+        written = 0
+        for start in range(0, len(rows), self.max_batch):
+            batch = rows[start:start + self.max_batch]
+            try:
+                self._write(batch)
+                written += len(batch)
+            except Exception as e:
+                logger.error("Error flushing progress views: %s", e)
+                # Put the unwritten rows back without clobbering newer entries
+                with self._lock:
+                    for row in rows[start:]:
+                        self._pending.setdefault((str(row['student_id']), str(row['task_id'])), row)
+                break
+        return written
+
+    def _write(self, rows):
+        with self.clients.checkout() as client:
+            client.table('progress').upsert(
+                rows,
+                on_conflict='student_id,task_id',
+                ignore_duplicates=True,
+                default_to_null=False
+            ).execute()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
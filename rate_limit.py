@@ -0,0 +1,240 @@
+"""
+Token-bucket rate limiting for the authentication routes.
+
+Each rule is a bucket of `capacity` tokens refilled evenly over `period`
+seconds, kept per client IP and per submitted email address. A POST spends
+one token from every bucket it falls in; when one is empty the request gets a
+429 with Retry-After instead of reaching the (expensive) password hashing or
+OTP generation. GET requests are never limited.
+
+Bucket state lives in a backend picked from a URL like the token store:
+memory:// (per process), sqlite:///path (shared by the workers on the host,
+updated in an IMMEDIATE transaction) or redis:// (shared, updated by a Lua
+script). If the backend fails the request is let through rather than locking
+everyone out of login.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlparse
+
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+
+class Rule:
+    """Bucket of `capacity` tokens per key, refilled over `period` seconds"""
+
+    def __init__(self, scope, capacity, period):
+        self.scope = scope
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / float(period)
+
+    @classmethod
+    def parse(cls, scope, value):
+        """Parse "capacity/period", e.g. "10/300" for 10 attempts per 5 minutes"""
+        capacity, period = value.split('/', 1)
+        return cls(scope, int(capacity), float(period))
+
+
+def refill(tokens, updated_at, now, rule):
+    """Token-bucket step: returns (tokens left, retry after seconds or 0 if allowed)"""
+    if tokens is None:
+        tokens = rule.capacity
+    else:
+        tokens = min(rule.capacity, tokens + (now - updated_at) * rule.rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, max(1, math.ceil((1 - tokens) / rule.rate))
+
+
+class MemoryBuckets:
+    # Buckets idle this long have refilled completely and can be dropped; set from the rules
+    idle_after = 3600
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rule):
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (None, now))
+            tokens, retry_after = refill(tokens, updated_at, now, rule)
+            if len(self._buckets) >= self.max_keys and key not in self._buckets:
+                self._sweep_locked(now)
+            self._buckets[key] = (tokens, now)
+        return retry_after
+
+    def sweep(self, now=None):
+        # Called from the sweeper thread while request threads take() from the same dict
+        with self._lock:
+            self._sweep_locked(now or time.time())
+
+    def _sweep_locked(self, now):
+        idle = [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > self.idle_after]
+        for key in idle:
+            del self._buckets[key]
+
+
+class SQLiteBuckets:
+    idle_after = 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute('CREATE TABLE IF NOT EXISTS rate_limit_buckets ('
+                                   'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rule):
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (key,)).fetchone()
+            tokens, retry_after = refill(row[0] if row else None, row[1] if row else now, now, rule)
+            conn.execute('INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                         'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+
+    def sweep(self, now=None):
+        self._connection().execute('DELETE FROM rate_limit_buckets WHERE updated_at < ?',
+                                   ((now or time.time()) - self.idle_after,))
+
+
+# KEYS[1] bucket; ARGV capacity, rate, now. Returns retry-after seconds, 0 if allowed
+REDIS_TAKE = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = capacity
+else
+  tokens = math.min(capacity, tokens + (now - tonumber(state[2])) * rate)
+end
+local retry_after = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  retry_after = math.max(1, math.ceil((1 - tokens) / rate))
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return retry_after
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// rate limit store needs the redis package: pip install redis")
+        self._take = redis.Redis.from_url(url).register_script(REDIS_TAKE)
+
+    def take(self, key, rule):
+        return int(self._take(keys=[f'ratelimit:{key}'], args=[rule.capacity, rule.rate, time.time()]))
+
+    def sweep(self, now=None):
+        pass
+
+
+def create_buckets(url):
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        return MemoryBuckets()
+    if parsed.scheme == 'sqlite':
+        if not parsed.path[1:]:
+            raise ValueError("A sqlite:/// rate limit store needs a file path so that workers can share it")
+        return SQLiteBuckets(parsed.path[1:])
+    if parsed.scheme in ('redis', 'rediss'):
+        return RedisBuckets(url)
+    raise ValueError(f"Unsupported rate limit store URL: {url}")
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def submitted_email():
+    email = request.form.get('email') or (request.view_args or {}).get('email')
+    return email.strip().lower() if email else None
+
+
+class RateLimiter:
+    """Per-IP and per-email token buckets applied with the @limited decorator"""
+
+    def __init__(self, buckets, ip_rule, email_rule, enabled=True, sweep_interval=600.0):
+        self.buckets = buckets
+        self.rules = [(ip_rule, client_ip), (email_rule, submitted_email)]
+        buckets.idle_after = max(ip_rule.period, email_rule.period)
+        self.enabled = enabled
+        # Called as observer(endpoint, scope) for every rejected request
+        self.observers = []
+        if enabled and sweep_interval:
+            threading.Thread(target=self._sweep_forever, args=(sweep_interval,), name='rate-limit-sweeper',
+                             daemon=True).start()
+
+    def check(self):
+        """Spend a token from each bucket; returns (scope, retry after) for the first empty one"""
+        for rule, key_func in self.rules:
+            key = key_func()
+            if not key:
+                continue
+            try:
+                retry_after = self.buckets.take(f'{request.endpoint}:{rule.scope}:{key}', rule)
+            except Exception as e:
+                logger.error("Rate limit backend failed, allowing request: %s", e)
+                return None
+            if retry_after:
+                return rule.scope, retry_after
+        return None
+
+    def limited(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self.enabled or request.method != 'POST':
+                return f(*args, **kwargs)
+            rejected = self.check()
+            if rejected is None:
+                return f(*args, **kwargs)
+            scope, retry_after = rejected
+            logger.warning("Rate limited %s by %s", request.endpoint, scope,
+                           extra={'ip': client_ip(), 'retry_after': retry_after})
+            for observer in self.observers:
+                observer(request.endpoint, scope)
+            message = f'Too many attempts. Please try again in {retry_after} seconds.'
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                response = jsonify({'success': False, 'message': message})
+            else:
+                response = message
+            return response, 429, {'Retry-After': str(retry_after)}
+        return decorated_function
+
+    def _sweep_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.buckets.sweep()
+            except Exception as e:
+                logger.error("Error sweeping rate limit buckets: %s", e)
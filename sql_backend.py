@@ -0,0 +1,355 @@
+"""
+Direct SQL reads for the Supabase query builder.
+
+Routes build queries with the supabase-py builder API
+(supabase.table(...).select(...).eq(...).execute()). RecordingQuery captures
+that chain and parse_query()/compile_select() turn plain reads into SQL.
+HybridClient sends reads on a few hot tables straight to Postgres through a
+pooled driver connection and hands everything else (writes, embedded selects,
+rpc, auth) to PostgREST exactly as before, so route code does not change.
+"""
+
+import datetime
+import decimal
+import re
+import threading
+import uuid
+
+from postgrest import APIResponse
+
+FILTER_OPERATORS = {
+    'eq': '=',
+    'neq': '<>',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'like': 'LIKE',
+    'ilike': 'ILIKE',
+    'in': 'IN',
+    'is': 'IS',
+}
+
+# or_() condition groups; parsed into (None, 'or'|'and', [filters], negate)
+LOGIC_OPERATORS = {'and': ' AND ', 'or': ' OR '}
+
+WRITE_ACTIONS = ('insert', 'update', 'upsert', 'delete')
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class UnsupportedQuery(Exception):
+    """Raised when a builder chain cannot be compiled to plain SQL"""
+
+
+class RecordingQuery:
+    """Stand-in for a postgrest request builder that records the call chain"""
+
+    def __init__(self, client, table):
+        self._client = client
+        self.table = table
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        # not_ is a property on the real builder, everything else is a method
+        if name == 'not_':
+            self.calls.append((name, None, None))
+            return self
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return record
+
+    def replay(self, builder):
+        """Apply the recorded chain to a real request builder"""
+        for name, args, kwargs in self.calls:
+            if args is None:
+                builder = getattr(builder, name)
+            else:
+                builder = getattr(builder, name)(*args, **kwargs)
+        return builder
+
+    def execute(self):
+        return self._client._execute(self)
+
+
+def parse_query(table, calls):
+    """Turn a recorded builder chain into a query description"""
+    query = {
+        'table': table,
+        'action': 'select',
+        'columns': '*',
+        'count': None,
+        'payload': None,
+        'options': {},
+        'filters': [],
+        'order': [],
+        'limit': None,
+        'offset': None,
+        'single': None,
+    }
+    negate = False
+
+    for name, args, kwargs in calls:
+        if name == 'not_':
+            negate = True
+            continue
+
+        if name == 'select':
+            query['columns'] = ','.join(args) if args else '*'
+            query['count'] = kwargs.get('count')
+        elif name in WRITE_ACTIONS:
+            query['action'] = name
+            query['payload'] = args[0] if args else kwargs.get('json')
+            query['options'] = dict(kwargs)
+            query['count'] = kwargs.get('count')
+        elif name == 'in_':
+            query['filters'].append((args[0], 'in', list(args[1]), negate))
+            negate = False
+        elif name == 'or_':
+            if args[1:] or kwargs.get('reference_table'):
+                raise UnsupportedQuery("or_ on an embedded resource")
+            query['filters'].append((None, 'or', parse_conditions(args[0]), negate))
+            negate = False
+        elif name.rstrip('_') in FILTER_OPERATORS:
+            query['filters'].append((args[0], name.rstrip('_'), args[1], negate))
+            negate = False
+        elif name == 'filter':
+            column, operator, value = args
+            if operator.startswith('not.'):
+                negate, operator = True, operator[4:]
+            if operator not in FILTER_OPERATORS:
+                raise UnsupportedQuery(f"filter operator {operator}")
+            if operator == 'in' and isinstance(value, str):
+                value = [item.strip().strip('"') for item in value.strip('()').split(',') if item.strip()]
+            query['filters'].append((column, operator, value, negate))
+            negate = False
+        elif name == 'order':
+            if set(kwargs) - {'desc', 'nullsfirst'}:
+                raise UnsupportedQuery(f"order options {sorted(kwargs)}")
+            query['order'].append((args[0], bool(kwargs.get('desc', False)), kwargs.get('nullsfirst')))
+        elif name == 'limit':
+            query['limit'] = int(args[0])
+        elif name == 'range':
+            query['offset'] = int(args[0])
+            query['limit'] = int(args[1]) - int(args[0]) + 1
+        elif name in ('single', 'maybe_single'):
+            query['single'] = name
+        else:
+            raise UnsupportedQuery(name)
+
+    return query
+
+
+def split_conditions(text):
+    """Split a PostgREST condition list on commas outside parentheses and double quotes"""
+    parts = []
+    depth = 0
+    quoted = False
+    current = []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+
+def parse_conditions(text):
+    """Parse the argument of or_(), e.g. "created_at.lt.X,and(created_at.eq.X,id.lt.Y)", into filters"""
+    filters = []
+    for part in split_conditions(text):
+        negate = False
+        if part.startswith('not.'):
+            negate, part = True, part[4:]
+        group = re.match(r'^(and|or)\((.*)\)$', part, re.S)
+        if group:
+            filters.append((None, group.group(1), parse_conditions(group.group(2)), negate))
+            continue
+        try:
+            column, operator, value = part.split('.', 2)
+        except ValueError:
+            raise UnsupportedQuery(f"condition {part!r}")
+        if operator == 'not':
+            negate = not negate
+            operator, value = value.split('.', 1)
+        if operator not in FILTER_OPERATORS:
+            raise UnsupportedQuery(f"filter operator {operator}")
+        if operator == 'in':
+            value = [item.strip().strip('"') for item in value.strip('()').split(',') if item.strip()]
+        elif len(value) > 1 and value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        filters.append((column, operator, value, negate))
+    return filters
+
+
+def quote_identifier(name):
+    """Quote a column or table name, refusing anything that is not a plain identifier"""
+    if not _IDENTIFIER.match(name):
+        raise UnsupportedQuery(f"identifier {name!r}")
+    return f'"{name}"'
+
+
+def select_columns(columns):
+    """Split a PostgREST column list, refusing embedded resources and renames"""
+    names = [column.strip() for column in columns.split(',') if column.strip()]
+    if not names or names == ['*']:
+        return None
+    if any(not _IDENTIFIER.match(name) for name in names):
+        raise UnsupportedQuery(f"columns {columns!r}")
+    return names
+
+
+def compile_conditions(filters, placeholder='%s'):
+    """Compile parsed filters into a list of SQL conditions and their parameters"""
+    clauses = []
+    params = []
+    for column, operator, value, negate in filters:
+        if operator in LOGIC_OPERATORS:
+            if not value:
+                raise UnsupportedQuery(f"empty {operator}()")
+            group_clauses, group_params = compile_conditions(value, placeholder)
+            clause = '(' + LOGIC_OPERATORS[operator].join(group_clauses) + ')'
+            params.extend(group_params)
+            clauses.append(f"NOT {clause}" if negate else clause)
+            continue
+        column_sql = quote_identifier(column)
+        if operator == 'is':
+            if value is None or str(value).lower() == 'null':
+                clause = f"{column_sql} IS NULL"
+            elif str(value).lower() in ('true', 'false'):
+                clause = f"{column_sql} IS {str(value).upper()}"
+            else:
+                raise UnsupportedQuery(f"is.{value}")
+        elif operator == 'in':
+            values = list(value)
+            if not values:
+                clause = '1 = 0'
+            else:
+                clause = f"{column_sql} IN ({', '.join([placeholder] * len(values))})"
+                params.extend(values)
+        else:
+            clause = f"{column_sql} {FILTER_OPERATORS[operator]} {placeholder}"
+            params.append(value)
+        clauses.append(f"NOT ({clause})" if negate else clause)
+    return clauses, params
+
+
+def compile_where(filters, placeholder='%s'):
+    """Compile parsed filters into a WHERE clause and its parameters"""
+    clauses, params = compile_conditions(filters, placeholder)
+    if not clauses:
+        return '', params
+    return ' WHERE ' + ' AND '.join(clauses), params
+
+
+def compile_select(query, placeholder='%s'):
+    """Compile a parsed plain read into (sql, params)"""
+    if query['action'] != 'select' or query['count'] or query['single']:
+        raise UnsupportedQuery(query['action'])
+
+    columns = select_columns(query['columns'])
+    columns_sql = '*' if columns is None else ', '.join(quote_identifier(column) for column in columns)
+    where_sql, params = compile_where(query['filters'], placeholder)
+
+    sql = f"SELECT {columns_sql} FROM {quote_identifier(query['table'])}{where_sql}"
+    if query['order']:
+        parts = []
+        for column, desc, nullsfirst in query['order']:
+            part = f"{quote_identifier(column)} {'DESC' if desc else 'ASC'}"
+            if nullsfirst is not None:
+                part += ' NULLS FIRST' if nullsfirst else ' NULLS LAST'
+            parts.append(part)
+        sql += ' ORDER BY ' + ', '.join(parts)
+    if query['limit'] is not None:
+        sql += f" LIMIT {int(query['limit'])}"
+    if query['offset']:
+        sql += f" OFFSET {int(query['offset'])}"
+    return sql, params
+
+
+def to_json_value(value):
+    """Convert a driver value to what PostgREST would have returned in JSON"""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+class PostgresReadBackend:
+    """Run compiled reads on Postgres through a psycopg2 connection pool"""
+
+    def __init__(self, dsn, minconn=1, maxconn=10):
+        try:
+            from psycopg2.extras import RealDictCursor
+            from psycopg2.pool import ThreadedConnectionPool
+        except ImportError:
+            raise RuntimeError("DATA_BACKEND=postgres needs psycopg2 (pip install psycopg2-binary)")
+
+        if not dsn:
+            raise RuntimeError("DATA_BACKEND=postgres needs DATABASE_URL to be set")
+
+        self._cursor_factory = RealDictCursor
+        self._pool = ThreadedConnectionPool(minconn, maxconn, dsn)
+        # ThreadedConnectionPool raises instead of waiting when it is exhausted
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def fetch(self, sql, params):
+        """Run a read and return the rows as JSON-ready dicts"""
+        with self._slots:
+            conn = self._pool.getconn()
+            try:
+                if not conn.autocommit:
+                    conn.set_session(readonly=True, autocommit=True)
+                with conn.cursor(cursor_factory=self._cursor_factory) as cursor:
+                    cursor.execute(sql, params)
+                    rows = cursor.fetchall()
+            except Exception:
+                self._pool.putconn(conn, close=conn.closed != 0)
+                raise
+            self._pool.putconn(conn)
+        return [{key: to_json_value(value) for key, value in row.items()} for row in rows]
+
+    def close(self):
+        self._pool.closeall()
+
+
+class HybridClient:
+    """Supabase client wrapper that serves plain reads on chosen tables from Postgres"""
+
+    def __init__(self, client, backend, tables):
+        self.client = client
+        self.backend = backend
+        self.tables = {table.strip() for table in tables if table.strip()}
+
+    def table(self, table_name):
+        if table_name in self.tables:
+            return RecordingQuery(self, table_name)
+        return self.client.table(table_name)
+
+    from_ = table
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _execute(self, recorded):
+        try:
+            sql, params = compile_select(parse_query(recorded.table, recorded.calls))
+        except UnsupportedQuery:
+            return recorded.replay(self.client.table(recorded.table)).execute()
+        return APIResponse(data=self.backend.fetch(sql, params), count=None)
@@ -0,0 +1,57 @@
+// Live badge and list updates from the /events Server-Sent Events stream.
+// Pages listen for "lms:notification", "lms:message" and "lms:read" on document to update their own lists.
+document.addEventListener('DOMContentLoaded', function() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    function bumpBadges(name) {
+        document.querySelectorAll(`[data-badge="${name}"]`).forEach(badge => {
+            badge.textContent = (parseInt(badge.textContent, 10) || 0) + 1;
+            badge.classList.remove('hidden');
+        });
+    }
+
+    // The server turns streams away with a 503 when its threads are taken; EventSource does not retry
+    // those by itself, so reconnect after a delay that grows while the server stays busy
+    const retryDelays = [30000, 60000, 120000, 300000];
+    let failures = 0;
+
+    function connect() {
+        const source = new EventSource('/events');
+
+        source.addEventListener('open', function() {
+            failures = 0;
+        });
+
+        source.addEventListener('error', function() {
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, retryDelays[Math.min(failures, retryDelays.length - 1)]);
+                failures += 1;
+            }
+        });
+
+        source.addEventListener('notification', function(e) {
+            const notification = JSON.parse(e.data);
+            bumpBadges('notifications');
+            document.dispatchEvent(new CustomEvent('lms:notification', { detail: notification }));
+        });
+
+        source.addEventListener('message', function(e) {
+            const message = JSON.parse(e.data);
+            // The open conversation marks its own messages as read
+            const openConversation = document.getElementById('messagesContainer');
+            if (!openConversation || openConversation.dataset.conversationId !== message.conversation_id) {
+                bumpBadges('messages');
+            }
+            document.dispatchEvent(new CustomEvent('lms:message', { detail: message }));
+        });
+
+        // The other participants have read this user's messages up to read_through
+        source.addEventListener('read', function(e) {
+            document.dispatchEvent(new CustomEvent('lms:read', { detail: JSON.parse(e.data) }));
+        });
+    }
+
+    connect();
+});
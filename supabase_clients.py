@@ -0,0 +1,136 @@
+"""
+Supabase client helpers.
+
+Privileged writes go through a small pool of service-role clients instead of
+toggling row level security with the disable_rls_for_admin/enable_rls_for_admin
+functions, which run ALTER TABLE and lock every table they touch.
+
+All clients of a worker share one httpx connection pool, so keep-alive
+connections (and their TLS sessions) are reused across threads instead of
+every client opening its own. Pool limits, keep-alive, HTTP/2 and timeouts
+are read from the environment, see http_settings_from_env().
+"""
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+import httpx
+from supabase import create_client
+from supabase.lib.client_options import SyncClientOptions
+
+_call_timeout = threading.local()
+
+
+def http_settings_from_env():
+    """Read the HTTP pool settings for the Supabase clients from the environment"""
+    return {
+        'max_connections': int(os.getenv('SUPABASE_POOL_MAX_CONNECTIONS', '64')),
+        'max_keepalive_connections': int(os.getenv('SUPABASE_POOL_MAX_KEEPALIVE', '32')),
+        'keepalive_expiry': float(os.getenv('SUPABASE_KEEPALIVE_EXPIRY', '60')),
+        'http2': os.getenv('SUPABASE_HTTP2', 'false').lower() in ('1', 'true', 'yes', 'on'),
+        'timeout': float(os.getenv('SUPABASE_TIMEOUT', '10')),
+        'connect_timeout': float(os.getenv('SUPABASE_CONNECT_TIMEOUT', '5')),
+        'pool_timeout': float(os.getenv('SUPABASE_POOL_TIMEOUT', '5')),
+    }
+
+
+def create_http_client(settings=None):
+    """Create the shared httpx client used by every Supabase client of this worker"""
+    settings = settings or http_settings_from_env()
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings['max_connections'],
+            max_keepalive_connections=settings['max_keepalive_connections'],
+            keepalive_expiry=settings['keepalive_expiry'],
+        ),
+        timeout=httpx.Timeout(
+            settings['timeout'],
+            connect=settings['connect_timeout'],
+            pool=settings['pool_timeout'],
+        ),
+        http2=settings['http2'],
+        follow_redirects=True,
+        event_hooks={'request': [_apply_call_timeout]},
+    )
+
+
+def create_supabase_client(supabase_url, key, http_client=None):
+    """Create a Supabase client that sends its requests through http_client"""
+    options = SyncClientOptions(httpx_client=http_client or create_http_client())
+    return create_client(supabase_url, key, options=options)
+
+
+def create_service_client(supabase_url, service_key, http_client=None):
+    """Create a client authenticated with the service-role key (bypasses RLS)"""
+    return create_supabase_client(supabase_url, service_key, http_client=http_client)
+
+
+@contextmanager
+def call_timeout(seconds):
+    """Override the HTTP timeout for Supabase calls made by this thread inside the block"""
+    previous = getattr(_call_timeout, 'value', None)
+    _call_timeout.value = httpx.Timeout(seconds)
+    try:
+        yield
+    finally:
+        _call_timeout.value = previous
+
+
+def _apply_call_timeout(request):
+    timeout = getattr(_call_timeout, 'value', None)
+    if timeout is not None:
+        request.extensions['timeout'] = timeout.as_dict()
+
+
+class ClientPool:
+    """Fixed-size pool of Supabase clients handed out with checkout()"""
+
+    def __init__(self, factory, size=4):
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def local(self):
+        """Return the client bound to the current thread, creating it on first use"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.factory()
+        return client
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        """Borrow a client for the duration of a with-block"""
+        client = self._acquire(timeout)
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No Supabase client available after {timeout} seconds")
@@ -0,0 +1,72 @@
+"""
+Task completion against the progress view buffer, on the offline backend.
+
+A first view may sit in another worker's buffer (or be in flight in the
+background flusher) when the task is completed; writing it afterwards must not
+undo the completion.
+"""
+
+import os
+import uuid
+
+os.environ.setdefault('DATA_BACKEND', 'offline')
+
+import pytest
+
+import app as lms
+from progress_buffer import ProgressViewBuffer
+
+
+@pytest.fixture
+def enrolled_task():
+    client = lms.service_clients
+    with client.checkout() as sb:
+        student_id = str(uuid.uuid4())
+        sb.table('profiles').insert({'id': student_id, 'email': f'{student_id[:8]}@example.com',
+                                     'name': 'Student', 'role': 'student'}).execute()
+        course_id = sb.table('courses').insert({'title': 'Course', 'description': 'Course', 'level': 'Beginner',
+                                                'duration': '1 week'}).execute().data[0]['id']
+        module_id = sb.table('modules').insert({'course_id': course_id, 'title': 'Module',
+                                                'order_index': 1}).execute().data[0]['id']
+        task_id = sb.table('tasks').insert({'module_id': module_id, 'type': 'reading', 'title': 'Task',
+                                            'order_index': 1}).execute().data[0]['id']
+        sb.table('enrollments').insert({'student_id': student_id, 'course_id': course_id}).execute()
+    return student_id, course_id, module_id, task_id
+
+
+def complete(student_id, course_id, module_id, task_id):
+    client = lms.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = student_id
+        session['role'] = 'student'
+    response = client.post(f'/course/{course_id}/module/{module_id}/task/{task_id}/complete')
+    assert response.status_code == 302
+
+
+def progress_rows(student_id, task_id):
+    with lms.service_clients.checkout() as sb:
+        return sb.table('progress').select('status, completion_percentage').eq(
+            'student_id', student_id).eq('task_id', task_id).execute().data
+
+
+def test_completion_survives_view_buffered_in_another_worker(enrolled_task):
+    student_id, course_id, module_id, task_id = enrolled_task
+    other_worker = ProgressViewBuffer(lms.service_clients)
+    other_worker.record_view(student_id, course_id, module_id, task_id)
+
+    complete(student_id, course_id, module_id, task_id)
+    other_worker.flush()
+
+    assert [row['status'] for row in progress_rows(student_id, task_id)] == ['completed']
+
+
+def test_completion_after_view_was_written(enrolled_task):
+    student_id, course_id, module_id, task_id = enrolled_task
+    lms.progress_view_buffer.record_view(student_id, course_id, module_id, task_id)
+    lms.progress_view_buffer.flush()
+
+    complete(student_id, course_id, module_id, task_id)
+
+    rows = progress_rows(student_id, task_id)
+    assert [row['status'] for row in rows] == ['completed']
+    assert float(rows[0]['completion_percentage']) == 100
@@ -0,0 +1,234 @@
+"""
+Key-value stores with per-entry expiry, used for OTPs and password reset codes.
+
+create_store() picks the implementation from a URL (TOKEN_STORE_URL):
+
+    memory://                 per-process dict; fine for a single worker
+    sqlite:///path/tokens.db  shared by every worker on the host
+    redis://host:6379/0       shared across hosts (needs `pip install redis`)
+
+Values are JSON-serialisable dicts and are copied in and out, so changing an
+entry means set()-ing it again. Expired entries are never returned and are
+removed by a background sweeper; the memory and SQLite stores also evict the
+oldest entries beyond max_entries so a flood of signups can't grow them
+without bound.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class TTLStore:
+    """Dict-like interface shared by the store implementations"""
+
+    def __init__(self, default_ttl=600, max_entries=10000):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._sweeper = None
+        self._stopped = threading.Event()
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def start_sweeper(self, interval=60.0):
+        """Remove expired entries every interval seconds on a daemon thread"""
+        if self._sweeper is not None or not interval:
+            return
+
+        def run():
+            while not self._stopped.wait(interval):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error("Error sweeping expired tokens: %s", e)
+
+        self._sweeper = threading.Thread(target=run, name=f'{type(self).__name__}-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def sweep(self):
+        return 0
+
+
+class MemoryTTLStore(TTLStore):
+    """In-process store; entries are kept in insertion order so the oldest are evicted first"""
+
+    def __init__(self, default_ttl=600, max_entries=10000):
+        super().__init__(default_ttl, max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return default
+            return json.loads(entry[1])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl or self.default_ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires_at, json.dumps(value))
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[0] <= time.time():
+            return default
+        return json.loads(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class SQLiteTTLStore(TTLStore):
+    """Store in a SQLite file so every worker process on the host sees the same entries"""
+
+    def __init__(self, path, namespace, default_ttl=600, max_entries=10000):
+        super().__init__(default_ttl, max_entries)
+        self.path = path
+        self.namespace = namespace
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS ttl_store ('
+                         'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                         'expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))')
+            conn.execute('CREATE INDEX IF NOT EXISTS ttl_store_expires_at ON ttl_store (namespace, expires_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            'SELECT value FROM ttl_store WHERE namespace = ? AND key = ? AND expires_at > ?',
+            (self.namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value, ttl=None):
+        conn = self._connection()
+        conn.execute(
+            'INSERT INTO ttl_store (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at',
+            (self.namespace, key, json.dumps(value), time.time() + (ttl or self.default_ttl))
+        )
+        if not self.max_entries:
+            return
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            conn.execute(
+                'DELETE FROM ttl_store WHERE namespace = ? AND key IN ('
+                'SELECT key FROM ttl_store WHERE namespace = ? ORDER BY expires_at LIMIT ?)',
+                (self.namespace, self.namespace, excess)
+            )
+
+    def pop(self, key, default=None):
+        row = self._connection().execute(
+            'DELETE FROM ttl_store WHERE namespace = ? AND key = ? RETURNING value, expires_at',
+            (self.namespace, key)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return default
+        return json.loads(row[0])
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM ttl_store WHERE namespace = ? AND expires_at > ?', (self.namespace, time.time())
+        ).fetchone()[0]
+
+    def sweep(self):
+        return self._connection().execute(
+            'DELETE FROM ttl_store WHERE namespace = ? AND expires_at <= ?', (self.namespace, time.time())
+        ).rowcount
+
+
+class RedisTTLStore(TTLStore):
+    """Store in Redis (or anything speaking its protocol); Redis expires the keys itself"""
+
+    def __init__(self, url, namespace, default_ttl=600, max_entries=10000):
+        super().__init__(default_ttl, max_entries)
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("A redis:// token store needs the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = f'{namespace}:'
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else default
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl or self.default_ttl))
+
+    def pop(self, key, default=None):
+        pipeline = self.client.pipeline()
+        pipeline.get(self.prefix + key)
+        pipeline.delete(self.prefix + key)
+        value, _ = pipeline.execute()
+        return json.loads(value) if value is not None else default
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000))
+
+    def start_sweeper(self, interval=60.0):
+        pass
+
+
+def create_store(url, namespace, default_ttl=600, max_entries=10000, sweep_interval=60.0):
+    """Build a store from a memory://, sqlite:/// or redis:// URL and start its sweeper"""
+    parsed = urlparse(url or 'memory://')
+    if parsed.scheme == 'memory':
+        store = MemoryTTLStore(default_ttl, max_entries)
+    elif parsed.scheme == 'sqlite':
+        # sqlite:///tokens.db is relative to the working directory, sqlite:////var/lms/tokens.db absolute
+        path = parsed.path[1:]
+        if not path:
+            raise ValueError("A sqlite:/// token store needs a file path so that workers can share it")
+        store = SQLiteTTLStore(path, namespace, default_ttl, max_entries)
+    elif parsed.scheme in ('redis', 'rediss'):
+        store = RedisTTLStore(url, namespace, default_ttl, max_entries)
+    else:
+        raise ValueError(f"Unsupported token store URL: {url}")
+    store.start_sweeper(sweep_interval)
+    return store
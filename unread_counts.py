@@ -0,0 +1,89 @@
+"""
+Per-user cache for the unread badges shown on every page.
+
+The badges are filled in by a context processor, i.e. on every
+render_template call. UnreadCountCache keeps each user's count in memory for
+`ttl` seconds, so a page view is a dict lookup and the backend is asked at most
+once per user per TTL window (concurrent misses for the same user wait for a
+single load). Writers call invalidate() when a count changes, so the user who
+caused the change sees it on their next page. The cache is per process: other
+workers pick the change up when their entry expires.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadCountCache:
+    """TTL cache of load(user_id) results with single-flight loads and invalidation"""
+
+    def __init__(self, name, load, ttl=30.0, max_entries=10000, load_timeout=5.0):
+        self.name = name
+        self.load = load
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.load_timeout = load_timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            flight = self._loading.get(user_id)
+            leader = flight is None
+            if leader:
+                flight = self._loading[user_id] = threading.Event()
+
+        if not leader:
+            # Someone else is already loading this user's count
+            flight.wait(self.load_timeout)
+            return getattr(flight, 'value', entry[1] if entry is not None else 0)
+
+        try:
+            value = self.load(user_id)
+        except Exception as e:
+            logger.error("Error loading %s count: %s", self.name, e)
+            # Keep serving the last known count (or 0) until the next window instead of retrying every page
+            value = entry[1] if entry is not None else 0
+
+        with self._lock:
+            # An invalidate() during the load dropped our flight; don't cache what may be stale
+            if self._loading.get(user_id) is flight:
+                del self._loading[user_id]
+                self._entries.pop(user_id, None)
+                self._entries[user_id] = (time.monotonic() + self.ttl, value)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        flight.value = value
+        flight.set()
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+            self._loading.pop(str(user_id), None)
+
+    def invalidate_many(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(str(user_id), None)
+                self._loading.pop(str(user_id), None)
+
+    def stats(self):
+        """(hits, misses), for Metrics.register_cache"""
+        return self.hits, self.misses
+
+    def __len__(self):
+        return len(self._entries)
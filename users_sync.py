@@ -0,0 +1,104 @@
+"""
+Background reconciliation of the users table with profiles.
+
+Every profile should have a matching users row. Signup upserts it right away;
+this job catches anything that slipped through (failed signup writes, users
+created by admins or imported directly) by walking profiles in id order and
+bulk-upserting the missing rows with ON CONFLICT DO NOTHING, so running it
+from several workers at once is harmless.
+"""
+
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def user_row(profile):
+    """users row for a profile"""
+    now = datetime.utcnow().isoformat()
+    return {
+        'id': str(profile['id']),
+        'email': profile['email'],
+        'full_name': profile.get('name', ''),
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+class UsersSync:
+    """Periodically upsert users rows for profiles that don't have one"""
+
+    def __init__(self, clients, interval=3600.0, batch_size=500):
+        self.clients = clients
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Run once shortly after startup and then every interval seconds"""
+        if self._thread is not None or not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name='users-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run_once(self):
+        """Reconcile every profile; returns the number of users rows written"""
+        written = 0
+        last_id = None
+        with self.clients.checkout() as client:
+            while True:
+                query = client.table('profiles').select('id, email, name').order('id').limit(self.batch_size)
+                if last_id is not None:
+                    query = query.gt('id', last_id)
+                profiles = query.execute().data or []
+                if not profiles:
+                    break
+                last_id = profiles[-1]['id']
+
+                ids = [profile['id'] for profile in profiles]
+                existing = client.table('users').select('id').in_('id', ids).execute().data or []
+                existing_ids = {str(row['id']) for row in existing}
+                missing = [user_row(profile) for profile in profiles
+                           if str(profile['id']) not in existing_ids and profile.get('email')]
+                written += self._upsert(client, missing)
+
+                if len(profiles) < self.batch_size:
+                    break
+        return written
+
+    def _upsert(self, client, rows):
+        if not rows:
+            return 0
+        try:
+            client.table('users').upsert(rows, on_conflict='id', ignore_duplicates=True).execute()
+            return len(rows)
+        except Exception as e:
+            # One bad row (e.g. an email already taken by another users row) fails the whole
+            # batch; retry row by row so the rest still get written
+            logger.warning("Bulk users upsert failed, retrying row by row: %s", e)
+        written = 0
+        for row in rows:
+            try:
+                client.table('users').upsert(row, on_conflict='id', ignore_duplicates=True).execute()
+                written += 1
+            except Exception as e:
+                logger.error("Error syncing user %s to users table: %s", row['id'], e)
+        return written
+
+    def _run(self):
+        # First pass shortly after startup, then every interval
+        delay = min(30.0, self.interval)
+        while not self._stopped.wait(delay):
+            try:
+                written = self.run_once()
+                if written:
+                    logger.info("Synced %d missing users rows", written)
+            except Exception as e:
+                logger.error("Error reconciling users table: %s", e)
+            delay = self.interval